@@ -2,6 +2,6 @@
 
 SNARP=$(dirname $0)/../snarp.py
 
-echo arecord -D hw:0,0 -r 8000 |\
-	python $SNARP --silence-min 120 --silence-max 135 output.wav
+arecord -D hw:0,0 -t raw -f S16_LE -c 1 -r 8000 |\
+	python $SNARP --raw-format S16_LE --raw-channels 1 --raw-rate 8000 output.wav
 
@@ -2,6 +2,6 @@
 
 SNARP=$(dirname $0)/../snarp.py
 
-arecord -D front:CARD=Podcaster,DEV=0 -r 48000 -f S24_3LE |\
-	python $SNARP --silence-min -1500000 --silence-max 1500000 output.wav
+arecord -D front:CARD=Podcaster,DEV=0 -t raw -f S24_3LE -c 1 -r 48000 |\
+	python $SNARP --raw-format S24_3LE --raw-channels 1 --raw-rate 48000 output.wav
 
@@ -21,6 +21,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import bisect
 #logging.basicConfig(level=logging.DEBUG)
 logging.basicConfig(level=logging.INFO)
 
@@ -34,6 +35,25 @@ import contextlib
 import itertools
 import collections
 import math
+import array
+import threading
+import Queue
+import os
+import stat
+import errno
+import mmap
+import multiprocessing
+import json
+import hashlib
+import datetime
+import socket
+
+# NumPy is optional; sample decoding and chunk statistics are vectorized
+# with it when available and fall back to the array module otherwise
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 SILENCE_PRESET_LIMITS = {
     'conversational': (-15, -24),
@@ -44,19 +64,65 @@ SILENCE_PRESET_LIMITS = {
 # todo: remove global setting and pass in to remove_silences() explicitly?
 SILENCE_PEAK_LIMIT, SILENCE_IQR_LIMIT = SILENCE_PRESET_LIMITS['quiet']
 
+# How chunks are judged, one of DETECTORS. The rms and zcr detectors
+# compare the RMS level against SILENCE_RMS_LIMIT in dBFS, or against
+# SILENCE_IQR_LIMIT if that is None; zcr also takes chunks crossing zero
+# more than SILENCE_ZCR_LIMIT times per sample for noise.
+DETECTOR = 'peak-iqr'
+SILENCE_RMS_LIMIT = None
+SILENCE_ZCR_LIMIT = 0.35
+
 # Global vars for Wave format metadata
 # Usually these are fixed by the format (little, 8 bit -> unsigned, > 8 bit signed), 
 # but change these values to override
 INPUT_ENDIANNESS = 'little' # Wave format default
 INPUT_SIGNEDNESS = None # None means permit Wave format rules to prevail
 
+## Raw input
+#
+# With RAW_INPUT_FORMAT set to one of the ALSA sample format names in
+# RAW_FORMATS, input is headerless PCM as `arecord -t raw` writes it,
+# at RAW_INPUT_RATE frames per second with RAW_INPUT_CHANNELS channels,
+# rather than a wave file. It is read RAW_READ_CHUNKS chunks at a time
+# and converted to the wave conventions as it is read, so it is analyzed
+# and written like wave input. Use raw_input_format() to change these.
+#
+RAW_INPUT_FORMAT   = None
+RAW_INPUT_RATE     = 44100
+RAW_INPUT_CHANNELS = 1
+RAW_READ_CHUNKS    = 10
+
+# (sample width, signedness, endianness) by ALSA format name
+RAW_FORMATS = {
+    'S8': (1, 'signed', 'little'),
+    'U8': (1, 'unsigned', 'little'),
+    'S16_LE': (2, 'signed', 'little'),
+    'S16_BE': (2, 'signed', 'big'),
+    'U16_LE': (2, 'unsigned', 'little'),
+    'U16_BE': (2, 'unsigned', 'big'),
+    'S24_3LE': (3, 'signed', 'little'),
+    'S24_3BE': (3, 'signed', 'big'),
+    'U24_3LE': (3, 'unsigned', 'little'),
+    'U24_3BE': (3, 'unsigned', 'big'),
+    'S32_LE': (4, 'signed', 'little'),
+    'S32_BE': (4, 'signed', 'big'),
+    'U32_LE': (4, 'unsigned', 'little'),
+    'U32_BE': (4, 'unsigned', 'big'),
+}
+
 ## Noise detection timings
 #
 # Set the times, in milliseconds, to use for various noise detection 
 # parameters. Note that all times must be multiples of CHUNK_MS, since
 # all audio processing is done in blocks of length CHUNK_MS. 
+#
+# Each chunk is judged by the statistics of the last WINDOW_MS of audio.
+# By default that is the chunk itself; with a longer window, chunks are
+# hops of a sliding window, so decisions can be made more often without
+# basing them on less audio. Use analysis_timing() to change these.
 # 
 CHUNK_MS      = 100   # milliseconds per silence analysis period
+WINDOW_MS     = None  # milliseconds of audio analyzed per chunk, None for CHUNK_MS
 HYSTERESIS_MS = 1000 # ms of silence before we decide audible segment is over
 PRE_ROLL_MS   = 200  # ms of silence to play at beginning of audible segment
 POST_ROLL_MS  = 100  # ms of silence to play at end of audible segment
@@ -65,7 +131,166 @@ HYSTERESIS_CHUNKS = int(float(HYSTERESIS_MS) / CHUNK_MS)
 PRE_ROLL_CHUNKS   = int(float(PRE_ROLL_MS) / CHUNK_MS)
 POST_ROLL_CHUNKS  = int(float(POST_ROLL_MS) / CHUNK_MS)
 
+def window_chunks(chunk_ms=None, window_ms=None):
+    '''Return the analysis window length in chunks, by default from the globals'''
+    chunk_ms = CHUNK_MS if chunk_ms is None else chunk_ms
+    window_ms = WINDOW_MS if window_ms is None else window_ms
+    if window_ms is None:
+        return 1
+    return max(1, int(round(float(window_ms) / chunk_ms)))
+
+## Decimated analysis
+#
+# Silence detection doesn't need the full bandwidth of high rate input.
+# With ANALYSIS_DECIMATION above 1, chunks are analyzed in a reduced
+# form: in 'stride' mode only every ANALYSIS_DECIMATION-th frame is
+# decoded and analyzed, in 'envelope' mode the minimum and maximum of
+# every block of that many frames. Output is still written from the full
+# rate frames. Use analysis_decimation() to change these.
+#
+ANALYSIS_DECIMATION      = 1
+ANALYSIS_DECIMATION_MODE = 'stride'
+DECIMATION_MODES = ('stride', 'envelope')
+
+## Output buffering
+#
+# Frames for the output and bypass files are collected in memory and
+# written (and the wave header fixed up) only once FLUSH_BYTES are
+# buffered or FLUSH_SECONDS have passed. With WRITE_BEHIND, the writes
+# happen on a background thread.
+#
+FLUSH_BYTES   = 1 << 20
+FLUSH_SECONDS = 30.0
+WRITE_BEHIND  = False
+
+## Output files
+#
+# Output files are written by the wave module, which stops at 4 GB. With
+# OUTPUT_RF64 they are written by RF64WaveWriter instead, and become RF64
+# files once they outgrow plain wave files. With ROLL_BYTES or
+# ROLL_SECONDS set, output moves on to a new file whenever the current
+# one holds that many bytes or seconds of audio.
+#
+# With OUTPUT_STREAM set, output is instead a stream, e.g. to a pipe,
+# written chunk by chunk as soon as it is known to be audible: 'raw'
+# PCM, or 'wav' with a header that leaves the length open. Segment
+# events are written as lines of JSON to SEGMENT_EVENTS_OUTPUT, if set.
+#
+# With SPLIT_OUTPUT set, every audible segment is also written to a file
+# of its own, named after the SPLIT_OUTPUT template (see SegmentFiles),
+# by a pool of SPLIT_WRITERS threads.
+#
+OUTPUT_RF64  = False
+ROLL_BYTES   = None
+ROLL_SECONDS = None
+OUTPUT_STREAM = None
+SEGMENT_EVENTS_OUTPUT = None
+SPLIT_OUTPUT  = None
+SPLIT_WRITERS = 2
+
+# Regular input files are memory mapped this many bytes at a time
+MMAP_WINDOW_BYTES = 8 << 20
+
+## Analysis cache
+#
+# With ANALYSIS_CACHE_DIR set, the chunk stats of regular input files are
+# kept there, so re-running on the same file with other silence limits
+# or timings skips decoding. The cache holds at most ANALYSIS_CACHE_BYTES;
+# the least recently used entries are evicted first.
+#
+ANALYSIS_CACHE_DIR   = None
+ANALYSIS_CACHE_BYTES = 1 << 30
+
+## Live pipeline queues
+#
+# In live mode the input is read, analyzed and written by separate
+# threads. At most LIVE_QUEUE_CHUNKS chunks wait between two stages.
+# When analysis falls behind, the reader keeps reading and holds up to
+# LIVE_SPILL_CHUNKS more chunks itself before dropping the oldest.
+#
+LIVE_QUEUE_CHUNKS = 50
+LIVE_SPILL_CHUNKS = 600
+
+# Which channels decide whether a chunk is silent: 'any' (audible if any
+# channel is audible), 'all' (audible only if every channel is), 'mix'
+# (analyze the mixdown of all channels) or a channel index
+CHANNEL_POLICY = 'any'
+
+## Adaptive thresholds
+#
+# With ADAPTIVE_WINDOW_MS set, the silence limits follow the noise floor,
+# taken as the ADAPTIVE_QUANTILE level of the chunks in about the last
+# ADAPTIVE_WINDOW_MS. The limits are the floor plus ADAPTIVE_MARGIN_DB,
+# but never below the configured limits nor more than ADAPTIVE_MAX_RISE_DB
+# above them. Levels are in the same dBFS units as the limits.
+#
+ADAPTIVE_WINDOW_MS   = None # None disables adaptive thresholds
+ADAPTIVE_QUANTILE    = 0.1
+ADAPTIVE_MARGIN_DB   = 6.0
+ADAPTIVE_MAX_RISE_DB = 15.0
+ADAPTIVE_BLOCKS      = 4    # quantile estimates kept per window
+
 # Context managers for global Wave format overrides
+@contextlib.contextmanager
+def analysis_timing(chunk_ms, window_ms=None):
+    '''
+    Override CHUNK_MS and WINDOW_MS, converting the segment timings to chunks
+
+    HYSTERESIS_MS, PRE_ROLL_MS and POST_ROLL_MS are kept and rounded down
+    to whole chunks of the new length.
+    '''
+    global CHUNK_MS, WINDOW_MS, HYSTERESIS_CHUNKS, PRE_ROLL_CHUNKS, POST_ROLL_CHUNKS
+    old = CHUNK_MS, WINDOW_MS, HYSTERESIS_CHUNKS, PRE_ROLL_CHUNKS, POST_ROLL_CHUNKS
+    CHUNK_MS, WINDOW_MS = chunk_ms, window_ms
+    HYSTERESIS_CHUNKS = int(float(HYSTERESIS_MS) / CHUNK_MS)
+    PRE_ROLL_CHUNKS = int(float(PRE_ROLL_MS) / CHUNK_MS)
+    POST_ROLL_CHUNKS = int(float(POST_ROLL_MS) / CHUNK_MS)
+    try:
+        yield
+    finally:
+        CHUNK_MS, WINDOW_MS, HYSTERESIS_CHUNKS, PRE_ROLL_CHUNKS, POST_ROLL_CHUNKS = old
+
+@contextlib.contextmanager
+def analysis_decimation(factor, mode=None):
+    '''Override ANALYSIS_DECIMATION and, if given, ANALYSIS_DECIMATION_MODE'''
+    global ANALYSIS_DECIMATION, ANALYSIS_DECIMATION_MODE
+    old = ANALYSIS_DECIMATION, ANALYSIS_DECIMATION_MODE
+    if int(factor) != factor or factor < 1:
+        raise ValueError("Decimation must be a whole number of frames, got {0!r}".format(factor))
+    if mode is not None and mode not in DECIMATION_MODES:
+        raise ValueError("Unknown decimation mode {0!r}".format(mode))
+    ANALYSIS_DECIMATION = int(factor)
+    if mode is not None:
+        ANALYSIS_DECIMATION_MODE = mode
+    try:
+        yield
+    finally:
+        ANALYSIS_DECIMATION, ANALYSIS_DECIMATION_MODE = old
+
+@contextlib.contextmanager
+def raw_input_format(name, rate=None, channels=None, read_chunks=None):
+    '''
+    Override RAW_INPUT_FORMAT and, if given, RAW_INPUT_RATE,
+    RAW_INPUT_CHANNELS and RAW_READ_CHUNKS
+
+    A `name` of None reads wave files again.
+    '''
+    global RAW_INPUT_FORMAT, RAW_INPUT_RATE, RAW_INPUT_CHANNELS, RAW_READ_CHUNKS
+    old = RAW_INPUT_FORMAT, RAW_INPUT_RATE, RAW_INPUT_CHANNELS, RAW_READ_CHUNKS
+    if name is not None and name not in RAW_FORMATS:
+        raise ValueError("Unknown raw sample format {0!r}".format(name))
+    RAW_INPUT_FORMAT = name
+    if rate is not None:
+        RAW_INPUT_RATE = rate
+    if channels is not None:
+        RAW_INPUT_CHANNELS = channels
+    if read_chunks is not None:
+        RAW_READ_CHUNKS = read_chunks
+    try:
+        yield
+    finally:
+        RAW_INPUT_FORMAT, RAW_INPUT_RATE, RAW_INPUT_CHANNELS, RAW_READ_CHUNKS = old
+
 @contextlib.contextmanager
 def input_endianness(val):
     assert(val in ('little', 'big'))
@@ -84,6 +309,111 @@ def input_signedness(val):
     yield
     INPUT_SIGNEDNESS = previous
 
+@contextlib.contextmanager
+def channel_policy(val):
+    assert(val in ('any', 'all', 'mix') or isinstance(val, int))
+    global CHANNEL_POLICY
+    previous = CHANNEL_POLICY
+    CHANNEL_POLICY = val
+    yield
+    CHANNEL_POLICY = previous
+
+AdaptiveSettings = collections.namedtuple(
+    'AdaptiveSettings', 'window_chunks quantile margin_db max_rise_db'
+)
+
+def current_adaptive_settings():
+    '''Return AdaptiveSettings from the ADAPTIVE_* globals; window_chunks is None if disabled'''
+    return AdaptiveSettings(
+        None if ADAPTIVE_WINDOW_MS is None else max(1, int(ADAPTIVE_WINDOW_MS / CHUNK_MS)),
+        ADAPTIVE_QUANTILE,
+        ADAPTIVE_MARGIN_DB,
+        ADAPTIVE_MAX_RISE_DB
+    )
+
+@contextlib.contextmanager
+def adaptive_thresholds(window_ms, quantile=None, margin_db=None, max_rise_db=None):
+    '''Override the ADAPTIVE_* globals; a `window_ms` of None disables adaptation'''
+    global ADAPTIVE_WINDOW_MS, ADAPTIVE_QUANTILE, ADAPTIVE_MARGIN_DB, ADAPTIVE_MAX_RISE_DB
+    old = ADAPTIVE_WINDOW_MS, ADAPTIVE_QUANTILE, ADAPTIVE_MARGIN_DB, ADAPTIVE_MAX_RISE_DB
+    ADAPTIVE_WINDOW_MS = window_ms
+    if quantile is not None:
+        ADAPTIVE_QUANTILE = quantile
+    if margin_db is not None:
+        ADAPTIVE_MARGIN_DB = margin_db
+    if max_rise_db is not None:
+        ADAPTIVE_MAX_RISE_DB = max_rise_db
+    yield
+    ADAPTIVE_WINDOW_MS, ADAPTIVE_QUANTILE, ADAPTIVE_MARGIN_DB, ADAPTIVE_MAX_RISE_DB = old
+
+@contextlib.contextmanager
+def output_buffering(flush_bytes, flush_seconds, write_behind=False):
+    '''Override FLUSH_BYTES, FLUSH_SECONDS and WRITE_BEHIND globals.'''
+    global FLUSH_BYTES, FLUSH_SECONDS, WRITE_BEHIND
+    previous = FLUSH_BYTES, FLUSH_SECONDS, WRITE_BEHIND
+    FLUSH_BYTES, FLUSH_SECONDS, WRITE_BEHIND = flush_bytes, flush_seconds, write_behind
+    yield
+    FLUSH_BYTES, FLUSH_SECONDS, WRITE_BEHIND = previous
+
+@contextlib.contextmanager
+def analysis_cache(directory, max_bytes=None):
+    '''Override ANALYSIS_CACHE_DIR and, if given, ANALYSIS_CACHE_BYTES globals.'''
+    global ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_BYTES
+    previous = ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_BYTES
+    ANALYSIS_CACHE_DIR = directory
+    if max_bytes is not None:
+        ANALYSIS_CACHE_BYTES = max_bytes
+    yield
+    ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_BYTES = previous
+
+@contextlib.contextmanager
+def output_files(rf64, roll_bytes=None, roll_seconds=None):
+    '''Override OUTPUT_RF64, ROLL_BYTES and ROLL_SECONDS globals.'''
+    global OUTPUT_RF64, ROLL_BYTES, ROLL_SECONDS
+    previous = OUTPUT_RF64, ROLL_BYTES, ROLL_SECONDS
+    OUTPUT_RF64, ROLL_BYTES, ROLL_SECONDS = rf64, roll_bytes, roll_seconds
+    yield
+    OUTPUT_RF64, ROLL_BYTES, ROLL_SECONDS = previous
+
+@contextlib.contextmanager
+def output_stream(kind):
+    '''Override the OUTPUT_STREAM global, None, 'raw' or 'wav'.'''
+    global OUTPUT_STREAM
+    if kind not in (None, 'raw', 'wav'):
+        raise ValueError("Unknown output stream kind {0!r}".format(kind))
+    previous = OUTPUT_STREAM
+    OUTPUT_STREAM = kind
+    try:
+        yield
+    finally:
+        OUTPUT_STREAM = previous
+
+@contextlib.contextmanager
+def segment_events(output):
+    '''Override the SEGMENT_EVENTS_OUTPUT global, a file or None.'''
+    global SEGMENT_EVENTS_OUTPUT
+    previous = SEGMENT_EVENTS_OUTPUT
+    SEGMENT_EVENTS_OUTPUT = output
+    try:
+        yield
+    finally:
+        SEGMENT_EVENTS_OUTPUT = previous
+
+@contextlib.contextmanager
+def split_output(template, writers=None):
+    '''Override SPLIT_OUTPUT and, if given, SPLIT_WRITERS globals.'''
+    global SPLIT_OUTPUT, SPLIT_WRITERS
+    if writers is not None and writers < 1:
+        raise ValueError("Need at least one segment writer, not {0}".format(writers))
+    previous = SPLIT_OUTPUT, SPLIT_WRITERS
+    SPLIT_OUTPUT = template
+    if writers is not None:
+        SPLIT_WRITERS = writers
+    try:
+        yield
+    finally:
+        SPLIT_OUTPUT, SPLIT_WRITERS = previous
+
 @contextlib.contextmanager
 def silence_limits(peak, iqr):
     '''Override SILENCE_PEAK_LIMIT and SILENCE_IQR_LIMIT globals.'''
@@ -93,41 +423,955 @@ def silence_limits(peak, iqr):
     yield
     SILENCE_PEAK_LIMIT, SILENCE_IQR_LIMIT = old_peak, old_iqr
 
+@contextlib.contextmanager
+def chunk_detector(name, rms_limit=None, zcr_limit=None):
+    '''Override DETECTOR, SILENCE_RMS_LIMIT and, if given, SILENCE_ZCR_LIMIT globals.'''
+    global DETECTOR, SILENCE_RMS_LIMIT, SILENCE_ZCR_LIMIT
+    old = DETECTOR, SILENCE_RMS_LIMIT, SILENCE_ZCR_LIMIT
+    if name not in DETECTORS:
+        raise ValueError("Unknown detector {0!r}".format(name))
+    DETECTOR, SILENCE_RMS_LIMIT = name, rms_limit
+    if zcr_limit is not None:
+        SILENCE_ZCR_LIMIT = zcr_limit
+    yield
+    DETECTOR, SILENCE_RMS_LIMIT, SILENCE_ZCR_LIMIT = old
+
+# Binary stats files start with a header of magic, format version and the
+# input sample width in bytes, followed by one record of two little endian
+# doubles, the raw peak and IQR sample deltas, per chunk. Deltas of 32 bit
+# input reach 2 ** 32, too much for 32 bit integers; doubles hold them exactly.
+STATS_MAGIC = b'SNARPSTS'
+STATS_VERSION = 2
+STATS_HEADER = struct.Struct('<8sHH4x')
+STATS_RECORD_BYTES = 16
+# Records buffered before a write
+STATS_BLOCK_RECORDS = 4096
+
 # disabled by defaults stats writer
 push_stats = lambda *args, **kwargs: None
 @contextlib.contextmanager
-def stats_file(f):
-    '''Toggle statistics recording'''
+def stats_file(f, binary=None):
+    '''
+    Toggle statistics recording
+
+    Stats are written in the binary format unless `binary` is False or,
+    by default, `f` is named like a CSV file. CSV holds dBFS levels.
+    '''
     global push_stats
+    if binary is None:
+        name = f if isinstance(f, basestring) else getattr(f, 'name', '')
+        binary = not (isinstance(name, basestring) and name.lower().endswith('.csv'))
     if isinstance(f, basestring):
         f = open(f, "wb")
     def push_stats_record(peak_delta, iqr_delta, sample_width):
         if f:
-            f.write("{peak_delta},{iqr_delta}\n".format(
-                peak_delta=sample_delta_to_dbfs(peak_delta, sample_width),
-                iqr_delta=sample_delta_to_dbfs(iqr_delta, sample_width)
-            ))
+            f.write(stats_csv_line(peak_delta, iqr_delta, sample_width))
+    writer = None
     old = push_stats
-    if f:
+    if f and binary:
+        writer = BinaryStatsWriter(f)
+        push_stats = writer.push
+    elif f:
         push_stats = push_stats_record
     yield
     push_stats = old
     try:
+        if writer is not None:
+            writer.flush()
         f.close()
     except Exception:
         pass
 
+def stats_csv_line(peak_delta, iqr_delta, sample_width):
+    '''Return one line of a CSV stats file'''
+    return "{peak_delta},{iqr_delta}\n".format(
+        peak_delta=sample_delta_to_dbfs(peak_delta, sample_width),
+        iqr_delta=sample_delta_to_dbfs(iqr_delta, sample_width)
+    )
+
+class BinaryStatsWriter(object):
+    '''
+    Write chunk stats to file `f` in the binary stats format
+
+    Raw sample deltas are collected in an array and written out
+    `block_records` chunks at a time; nothing is converted to dBFS until
+    the file is read. The header is written along with the first block,
+    as the sample width is only known once a chunk has been analyzed.
+    '''
+    def __init__(self, f, block_records=STATS_BLOCK_RECORDS):
+        self.f = f
+        self.block_records = block_records
+        self.sample_width = None
+        self.header_written = False
+        self.records = array.array('d')
+
+    def push(self, peak_delta, iqr_delta, sample_width):
+        if self.sample_width is None:
+            self.sample_width = sample_width
+        elif sample_width != self.sample_width:
+            raise ValueError("Stats for {0} and {1} byte samples in one file".format(self.sample_width, sample_width))
+        self.records.append(float(peak_delta))
+        self.records.append(float(iqr_delta))
+        if len(self.records) >= 2 * self.block_records:
+            self.flush()
+
+    def flush(self):
+        '''Write out the buffered records'''
+        if self.sample_width is None:
+            return
+        if not self.header_written:
+            self.f.write(STATS_HEADER.pack(STATS_MAGIC, STATS_VERSION, self.sample_width))
+            self.header_written = True
+        if sys.byteorder != 'little':
+            self.records.byteswap()
+        self.f.write(self.records.tobytes() if hasattr(self.records, 'tobytes') else self.records.tostring())
+        del self.records[:]
+
+def read_stats_header(f):
+    '''
+    Read the header of binary stats file `f`; return the sample width
+
+    Raises ValueError if `f` is not a binary stats file.
+    '''
+    header = f.read(STATS_HEADER.size)
+    if len(header) < STATS_HEADER.size or not header.startswith(STATS_MAGIC):
+        raise ValueError("Not a binary stats file")
+    magic, version, sample_width = STATS_HEADER.unpack(header)
+    if version != STATS_VERSION:
+        raise ValueError("Unsupported stats file version {0}".format(version))
+    return sample_width
+
+def read_stats(f):
+    '''
+    Generator returning (peak_delta, iqr_delta, sample_width) for each
+    chunk recorded in binary stats file `f`
+    '''
+    sample_width = read_stats_header(f)
+    while True:
+        block = f.read(STATS_RECORD_BYTES * STATS_BLOCK_RECORDS)
+        if not block:
+            return
+        records = array.array('d', block)
+        if sys.byteorder != 'little':
+            records.byteswap()
+        for i in xrange(0, len(records), 2):
+            yield records[i], records[i + 1], sample_width
+
+@contextlib.contextmanager
+def stats_sink(func):
+    '''Call func(peak_delta, iqr_delta, sample_width) for every chunk analyzed'''
+    global push_stats
+    old = push_stats
+    push_stats = func
+    yield
+    push_stats = old
+
+# Upper bounds, in seconds, of the histogram buckets for stage timings
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Seconds between metrics exports
+METRICS_INTERVAL = 15.0
+
+class NullMetrics(object):
+    '''
+    Metrics that record nothing, used unless metrics are enabled
+
+    Call sites check `enabled` before doing work, such as reading the
+    clock, that only serves to produce a metric.
+    '''
+    enabled = False
+
+    def count(self, name, value=1, **labels):
+        '''Add `value` to a counter'''
+
+    def gauge(self, name, value, **labels):
+        '''Set a gauge to `value`'''
+
+    def observe(self, name, value, **labels):
+        '''Add an observation to a histogram'''
+
+    def close(self):
+        '''Export the final values and stop exporting'''
+
+class Metrics(NullMetrics):
+    '''
+    Counters, gauges and histograms, safe to update from any thread
+
+    Metrics are identified by name and labels. Histograms count
+    observations into `buckets`, given as upper bounds. Every `interval`
+    seconds, and once more on close, a `snapshot` is passed to the
+    export method of each of `exporters` from a background thread.
+    '''
+    enabled = True
+
+    def __init__(self, exporters=(), interval=None, buckets=METRICS_BUCKETS):
+        self.exporters = list(exporters)
+        self.interval = METRICS_INTERVAL if interval is None else interval
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.closed = threading.Event()
+        self.thread = None
+        if self.exporters:
+            self.thread = threading.Thread(target=self._export_periodically, name='snarp-metrics')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def count(self, name, value=1, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = metric_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # per-bucket counts with one for +Inf, sum, count
+                histogram = self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        '''
+        Return the current values as a JSON serializable dict
+
+        Metrics are keyed by name and labels as in the Prometheus text
+        format. Histogram bucket counts are cumulative, the last one
+        being the +Inf bucket.
+        '''
+        with self.lock:
+            histograms = {}
+            for key, (counts, total, count) in self.histograms.items():
+                cumulative = []
+                for bucket_count in counts:
+                    cumulative.append(bucket_count + (cumulative[-1] if cumulative else 0))
+                histograms[key] = {'buckets': cumulative, 'sum': total, 'count': count}
+            return {
+                'time': time.time(),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'buckets': list(self.buckets),
+                'histograms': histograms,
+            }
+
+    def export(self):
+        '''Pass a snapshot to every exporter now'''
+        snapshot = self.snapshot()
+        for exporter in self.exporters:
+            try:
+                exporter.export(snapshot)
+            except Exception:
+                # losing metrics must not take the recording down
+                logging.exception("Metrics export failed.")
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.export()
+        for exporter in self.exporters:
+            exporter.close()
+
+    def _export_periodically(self):
+        while not self.closed.wait(self.interval):
+            self.export()
+
+def metric_key(name, labels):
+    '''Return the Prometheus style key for metric `name` with `labels`'''
+    if not labels:
+        return name
+    return '{0}{{{1}}}'.format(name, ','.join(
+        '{0}="{1}"'.format(label, labels[label]) for label in sorted(labels)
+    ))
+
+def prometheus_text(snapshot):
+    '''Return a `Metrics` snapshot in the Prometheus text exposition format'''
+    lines = []
+    for kind, values in (('counter', snapshot['counters']), ('gauge', snapshot['gauges'])):
+        typed = set()
+        for key in sorted(values):
+            name = key.partition('{')[0]
+            if name not in typed:
+                lines.append('# TYPE {0} {1}'.format(name, kind))
+                typed.add(name)
+            lines.append('{0} {1}'.format(key, metric_value(values[key])))
+    typed = set()
+    for key in sorted(snapshot['histograms']):
+        histogram = snapshot['histograms'][key]
+        name, _, labels = key.partition('{')
+        labels = labels.rstrip('}')
+        if name not in typed:
+            lines.append('# TYPE {0} histogram'.format(name))
+            typed.add(name)
+        bounds = [metric_value(float(bound)) for bound in snapshot['buckets']] + ['+Inf']
+        for bound, count in zip(bounds, histogram['buckets']):
+            lines.append('{0}_bucket{{{1}le="{2}"}} {3}'.format(
+                name, labels + ',' if labels else '', bound, count
+            ))
+        suffix = '{{{0}}}'.format(labels) if labels else ''
+        lines.append('{0}_sum{1} {2}'.format(name, suffix, metric_value(histogram['sum'])))
+        lines.append('{0}_count{1} {2}'.format(name, suffix, histogram['count']))
+    return ''.join(line + '\n' for line in lines)
+
+def metric_value(value):
+    # repr keeps full float precision, str drops the L of Python 2 longs
+    return repr(value) if isinstance(value, float) else str(value)
+
+class PrometheusTextfileExporter(object):
+    '''
+    Rewrite `filename` with every snapshot in the Prometheus text format
+
+    The file is replaced atomically, as the node exporter's textfile
+    collector requires, so it is never scraped half written.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+
+    def export(self, snapshot):
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as f:
+            f.write(prometheus_text(snapshot))
+        os.rename(temp_filename, self.filename)
+
+    def close(self):
+        pass
+
+class JsonLinesExporter(object):
+    '''
+    Append every snapshot to `f`, a file or filename, as one line of JSON
+    '''
+    def __init__(self, f):
+        self.owned = isinstance(f, basestring)
+        self.f = open(f, 'a') if self.owned else f
+
+    def export(self, snapshot):
+        self.f.write(json.dumps(snapshot, sort_keys=True) + '\n')
+        self.f.flush()
+
+    def close(self):
+        if self.owned:
+            self.f.close()
+
+metrics = NullMetrics()
+@contextlib.contextmanager
+def metrics_sink(m):
+    '''Record metrics to `m` for the duration, then close it'''
+    global metrics
+    old = metrics
+    metrics = m
+    try:
+        yield
+    finally:
+        metrics = old
+        m.close()
+
+class ReadMeter(object):
+    '''
+    Record reads of `frame_rate` audio to the current metrics
+
+    The realtime factor is the duration of the audio read so far over the
+    wall time since the meter was created. For live input it drops below
+    1 when we fall behind the input.
+    '''
+    def __init__(self, frame_rate):
+        self.frame_rate = frame_rate
+        self.created = time.time()
+        self.seconds_read = 0.0
+
+    def start(self):
+        '''Return the start time to pass to `record`, None if metrics are off'''
+        return time.time() if metrics.enabled else None
+
+    def record(self, started, nframes):
+        '''Record reading (and decoding) `nframes` since `started`'''
+        if started is None:
+            return
+        metrics.observe('snarp_read_seconds', time.time() - started)
+        self.advance(nframes)
+
+    def advance(self, nframes):
+        '''Record `nframes` read without timing the read'''
+        if not metrics.enabled:
+            return
+        self.seconds_read += float(nframes) / self.frame_rate
+        metrics.count('snarp_input_frames_total', nframes)
+        elapsed = time.time() - self.created
+        if elapsed > 0:
+            metrics.gauge('snarp_realtime_factor', self.seconds_read / elapsed)
+
+class P2Quantile(object):
+    '''
+    Streaming estimate of quantile `p` in constant memory and time
+
+    Implements the P² algorithm (Jain and Chlamtac, 1985): five
+    markers track the minimum, the p/2, p and (1+p)/2 quantiles and the
+    maximum, and are moved by piecewise parabolic interpolation as values
+    arrive. Exact for up to five values.
+    '''
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, value):
+        self.count += 1
+        q = self.heights
+        if len(q) < 5:
+            bisect.insort(q, value)
+            return
+        if value < q[0]:
+            q[0] = value
+            k = 0
+        elif value >= q[4]:
+            q[4] = value
+            k = 3
+        else:
+            k = bisect.bisect_right(q, value) - 1
+        n = self.positions
+        for i in xrange(k + 1, 5):
+            n[i] += 1
+        for i in xrange(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    # parabola overshoots its neighbours, interpolate linearly
+                    height = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / float(n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / float(n[i + 1] - n[i]) +
+            (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / float(n[i] - n[i - 1])
+        )
+
+    def value(self):
+        '''Return the current estimate, None before any values'''
+        q = self.heights
+        if self.count > 5:
+            return q[2]
+        if not q:
+            return None
+        return q[int(round(self.p * (len(q) - 1)))]
+
+class NoiseFloor(object):
+    '''
+    Estimate the `quantile` level of about the last `window` values
+
+    The window is split into `blocks` blocks, each with its own
+    `P2Quantile`. The floor is the mean of the last `blocks` complete
+    block estimates, or the current block's estimate until one block is
+    complete, so memory and time per value stay constant however long
+    the stream runs.
+    '''
+    def __init__(self, window, quantile, blocks=None):
+        blocks = ADAPTIVE_BLOCKS if blocks is None else blocks
+        self.quantile = quantile
+        self.block_size = max(1, window // blocks)
+        self.estimates = collections.deque(maxlen=blocks)
+        self.current = P2Quantile(quantile)
+
+    def add(self, value):
+        self.current.add(value)
+        if self.current.count >= self.block_size:
+            self.estimates.append(self.current.value())
+            self.current = P2Quantile(self.quantile)
+
+    def value(self):
+        '''Return the floor estimate, None before any values'''
+        if self.estimates:
+            return sum(self.estimates) / len(self.estimates)
+        return self.current.value()
+
+class AdaptiveLimits(object):
+    '''
+    Silence limits, as sample deltas, that follow the noise floor
+
+    Starts at `silence_deltas` and follows the peak and IQR deltas passed
+    to `update` as described for ADAPTIVE_WINDOW_MS. `settings` are
+    AdaptiveSettings, by default from the globals.
+    '''
+    def __init__(self, silence_deltas, sample_width, settings=None):
+        settings = current_adaptive_settings() if settings is None else settings
+        self.full_scale = 2.0 ** (sample_width * 8)
+        self.base = [self._dbfs(delta) for delta in silence_deltas]
+        self.floors = [NoiseFloor(settings.window_chunks, settings.quantile) for delta in silence_deltas]
+        self.margin = settings.margin_db
+        self.max_rise = settings.max_rise_db
+        self.limits = tuple(silence_deltas)
+
+    def update(self, peak_delta, iqr_delta):
+        limits = []
+        for floor, base, delta, kind in zip(self.floors, self.base, (peak_delta, iqr_delta), ('peak', 'iqr')):
+            floor.add(self._dbfs(delta))
+            limit = min(max(floor.value() + self.margin, base), base + self.max_rise)
+            if metrics.enabled:
+                metrics.gauge('snarp_adaptive_limit_dbfs', limit, kind=kind)
+            limits.append(10.0 ** (limit / 10.0) * self.full_scale)
+        self.limits = tuple(limits)
+
+    def _dbfs(self, delta):
+        # as sample_delta_to_dbfs, without logging every chunk
+        return math.log10(max(delta, 1) / self.full_scale) * 10
+
 class NoiseFilter(object):
     def __init__(self):
         pass
 
-class RingBuffer(collections.deque):
-    def append(self, value):
-        discard = None
-        if len(self) == self.maxlen:
-            discard = self.popleft()
-        collections.deque.append(self, value)
-        return discard
+class ByteRingBuffer(object):
+    '''
+    Fixed size ring of chunk frames
+
+    Holds up to `maxlen` chunks in one preallocated bytearray. Chunk
+    frames are copied in by `append`; `popleft` hands the oldest chunks
+    back as memoryviews of the ring, one span or two where they wrap
+    around its end. The views are only valid until the next append.
+
+    Storage is allocated by the first append, for `maxlen` chunks of that
+    size, and only reallocated if a chunk doesn't fit, so long rolls
+    cost no allocations per chunk.
+    '''
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self.data = bytearray()
+        self.view = memoryview(self.data)
+        # chunk lengths, a ring of their own
+        self.lengths = array.array('L', [0]) * maxlen
+        self.first = 0
+        self.count = 0
+        # byte offset of the oldest chunk, and bytes held
+        self.start = 0
+        self.nbytes = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, frames):
+        '''Copy in a chunk of `frames`, which must not overfill the ring'''
+        if self.count == self.maxlen:
+            raise IndexError("append to a full ByteRingBuffer")
+        size = len(frames)
+        if self.nbytes + size > len(self.data):
+            self._grow(size)
+        if size:
+            end = (self.start + self.nbytes) % len(self.data)
+            head = min(size, len(self.data) - end)
+            if head == size:
+                self.view[end:end + size] = frames
+            else:
+                frames = memoryview(frames)
+                self.view[end:] = frames[:head]
+                self.view[:size - head] = frames[head:]
+        self.lengths[(self.first + self.count) % self.maxlen] = size
+        self.count += 1
+        self.nbytes += size
+
+    def popleft(self, count=1):
+        '''
+        Remove up to `count` of the oldest chunks
+
+        Returns a list of at most two memoryviews holding their frames.
+        '''
+        count = max(0, min(count, self.count))
+        size = 0
+        for i in xrange(count):
+            size += self.lengths[(self.first + i) % self.maxlen]
+        spans = self._spans(self.start, size)
+        self.first = (self.first + count) % max(1, self.maxlen)
+        self.count -= count
+        self.nbytes -= size
+        if self.count == 0:
+            # start over at the front, so the next chunks don't wrap
+            self.start = 0
+        else:
+            self.start = (self.start + size) % len(self.data)
+        return spans
+
+    def clear(self):
+        self.first = self.count = self.start = self.nbytes = 0
+
+    def _spans(self, start, size):
+        if size == 0:
+            return []
+        stop = start + size
+        if stop <= len(self.data):
+            return [self.view[start:stop]]
+        return [self.view[start:], self.view[:stop - len(self.data)]]
+
+    def _grow(self, size):
+        data = bytearray(max(self.maxlen * size, self.nbytes + size))
+        offset = 0
+        for span in self._spans(self.start, self.nbytes):
+            data[offset:offset + len(span)] = span
+            offset += len(span)
+        self.data = data
+        self.view = memoryview(data)
+        self.start = 0
+
+class BufferedWaveWriter(object):
+    '''
+    Coalesce many small frame writes into few large ones
+
+    Wraps a `wave` writer (or anything with writeframes and close). Frames
+    are collected in one contiguous buffer and handed to the wrapped
+    writer's writeframes, which also fixes up the header, only when
+    `flush_bytes` are buffered or `flush_seconds` have passed since the
+    last flush. Both are checked whenever frames are written, and a timer
+    thread flushes frames that are still buffered `flush_seconds` after
+    the last flush, e.g. when no more output comes during silence.
+
+    With `threaded`, flushed blocks are written by a background thread;
+    at most `queue_blocks` blocks wait to be written before writeframes
+    blocks. Errors raised by the background thread are re-raised by the
+    next call to writeframes, flush or close.
+
+    Write latencies and sizes are recorded to the metrics labelled with
+    `name`.
+    '''
+    def __init__(self, wave_writer, flush_bytes=None, flush_seconds=None, threaded=None, queue_blocks=4, name='output'):
+        self.wave_writer = wave_writer
+        self.name = name
+        self.flush_bytes = FLUSH_BYTES if flush_bytes is None else flush_bytes
+        self.flush_seconds = FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self.buffer = bytearray()
+        self.bytes_written = 0
+        self.last_flush = time.time()
+        self.error = None
+        self.queue = None
+        # the timer flushes from its own thread
+        self.lock = threading.RLock()
+        self.timer = None
+        if WRITE_BEHIND if threaded is None else threaded:
+            self.queue = Queue.Queue(maxsize=queue_blocks)
+            self.thread = threading.Thread(target=self._write_behind, name='snarp-writer')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def writeframes(self, frames):
+        with self.lock:
+            self._check_error()
+            self.bytes_written += len(frames)
+            if len(frames) >= self.flush_bytes:
+                # already big enough, skip the copy into our buffer
+                self.flush()
+                self._write(frames)
+                return
+            self.buffer += frames
+            if len(self.buffer) >= self.flush_bytes or \
+                time.time() - self.last_flush >= self.flush_seconds:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(
+                    self.last_flush + self.flush_seconds - time.time(), self._flush_on_time
+                )
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        '''Write out buffered frames'''
+        with self.lock:
+            self._check_error()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.last_flush = time.time()
+            if len(self.buffer) == 0:
+                return
+            self._write(self.buffer)
+            self.buffer = bytearray()
+
+    def close(self):
+        '''Flush, wait for pending background writes and close the wrapped writer'''
+        try:
+            self.flush()
+        finally:
+            if self.queue is not None:
+                self.queue.put(None)
+                self.thread.join()
+            self.wave_writer.close()
+        self._check_error()
+
+    def _flush_on_time(self):
+        with self.lock:
+            # errors wait for the next call from the writing thread
+            if self.error is None:
+                try:
+                    self.flush()
+                except Exception:
+                    self.error = sys.exc_info()
+
+    def _write(self, frames):
+        if self.queue is None:
+            self._write_block(frames)
+        else:
+            if frames is not self.buffer and not is_immutable(frames):
+                # the caller may reuse its buffer once we return
+                frames = bytearray(frames)
+            self.queue.put(frames)
+
+    def _write_behind(self):
+        while True:
+            block = self.queue.get()
+            if block is None:
+                return
+            if self.error is None:
+                try:
+                    self._write_block(block)
+                except Exception:
+                    # keep draining so writeframes never blocks forever
+                    self.error = sys.exc_info()
+
+    def _write_block(self, block):
+        started = time.time() if metrics.enabled else None
+        self.wave_writer.writeframes(block)
+        if started is not None:
+            metrics.observe('snarp_write_seconds', time.time() - started, writer=self.name)
+            metrics.count('snarp_written_bytes_total', len(block), writer=self.name)
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+def is_immutable(frames):
+    '''Return True if `frames` can be kept without copying'''
+    if isinstance(frames, memoryview):
+        return frames.readonly
+    return not isinstance(frames, bytearray)
+
+def data_view(obj, start, stop):
+    '''Return a zero-copy view of obj[start:stop]'''
+    try:
+        return memoryview(obj)[start:stop]
+    except TypeError:
+        # Python 2 mmap objects only support the old buffer protocol
+        return buffer(obj, start, stop - start)
+
+class MappedWaveData(object):
+    '''
+    Read-only memory map of the data chunk of a regular wave file
+
+    The file is mapped one window of about `window_bytes` at a time, so
+    that however big the file is, only the current window is resident.
+    Views handed out stay valid after the window moves on; the old
+    mapping is released once the last view of it is gone.
+    '''
+    def __init__(self, f, offset, size, window_bytes=None):
+        self.fileno = f.fileno()
+        self.offset = offset
+        self.size = size
+        self.window_bytes = MMAP_WINDOW_BYTES if window_bytes is None else window_bytes
+        self.window = None
+        self.window_start = self.window_stop = 0
+
+    @classmethod
+    def open(cls, f, frame_width, window_bytes=None):
+        '''
+        Map the wave file `f`, or return None if it is not a regular file
+        '''
+        try:
+            info = os.fstat(f.fileno())
+        except (AttributeError, ValueError, IOError, OSError):
+            return None
+        if not stat.S_ISREG(info.st_mode):
+            return None
+        offset, size = find_wave_data(f)
+        # don't trust the header past the end of the file
+        size = min(size, info.st_size - offset)
+        return cls(f, offset, size - size % frame_width, window_bytes)
+
+    def view(self, start, stop):
+        '''Return a view of data bytes [start, stop)'''
+        stop = min(stop, self.size)
+        if start < self.window_start or stop > self.window_stop:
+            self._map(start, stop)
+        return data_view(self.window, start - self.window_start, stop - self.window_start)
+
+    def views(self, start, stop):
+        '''Generate views of data bytes [start, stop), one window at a time'''
+        stop = min(stop, self.size)
+        while start < stop:
+            end = min(stop, start + self.window_bytes)
+            yield self.view(start, end)
+            start = end
+
+    def _map(self, start, stop):
+        granularity = mmap.ALLOCATIONGRANULARITY
+        file_start = (self.offset + start) // granularity * granularity
+        length = max(self.offset + stop - file_start, self.window_bytes)
+        length = min(length, self.offset + self.size - file_start)
+        self.window = mmap.mmap(self.fileno, length, access=mmap.ACCESS_READ, offset=file_start)
+        self.window_start = file_start - self.offset
+        self.window_stop = self.window_start + length
+
+def find_wave_data(f):
+    '''
+    Return (offset, size) in bytes of the data chunk of RIFF wave file `f`
+    '''
+    f.seek(0)
+    riff, riff_size, form = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or form != b'WAVE':
+        raise wave.Error('file does not start with RIFF/WAVE id')
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise wave.Error('data chunk missing')
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            return f.tell(), chunk_size
+        # chunks are padded to an even length
+        f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+class RawPcmReader(object):
+    '''
+    Reader of headerless PCM from `input_file`, with the interface of a
+    `wave` module reader
+
+    Input is read with `readinto` in blocks of `block_frames`, into two
+    preallocated buffers used in turn, so reading allocates nothing per
+    chunk. `readframes` returns memoryviews of these buffers; a view
+    stays valid until its buffer is refilled, that is for at least
+    `block_frames` more frames. Make block_frames a multiple of the
+    frames read at a time, so reads don't straddle blocks.
+
+    Samples are `signedness` ('signed' or 'unsigned') and `endianness`
+    ('little' or 'big') on input. Every block is converted in place to
+    what a wave file holds: little endian, unsigned for 8 bit samples
+    and signed for wider ones. With NumPy the conversion works on views
+    of the buffer and allocates nothing; without it, formats that need
+    converting allocate a copy of each block.
+
+    The frame count is not known in advance; `getnframes` returns the
+    number of frames read so far.
+    '''
+    def __init__(self, input_file, sample_width, nchannels, frame_rate, block_frames,
+            signedness='signed', endianness='little'):
+        self.file = input_file
+        self.sample_width = sample_width
+        self.nchannels = nchannels
+        self.frame_rate = frame_rate
+        self.frame_width = sample_width * nchannels
+        block_bytes = max(1, block_frames) * self.frame_width
+        self.buffers = [bytearray(block_bytes), bytearray(block_bytes)]
+        self.current = 0
+        self.start = self.stop = 0
+        self.frames_read = 0
+        self.eof = False
+        self.swap = sample_width > 1 and endianness != 'little'
+        self.flip_sign = (signedness == 'signed') != (sample_width > 1)
+
+    def getnchannels(self):
+        return self.nchannels
+
+    def getsampwidth(self):
+        return self.sample_width
+
+    def getframerate(self):
+        return self.frame_rate
+
+    def getnframes(self):
+        return self.frames_read
+
+    def getcomptype(self):
+        return 'NONE'
+
+    def getcompname(self):
+        return 'not compressed'
+
+    def getparams(self):
+        return (self.nchannels, self.sample_width, self.frame_rate, 0, 'NONE', 'not compressed')
+
+    def tell(self):
+        return self.frames_read
+
+    def readframes(self, nframes):
+        size = nframes * self.frame_width
+        if self.stop - self.start < size and not self.eof:
+            self._fill()
+        size = min(size, (self.stop - self.start) // self.frame_width * self.frame_width)
+        if size == 0:
+            return b''
+        frames = memoryview(self.buffers[self.current])[self.start:self.start + size]
+        self.start += size
+        self.frames_read += size // self.frame_width
+        return frames
+
+    def _fill(self):
+        # move on to the other buffer, carrying over what is left of this one
+        old, self.current = self.buffers[self.current], 1 - self.current
+        buf = self.buffers[self.current]
+        left = self.stop - self.start
+        buf[:left] = memoryview(old)[self.start:self.stop]
+        self.start, self.stop = 0, left
+        view = memoryview(buf)
+        while self.stop < len(buf):
+            count = self.file.readinto(view[self.stop:])
+            if not count:
+                self.eof = True
+                break
+            self.stop += count
+        self._convert(buf, left, self.stop - self.stop % self.frame_width)
+
+    def _convert(self, buf, start, stop):
+        # bring buf[start:stop] to the wave conventions, sample byte by sample byte
+        width = self.sample_width
+        if numpy is not None and (self.swap or self.flip_sign):
+            # one row of bytes per sample, a view of buf
+            samples = numpy.frombuffer(buf, numpy.uint8, stop - start, start).reshape(-1, width)
+            if self.swap:
+                for i in xrange(width // 2):
+                    # swap byte columns without a temporary
+                    low, high = samples[:, i], samples[:, width - 1 - i]
+                    numpy.bitwise_xor(low, high, out=low)
+                    numpy.bitwise_xor(high, low, out=high)
+                    numpy.bitwise_xor(low, high, out=low)
+            if self.flip_sign:
+                top = samples[:, width - 1]
+                numpy.bitwise_xor(top, 0x80, out=top)
+            return
+        if self.swap:
+            data = buf[start:stop]
+            for i in xrange(width):
+                buf[start + i:stop:width] = data[width - 1 - i::width]
+        if self.flip_sign:
+            # most significant byte of every (now little endian) sample
+            buf[start + width - 1:stop:width] = buf[start + width - 1:stop:width].translate(SIGN_FLIP_TABLE)
+
+    def close(self):
+        pass
+
+SIGN_FLIP_TABLE = bytes(bytearray(i ^ 0x80 for i in xrange(256)))
+SIGN_EXTEND_TABLE = bytes(bytearray(0xFF if i & 0x80 else 0 for i in xrange(256)))
+
+def open_input_wave(input_file):
+    '''
+    Open `input_file` with the `wave` module, or as raw PCM with a
+    RawPcmReader if RAW_INPUT_FORMAT is set
+    '''
+    if RAW_INPUT_FORMAT is None:
+        return wave.open(input_file)
+    sample_width, signedness, endianness = RAW_FORMATS[RAW_INPUT_FORMAT]
+    frames_per_chunk = int(RAW_INPUT_RATE * CHUNK_MS / 1000.0)
+    return RawPcmReader(
+        input_file, sample_width, RAW_INPUT_CHANNELS, RAW_INPUT_RATE,
+        RAW_READ_CHUNKS * frames_per_chunk, signedness, endianness
+    )
 
 def dbfs_to_sample_delta(dbfs, sample_width):
     # convert dBFS to sample range based on our sample width in bytes
@@ -168,20 +1412,29 @@ def segmenter(tagged_segments):
     for silent, segment in itertools.groupby(tagged_segments, key=lambda pair: pair[0]):
         yield silent, itertools.imap(lambda pair: pair[1], segment)
 
-def tag_segments(tagged_chunks):
+def tag_segments(tagged_chunks, hysteresis_chunks=None, pre_roll_chunks=None, post_roll_chunks=None):
     '''
     Generator returning chunk frames tagged by segment
 
     Returns a tuple of (chunk_in_silent_segment, chunk_frames) for each
-    chunk in the provided generator. 
+    chunk in the provided generator. The timings default to the
+    HYSTERESIS_CHUNKS, PRE_ROLL_CHUNKS and POST_ROLL_CHUNKS globals.
 
     Note that this does not tag based strictly on whether the current chunk is silent
     or audible; rather it tags *which type of segment* the chunk belongs to. 
+
+    Silent chunks are held back in a ByteRingBuffer until their segment
+    is known. They come out as memoryviews into it, several chunks at a
+    time in at most two spans, and must be consumed before the generator
+    is resumed.
     '''
-    logging.info("CHUNK_MS: {0}, HYSTERESIS_CHUNKS: {1}, PRE_ROLL_CHUNKS: {2}, POST_ROLL_CHUNKS: {3}".format(
-        CHUNK_MS, HYSTERESIS_CHUNKS, PRE_ROLL_CHUNKS, POST_ROLL_CHUNKS
+    hysteresis_chunks = HYSTERESIS_CHUNKS if hysteresis_chunks is None else hysteresis_chunks
+    pre_roll_chunks = PRE_ROLL_CHUNKS if pre_roll_chunks is None else pre_roll_chunks
+    post_roll_chunks = POST_ROLL_CHUNKS if post_roll_chunks is None else post_roll_chunks
+    logging.info("HYSTERESIS_CHUNKS: {0}, PRE_ROLL_CHUNKS: {1}, POST_ROLL_CHUNKS: {2}".format(
+        hysteresis_chunks, pre_roll_chunks, post_roll_chunks
     ))
-    buffer = RingBuffer(maxlen=max(PRE_ROLL_CHUNKS, POST_ROLL_CHUNKS))
+    buffer = ByteRingBuffer(max(pre_roll_chunks, post_roll_chunks))
     segment_silent = True
     hysteresis_counter = 0
     for chunk_silent, chunk_samples, chunk_frames in tagged_chunks:
@@ -196,34 +1449,28 @@ def tag_segments(tagged_chunks):
 #                logging.debug("Hysteresis counter reset")
             if not segment_silent:
                 # dump buffered silent frames so we don't lose silence in middle of audible
-                for frames in buffer:
+                for frames in buffer.popleft(len(buffer)):
                     yield False, frames
-                buffer.clear()
             hysteresis_counter = 0
         # four cases: changing state/not changing state X silent chunk/audible chunk
         if (segment_silent and not chunk_silent) or\
-            hysteresis_counter >= HYSTERESIS_CHUNKS:
+            hysteresis_counter >= hysteresis_chunks:
 
 #            logging.debug("Changing state, hysteresis counter: {0}".format(hysteresis_counter))
 
             # changing state if we see any audible chunks 
             # or more than HYSTERESIS_CHUNKS silent chunks
             segment_silent = chunk_silent
+            metrics.count('snarp_segments_total', kind='silent' if chunk_silent else 'audible')
 
             if not chunk_silent:
                 # starting audible segment
 
-                # first, take any extra buffer and append to silent segment
-                for i in range(len(buffer) - PRE_ROLL_CHUNKS):
-                    #logging.debug("Dumped excess buffer chunk to silent segment.")
-                    yield False, buffer.popleft()
-                    
-                # write out remainder of buffer as pre-roll
+                # write out the buffer as pre-roll; chunks beyond the
+                # pre-roll go to the audible segment as well
                 logging.debug("Pre-rolling...")
-                for frames in buffer:
-                    #logging.debug("Pre-roll chunk written.")
+                for frames in buffer.popleft(len(buffer)):
                     yield False, frames
-                buffer.clear()
 
                 # emit first audible chunk
                 yield False, chunk_frames
@@ -232,117 +1479,931 @@ def tag_segments(tagged_chunks):
                 logging.debug("Post-rolling...")
 
                 # first few buffered chunks go to end of audible segment
-                for i in range(POST_ROLL_CHUNKS):
-                    if len(buffer) > 0:
-                        #logging.debug("Post-roll chunk written.")
-                        yield False, buffer.popleft()
+                for frames in buffer.popleft(post_roll_chunks):
+                    yield False, frames
 
                 # any remaining buffer chunks should go to the silent segment
-                for frames in buffer:
+                for frames in buffer.popleft(len(buffer)):
                     logging.debug("Dumped excess buffer chunk to silent segment.")
                     yield True, frames
 
-                buffer.clear()
-
                 # the current (silent) chunk goes to the silent segment
                 yield True, chunk_frames
         else: # not changing state
             if chunk_silent:
+                if buffer.maxlen == 0:
+                    # no pre- or post-roll to hold the chunk back for
+                    yield True, chunk_frames
+                    continue
+
+                # If the ring buffer is full, take out the oldest chunk.
+                # Go ahead and emit this as part of a silent segment, since we
+                # now know we don't care about it.
+                if len(buffer) == buffer.maxlen:
+                    for frames in buffer.popleft():
+                        yield True, frames
+
                 # we only ever buffer silent chunks, since we don't know whether we
                 # want to hear them (within, or at the beginning or end of an audible
                 # segment. 
-                frames = buffer.append(chunk_frames)
-
-                # If the ring buffer is full, it will spit out the displaced, oldest
-                # chunk. Go ahead and emit this as part of a silent segment, since we
-                # now know we don't care about it.
-                if frames is not None:
-                    yield True, frames
+                buffer.append(chunk_frames)
             else:
                 # we always want to hear audible chunks
                 yield False, chunk_frames
     # todo: handle contents of buffer after input chunks exhausted
     # ideally would run back through state change loop one more time
     # for now, just dump out attached to current segment
-    for frames in buffer:
+    for frames in buffer.popleft(len(buffer)):
         logging.debug("Dumping left-over frames at end of file.")
         yield segment_silent, frames
 
-def tag_chunks(chunk_gen, silence_deltas, sample_width):
+def flag_runs(flags):
+    '''
+    Run length encode a sequence of chunk silence flags
+
+    Returns a list of (silent, nchunks) tuples.
+    '''
+    if numpy is not None:
+        flags = numpy.asarray(flags, dtype=bool)
+        if not len(flags):
+            return []
+        starts = numpy.concatenate(([0], numpy.flatnonzero(flags[1:] != flags[:-1]) + 1))
+        lengths = numpy.diff(numpy.append(starts, len(flags)))
+        return zip(flags[starts].tolist(), lengths.tolist())
+    return [(bool(silent), sum(1 for flag in run)) for silent, run in itertools.groupby(flags)]
+
+def segment_flags(flags, hysteresis_chunks=None, pre_roll_chunks=None, post_roll_chunks=None, end_fix=True):
+    '''
+    Return the segments of a complete sequence of chunk silence flags
+
+    Offline counterpart of `tag_segments` for input that has been
+    analyzed in full: `flags` holds chunk_silent for every chunk. The
+    flags are run length encoded and the hysteresis and roll timings are
+    applied to whole runs, so the work grows with the number of
+    silent/audible transitions rather than with the number of chunks.
+
+    Returns a list of (segment_silent, start_chunk, stop_chunk) tuples
+    covering all chunks in order, tagged exactly as by `tag_segments`
+    with the same timings - including the chunks its ring buffer pushes
+    out early - with one exception. `tag_segments` leaves silent chunks
+    still buffered at the end of the input in the current segment, so a
+    recording ending in a silence shorter than the hysteresis keeps all
+    of it. Here the end of input ends the audible segment like a long
+    enough silence would: up to `post_roll_chunks` of the buffered
+    chunks stay audible and the rest are silent. Pass `end_fix=False`
+    for the `tag_segments` behaviour.
+    '''
+    hysteresis_chunks = HYSTERESIS_CHUNKS if hysteresis_chunks is None else hysteresis_chunks
+    pre_roll_chunks = PRE_ROLL_CHUNKS if pre_roll_chunks is None else pre_roll_chunks
+    post_roll_chunks = POST_ROLL_CHUNKS if post_roll_chunks is None else post_roll_chunks
+    # tag_segments holds this many silent chunks, whatever the pre-roll
+    buffer_chunks = max(pre_roll_chunks, post_roll_chunks)
+
+    segments = []
+    position = [0]
+    def emit(silent, nchunks):
+        if nchunks <= 0:
+            return
+        start = position[0]
+        position[0] += nchunks
+        if segments and segments[-1][0] == silent:
+            segments[-1] = (silent, segments[-1][1], position[0])
+        else:
+            segments.append((silent, start, position[0]))
+
+    def switch(silent):
+        metrics.count('snarp_segments_total', kind='silent' if silent else 'audible')
+
+    if hysteresis_chunks < 1:
+        # every chunk changes state, so nothing is ever buffered
+        for silent, nchunks in flag_runs(flags):
+            switch(silent)
+            emit(silent, nchunks)
+        return segments
+
+    segment_silent = True
+    hysteresis_counter = 0
+    # silent chunks held back, the most recent ones before the current run
+    buffered = 0
+    for silent, nchunks in flag_runs(flags):
+        if not silent:
+            # audible chunks are always heard, and so are buffered ones
+            # before them, as pre-roll or as silence inside the segment
+            emit(False, buffered + nchunks)
+            buffered = 0
+            if segment_silent:
+                switch(False)
+                segment_silent = False
+                # the counter only resets on the second audible chunk
+                hysteresis_counter = hysteresis_counter + 1 if nchunks == 1 else 0
+            else:
+                hysteresis_counter = 0
+        elif segment_silent:
+            # only at the start of the input: fill the buffer, pushing
+            # out the oldest chunks as silent
+            emit(True, buffered + nchunks - buffer_chunks)
+            buffered = min(buffered + nchunks, buffer_chunks)
+        else:
+            # chunk of this run at which the hysteresis is reached
+            change = max(1, hysteresis_chunks - hysteresis_counter)
+            if change > nchunks:
+                emit(True, nchunks - buffer_chunks)
+                buffered = min(nchunks, buffer_chunks)
+                hysteresis_counter += nchunks
+                continue
+            held = change - 1
+            emit(True, held - buffer_chunks)
+            held = min(held, buffer_chunks)
+            # the oldest held chunks are the post-roll
+            emit(False, min(post_roll_chunks, held))
+            emit(True, held - min(post_roll_chunks, held) + 1)
+            switch(True)
+            segment_silent = True
+            hysteresis_counter += change
+            rest = nchunks - change
+            if rest:
+                hysteresis_counter = 0
+                emit(True, rest - buffer_chunks)
+            buffered = min(rest, buffer_chunks)
+
+    if end_fix and not segment_silent:
+        emit(False, min(post_roll_chunks, buffered))
+        emit(True, buffered - min(post_roll_chunks, buffered))
+    else:
+        emit(segment_silent, buffered)
+    return segments
+
+def tag_chunks(chunk_gen, silence_deltas, sample_width, batch_size=1, nchannels=1,
+    policy=None, adaptive=None, stats=None, window=None, channel_stats=None, detector=None):
     '''
     Tag each chunk in the generator as silent (True) or audible (False)
 
+    Each channel is judged by `detector`, a ChunkDetector (by default
+    from DETECTOR), against `silence_deltas` from its `silence_deltas`.
+    Chunk samples are channel-interleaved; how the channels combine into
+    one decision is set by `policy`, CHANNEL_POLICY by default. Chunk
+    statistics are computed `batch_size` chunks at a time; larger batches
+    amortize per-call overhead at the cost of latency. With adaptive
+    thresholds enabled by `adaptive` (AdaptiveSettings, by default from
+    the globals) the `silence_deltas` limits adapt to the noise floor of
+    the chunks seen so far. Chunk stats go to `stats`, by default
+    `push_stats`. With a `window` longer than one chunk (in chunks, by
+    default from WINDOW_MS) each chunk is judged by the statistics of
+    the last `window` chunks, kept up to date by `SlidingWindowStats`.
+    If given, `channel_stats` is called with every chunk's (peak_deltas,
+    iqr_deltas), one per analyzed channel, which `tag_cached_chunks`
+    can tag again later without the samples.
+
     Returns tuple of (chunk_silent, chunk_samples, chunk_frames)
     '''
-    max_delta, iqr_delta = silence_deltas
+    policy = CHANNEL_POLICY if policy is None else policy
+    if isinstance(policy, int) and not 0 <= policy < nchannels:
+        raise ValueError("Channel {0} out of range for {1} channel input".format(policy, nchannels))
+    detector = current_detector() if detector is None else detector
+    limits = _adaptive_limits(silence_deltas, sample_width, adaptive, detector)
+    stats = push_stats if stats is None else stats
+    window = window_chunks() if window is None else window
+    windows = None
+    if window > 1 and not detector.windowed:
+        raise ValueError("The {0} detector does not support sliding windows".format(detector.name))
+    if window > 1:
+        analyzed_channels = 1 if policy == 'mix' or isinstance(policy, int) else nchannels
+        windows = [SlidingWindowStats(window, sample_width) for channel in xrange(analyzed_channels)]
+    batch = []
     for chunk_samples, chunk_frames in chunk_gen:
         if len(chunk_samples) == 0:
             break
+        batch.append((chunk_samples, chunk_frames))
+        if len(batch) < batch_size:
+            continue
+        for tagged in _tag_batch(
+            batch, silence_deltas, sample_width, nchannels, policy, limits, stats, windows, channel_stats, detector
+        ):
+            yield tagged
+        batch = []
+    for tagged in _tag_batch(
+        batch, silence_deltas, sample_width, nchannels, policy, limits, stats, windows, channel_stats, detector
+    ):
+        yield tagged
 
-        samples = sorted(chunk_samples)
-        count = len(samples)
-        first, last = samples[:int(count/2)], samples[int(count/2):]
-        q1, q3 = first[int(len(first)/2):][0], last[int(len(last)/2):][0]
+def tag_cached_chunks(cached_stats, silence_deltas, sample_width, policy=None, adaptive=None, stats=None,
+    detector=None):
+    '''
+    Tag chunks by the per-channel stats `tag_chunks` passed to its `channel_stats`
 
-        min_, max_ = samples[0], samples[count - 1]
-        #audible = min_ < SILENCE_MIN and SILENCE_MAX < max_
-        audible = max_ - min_ > max_delta
-        audible = audible or q3 - q1 > iqr_delta
-        silence = not audible
+    `cached_stats` is a sequence of (peak_deltas, iqr_deltas), one per
+    chunk. The other arguments are those of `tag_chunks`, with the same
+    defaults; the decisions are the same as on the original samples.
 
-        md, iqrd = max_ - min_, q3 - q1
+    Returns tuple of (chunk_silent, None, None)
+    '''
+    policy = CHANNEL_POLICY if policy is None else policy
+    detector = current_detector() if detector is None else detector
+    limits = _adaptive_limits(silence_deltas, sample_width, adaptive, detector)
+    stats = push_stats if stats is None else stats
+    return _tag_stats(
+        itertools.repeat((None, None)),
+        (peaks for peaks, iqrs in cached_stats),
+        (iqrs for peaks, iqrs in cached_stats),
+        silence_deltas, sample_width, policy, limits, stats, detector
+    )
+
+def _adaptive_limits(silence_deltas, sample_width, adaptive, detector):
+    adaptive = current_adaptive_settings() if adaptive is None else adaptive
+    if adaptive.window_chunks is None:
+        return None
+    if not detector.adaptive:
+        raise ValueError("The {0} detector does not support adaptive thresholds".format(detector.name))
+    return AdaptiveLimits(silence_deltas, sample_width, adaptive)
+
+def _tag_batch(batch, silence_deltas, sample_width, nchannels, policy, limits, stats, windows, channel_stats,
+    detector):
+    chunks = [samples for samples, frames in batch]
+    if nchannels > 1 and policy == 'mix':
+        chunks = [mixdown(samples, nchannels) for samples in chunks]
+        nchannels = 1
+    elif nchannels > 1 and isinstance(policy, int):
+        chunks = [samples[policy::nchannels] for samples in chunks]
+        nchannels = 1
+    started = time.time() if metrics.enabled else None
+    if windows is None:
+        peak_deltas, iqr_deltas = detector.chunk_stats(chunks, nchannels, sample_width)
+    else:
+        peak_deltas = []
+        iqr_deltas = []
+        for chunk in chunks:
+            window_stats = [window.add(chunk[channel::nchannels]) for channel, window in enumerate(windows)]
+            peak_deltas.append([peak for peak, iqr in window_stats])
+            iqr_deltas.append([iqr for peak, iqr in window_stats])
+    if started is not None:
+        metrics.observe('snarp_analysis_seconds', time.time() - started)
+    return _tag_stats(
+        batch, peak_deltas, iqr_deltas, silence_deltas, sample_width, policy, limits, stats, detector, channel_stats
+    )
+
+def _tag_stats(batch, peak_deltas, iqr_deltas, silence_deltas, sample_width, policy, limits, stats, detector,
+    channel_stats=None):
+    audible_channel = detector.audible
+    combine = all if policy == 'all' else any
+    summarize = min if policy == 'all' else max
+    # checked once, the default NullMetrics costs no call per chunk
+    counting = metrics.enabled
+    for (chunk_samples, chunk_frames), peaks, iqrs in itertools.izip(batch, peak_deltas, iqr_deltas):
+        if channel_stats is not None:
+            channel_stats(peaks, iqrs)
+        if limits is not None:
+            silence_deltas = limits.limits
+        audible = combine(
+            audible_channel(md, iqrd, silence_deltas) for md, iqrd in zip(peaks, iqrs)
+        )
+        silence = not audible
+        if counting:
+            metrics.count('snarp_chunks_total', kind='silent' if silence else 'audible')
 
-#        logging.debug('{0}% {1}%, ({2}, {3}), silence: {4}'.format(
-#            int(100 * float(max_ - min_) / max_delta), 
-#            int(100 * float(q3 - q1) / iqr_delta), 
-#            md, iqrd, silence
-#        ))
+        chunk_peak_delta, chunk_iqr_delta = summarize(peaks), summarize(iqrs)
+        if limits is not None:
+            # limits for the next chunk
+            limits.update(chunk_peak_delta, chunk_iqr_delta)
 
-        # record per-frame stats – function is noop if stats are off
-        push_stats(
-            peak_delta=max_-min_,
-            iqr_delta=q3-q1,
+        # record per-frame stats – function is noop if stats are off
+        stats(
+            peak_delta=chunk_peak_delta,
+            iqr_delta=chunk_iqr_delta,
             sample_width=sample_width
         )
 
         yield silence, chunk_samples, chunk_frames
 
-def chunked_samples(input_wave, chunk_seconds):
+class SlidingWindowStats(object):
+    '''
+    Peak and IQR deltas of one channel over its last `window` chunks
+
+    `add` takes the samples of the next chunk and returns the stats of
+    the window ending with it, as `chunk_stats` would for the samples of
+    the whole window. Its cost grows with the chunk, not the window:
+
+    - window minimum and maximum come from monotonic deques of the
+      chunks' own extremes, amortized O(1) per chunk;
+    - quartiles come from a histogram of sample values that chunks are
+      added to and removed from, with a coarse level of bucket totals so
+      a rank is found by scanning 2^9 coarse and 2^8 fine buckets.
+
+    Samples wider than 16 bits are quantized to 16 bits in the
+    histogram, so for 24 and 32 bit input the IQR delta is exact only to
+    within 2^8 or 2^16; the peak delta is always exact.
+    '''
+    FINE_BITS = 8
+
+    def __init__(self, window, sample_width):
+        self.window = window
+        self.shift = max(0, sample_width * 8 - 16)
+        bits = sample_width * 8 - self.shift
+        # room for signed and unsigned samples alike
+        self.offset = 1 << bits
+        size = 2 << bits
+        if numpy is not None:
+            self.counts = numpy.zeros(size, numpy.int64)
+            self.coarse = numpy.zeros(max(1, size >> self.FINE_BITS), numpy.int64)
+        else:
+            self.counts = [0] * size
+            self.coarse = [0] * max(1, size >> self.FINE_BITS)
+        self.chunks = collections.deque()
+        self.count = 0
+        self.added = 0
+        # (chunk number, extreme) with increasing minima / decreasing maxima
+        self.minima = collections.deque()
+        self.maxima = collections.deque()
+
+    def add(self, samples):
+        '''Add the next chunk's samples; return the window's (peak_delta, iqr_delta)'''
+        if len(samples) == 0:
+            raise ValueError("Empty chunk")
+        if numpy is not None:
+            samples = numpy.asarray(samples)
+            indices = (samples.astype(numpy.int64) >> self.shift) + self.offset
+            low, high = int(samples.min()), int(samples.max())
+            # kept in this form, so removing the chunk costs no sorting
+            values, counts = numpy.unique(indices, return_counts=True)
+            coarse_values, starts = numpy.unique(values >> self.FINE_BITS, return_index=True)
+            histogram = (values, counts, coarse_values, numpy.add.reduceat(counts, starts))
+        else:
+            histogram = [(sample >> self.shift) + self.offset for sample in samples]
+            low, high = min(samples), max(samples)
+        self._count(histogram, 1)
+        self.chunks.append((histogram, len(samples)))
+        self.count += len(samples)
+        number = self.added
+        self.added += 1
+        while self.minima and self.minima[-1][1] >= low:
+            self.minima.pop()
+        self.minima.append((number, low))
+        while self.maxima and self.maxima[-1][1] <= high:
+            self.maxima.pop()
+        self.maxima.append((number, high))
+
+        if len(self.chunks) > self.window:
+            histogram, count = self.chunks.popleft()
+            self._count(histogram, -1)
+            self.count -= count
+        first = self.added - len(self.chunks)
+        while self.minima[0][0] < first:
+            self.minima.popleft()
+        while self.maxima[0][0] < first:
+            self.maxima.popleft()
+
+        q1_index, q3_index = quartile_indices(self.count)
+        return (
+            self.maxima[0][1] - self.minima[0][1],
+            self._value(q3_index) - self._value(q1_index)
+        )
+
+    def _count(self, histogram, sign):
+        if numpy is not None:
+            values, counts, coarse_values, coarse_counts = histogram
+            self.counts[values] += sign * counts
+            self.coarse[coarse_values] += sign * coarse_counts
+        else:
+            for index in histogram:
+                self.counts[index] += sign
+                self.coarse[index >> self.FINE_BITS] += sign
+
+    def _value(self, rank):
+        # the sample value of the given rank, counting from 0
+        if numpy is not None:
+            totals = numpy.cumsum(self.coarse)
+            bucket = int(numpy.searchsorted(totals, rank, side='right'))
+            below = int(totals[bucket - 1]) if bucket else 0
+            fine = numpy.cumsum(self.counts[bucket << self.FINE_BITS:(bucket + 1) << self.FINE_BITS])
+            index = (bucket << self.FINE_BITS) + int(numpy.searchsorted(fine, rank - below, side='right'))
+        else:
+            bucket = 0
+            while rank >= self.coarse[bucket]:
+                rank -= self.coarse[bucket]
+                bucket += 1
+            index = bucket << self.FINE_BITS
+            while rank >= self.counts[index]:
+                rank -= self.counts[index]
+                index += 1
+        return (index - self.offset) << self.shift
+
+def mixdown(samples, nchannels):
+    '''
+    Return the mono mixdown (mean, rounded down) of channel-interleaved samples
+    '''
+    if numpy is not None:
+        return numpy.asarray(samples).reshape(-1, nchannels).sum(axis=1) // nchannels
+    return [sum(samples[i:i + nchannels]) // nchannels for i in xrange(0, len(samples), nchannels)]
+
+def quartile_indices(count):
+    '''
+    Return the sorted-order indices of (q1, q3) for a chunk of `count` samples
+
+    Q1 and Q3 are the medians (upper median for even lengths) of the lower
+    and upper halves of the sorted chunk; the upper half takes the odd sample.
+    '''
+    half = count // 2
+    return half // 2, half + (count - half) // 2
+
+def chunk_stats(samples):
+    '''
+    Return (peak_delta, iqr_delta) for one chunk of single channel samples
+
+    With NumPy the order statistics are found by selection in linear time
+    rather than by sorting the whole chunk.
+    '''
+    count = len(samples)
+    q1_index, q3_index = quartile_indices(count)
+    if numpy is not None:
+        selected = numpy.partition(numpy.asarray(samples), (0, q1_index, q3_index, count - 1))
+    else:
+        # without NumPy the C sort beats any selection written in Python
+        selected = sorted(samples)
+    return (
+        selected[count - 1] - selected[0],
+        selected[q3_index] - selected[q1_index]
+    )
+
+SilenceLimits = collections.namedtuple('SilenceLimits', 'peak iqr rms zcr')
+
+def current_silence_limits():
+    '''Return the SilenceLimits set by the SILENCE_*_LIMIT globals'''
+    return SilenceLimits(SILENCE_PEAK_LIMIT, SILENCE_IQR_LIMIT, SILENCE_RMS_LIMIT, SILENCE_ZCR_LIMIT)
+
+def current_detector():
+    '''Return the chunk detector selected by DETECTOR, with the current limits'''
+    return DETECTORS[DETECTOR](current_silence_limits())
+
+class ChunkDetector(object):
+    '''
+    Decides, channel by channel, whether chunks are silent
+
+    A detector computes two statistics for every channel of a batch of
+    chunks, and compares them against two limits. The statistics are
+    what the stats sink records as peak_delta and iqr_delta, what the
+    analysis cache keeps and what adaptive thresholds follow; the limits
+    are what `silence_deltas` returns for them, in the same units.
+
+    Subclasses set `name`, implement `silence_deltas`, `chunk_stats` and
+    `audible`, and are made selectable by adding them to DETECTORS.
+    `windowed` detectors support sliding windows (see WINDOW_MS), whose
+    statistics come from SlidingWindowStats; `adaptive` ones support
+    adaptive thresholds.
+    '''
+    name = None
+    windowed = False
+    adaptive = True
+
+    def __init__(self, limits):
+        self.limits = limits
+
+    def silence_deltas(self, sample_width):
+        '''Return the two limits for input of `sample_width`'''
+        raise NotImplementedError
+
+    def chunk_stats(self, chunks, nchannels, sample_width):
+        '''
+        Return the two statistics for a list of channel-interleaved chunks,
+        each with one row per chunk and one column per channel
+        '''
+        raise NotImplementedError
+
+    def audible(self, first, second, silence_deltas):
+        '''Return True if a channel with these statistics is audible'''
+        raise NotImplementedError
+
+class PeakIqrDetector(ChunkDetector):
+    '''
+    Audible if the peak to peak range or the interquartile range of the
+    samples exceeds its limit, SILENCE_PEAK_LIMIT or SILENCE_IQR_LIMIT
+
+    Needs a selection of the sorted samples of every chunk.
+    '''
+    name = 'peak-iqr'
+    windowed = True
+
+    def silence_deltas(self, sample_width):
+        return (
+            dbfs_to_sample_delta(self.limits.peak, sample_width),
+            dbfs_to_sample_delta(self.limits.iqr, sample_width)
+        )
+
+    def chunk_stats(self, chunks, nchannels, sample_width):
+        return chunk_stats_batch(chunks, nchannels)
+
+    def audible(self, peak_delta, iqr_delta, silence_deltas):
+        return peak_delta > silence_deltas[0] or iqr_delta > silence_deltas[1]
+
+class RmsDetector(ChunkDetector):
+    '''
+    Audible if the RMS level exceeds its limit
+
+    The first statistic is twice the RMS about the mean, which for a
+    sine is about its IQR delta, so the RMS limit defaults to the IQR
+    limit. The second is always 0. Sums of squares are exact integer
+    sums for up to 16 bit input, so only additions and multiplications
+    are needed per sample.
+    '''
+    name = 'rms'
+
+    def silence_deltas(self, sample_width):
+        rms_limit = self.limits.iqr if self.limits.rms is None else self.limits.rms
+        return dbfs_to_sample_delta(rms_limit, sample_width), 0
+
+    def chunk_stats(self, chunks, nchannels, sample_width):
+        rms_deltas, crossings = level_stats_batch(chunks, nchannels, sample_width)
+        return rms_deltas, [[0] * nchannels] * len(rms_deltas)
+
+    def audible(self, rms_delta, unused, silence_deltas):
+        return rms_delta > silence_deltas[0]
+
+class ZeroCrossingDetector(RmsDetector):
+    '''
+    Audible if the RMS level exceeds its limit and the chunk doesn't
+    cross zero more than SILENCE_ZCR_LIMIT times per sample
+
+    Steady noise like hiss or fans crosses zero far more often than
+    voiced speech. The second statistic is the zero crossing rate about
+    the mean, in crossings per 1000 samples. Its limit is not a level, so
+    adaptive thresholds are not supported.
+    '''
+    name = 'zcr'
+    adaptive = False
+
+    def silence_deltas(self, sample_width):
+        return RmsDetector.silence_deltas(self, sample_width)[0], self.limits.zcr * 1000
+
+    def chunk_stats(self, chunks, nchannels, sample_width):
+        return level_stats_batch(chunks, nchannels, sample_width, with_crossings=True)
+
+    def audible(self, rms_delta, crossings, silence_deltas):
+        return rms_delta > silence_deltas[0] and crossings <= silence_deltas[1]
+
+# Selectable chunk detectors by name
+DETECTORS = {
+    PeakIqrDetector.name: PeakIqrDetector,
+    RmsDetector.name: RmsDetector,
+    ZeroCrossingDetector.name: ZeroCrossingDetector,
+}
+
+def level_stats_batch(chunks, nchannels=1, sample_width=2, with_crossings=False):
+    '''
+    Return (rms_deltas, crossings) for a list of channel-interleaved chunks
+
+    Rows and columns are as for `chunk_stats_batch`. RMS deltas are twice
+    the RMS about the chunk mean. With `with_crossings`, crossings are the
+    number of times the samples cross the mean per 1000 samples,
+    otherwise None. Both are integers.
+    '''
+    if numpy is not None and len(chunks) > 0 and \
+        all(len(chunk) == len(chunks[0]) for chunk in chunks):
+        count = len(chunks[0]) // nchannels
+        stacked = numpy.vstack(chunks).reshape(len(chunks), count, nchannels).astype(numpy.int64)
+        sums = stacked.sum(axis=1)
+        if sample_width <= 2 and count < 1 << 15:
+            # exact, and count * sum of squares fits in 64 bits
+            squares = numpy.einsum('ijk,ijk->ik', stacked, stacked)
+        else:
+            sums = sums.astype(numpy.float64)
+            squares = numpy.einsum('ijk,ijk->ik', stacked.astype(numpy.float64), stacked.astype(numpy.float64))
+        variances = numpy.maximum(count * squares - sums * sums, 0)
+        rms_deltas = (2 * numpy.sqrt(variances) / count).astype(numpy.int64)
+        if not with_crossings:
+            return rms_deltas, None
+        # which side of the mean each sample is on, without dividing
+        above = stacked * count >= sums.astype(numpy.int64)[:, numpy.newaxis, :]
+        crossings = (above[:, 1:] != above[:, :-1]).sum(axis=1) * 1000 // max(1, count - 1)
+        return rms_deltas, crossings
+    if numpy is not None:
+        stats = [level_stats_batch([chunk], nchannels, sample_width, with_crossings) for chunk in chunks]
+        return (
+            [rms[0] for rms, crossings in stats],
+            [crossings[0] for rms, crossings in stats] if with_crossings else None
+        )
+    rms_deltas, crossings = [], []
+    for chunk in chunks:
+        rms_row, crossings_row = [], []
+        for channel in xrange(nchannels):
+            samples = chunk[channel::nchannels]
+            count = len(samples)
+            total = sum(samples)
+            squares = sum(sample * sample for sample in samples)
+            rms_row.append(int(2 * math.sqrt(max(0, count * squares - total * total)) / count))
+            if with_crossings:
+                above = [sample * count >= total for sample in samples]
+                crossings_row.append(
+                    sum(1 for i in xrange(1, count) if above[i] != above[i - 1]) * 1000 // max(1, count - 1)
+                )
+        rms_deltas.append(rms_row)
+        crossings.append(crossings_row)
+    return rms_deltas, crossings if with_crossings else None
+
+def chunk_stats_batch(chunks, nchannels=1):
+    '''
+    Return (peak_deltas, iqr_deltas) for a list of channel-interleaved chunks
+
+    Both results hold one row per chunk and one column per channel. With
+    NumPy, equally sized chunks are stacked and every channel of every
+    chunk is partitioned together in a single vectorized call.
+    '''
+    if numpy is not None and len(chunks) > 0 and \
+        all(len(chunk) == len(chunks[0]) for chunk in chunks):
+        count = len(chunks[0]) // nchannels
+        q1_index, q3_index = quartile_indices(count)
+        stacked = numpy.vstack(chunks).reshape(len(chunks), count, nchannels)
+        selected = numpy.partition(stacked, (0, q1_index, q3_index, count - 1), axis=1)
+        return (
+            selected[:, count - 1] - selected[:, 0],
+            selected[:, q3_index] - selected[:, q1_index]
+        )
+    if numpy is not None:
+        # ragged batch, e.g. the short final chunk: one chunk at a time
+        stats = [chunk_stats_batch([chunk], nchannels) for chunk in chunks]
+        return [peaks[0] for peaks, iqrs in stats], [iqrs[0] for peaks, iqrs in stats]
+    peak_deltas, iqr_deltas = [], []
+    for chunk in chunks:
+        stats = [chunk_stats(chunk[channel::nchannels]) for channel in xrange(nchannels)]
+        peak_deltas.append([peak for peak, iqr in stats])
+        iqr_deltas.append([iqr for peak, iqr in stats])
+    return peak_deltas, iqr_deltas
+
+def chunked_samples(input_wave, chunk_seconds, signed_data=None, endianness=None, decimation=None, decimation_mode=None):
     '''
     Generator returning parsed and raw wave data one chunk at a time
     
     Yield a pair of (parsed wave samples, raw wave frames) from `input_wave` 
     in chunks of at most `chunk_seconds` of data. The actual number of frames 
-    per chunk will vary with the input wave's frame rate. 
+    per chunk will vary with the input wave's frame rate. Samples for all
+    channels are interleaved as in the frame data. `signed_data` and
+    `endianness` default to the input_is_signed_data and INPUT_ENDIANNESS
+    settings. Samples are decimated as `analysis_samples` does, the raw
+    frames never are.
     '''
     sample_width = input_wave.getsampwidth()
     nchannels = input_wave.getnchannels()
-    signed_data = input_is_signed_data(input_wave)
+    signed_data = input_is_signed_data(input_wave) if signed_data is None else signed_data
     frames_per_chunk = int(input_wave.getframerate() * chunk_seconds)
+    meter = ReadMeter(input_wave.getframerate())
     while True:
+        started = meter.start()
         frames = input_wave.readframes(frames_per_chunk)
-        yield list(parse_frames(frames, sample_width, nchannels, signed_data)), frames
+        samples = analysis_samples(
+            frames, sample_width, nchannels, signed_data, endianness, decimation, decimation_mode
+        )
+        meter.record(started, len(frames) // (sample_width * nchannels))
+        yield samples, frames
+
+def mapped_chunked_samples(mapped, input_wave, chunk_seconds, first_chunk=0, stop_chunk=None):
+    '''
+    Generator returning parsed wave data and frame views one chunk at a time
+
+    Like `chunked_samples`, but reads from a `MappedWaveData`. Frames are
+    zero-copy views of the mapping rather than newly allocated strings.
+    Only chunks `first_chunk` up to (excluding) `stop_chunk` are read.
+    '''
+    sample_width = input_wave.getsampwidth()
+    nchannels = input_wave.getnchannels()
+    signed_data = input_is_signed_data(input_wave)
+    chunk_bytes = int(input_wave.getframerate() * chunk_seconds) * sample_width * nchannels
+    stop = mapped.size if stop_chunk is None else min(mapped.size, stop_chunk * chunk_bytes)
+    meter = ReadMeter(input_wave.getframerate())
+    for start in xrange(first_chunk * chunk_bytes, stop, chunk_bytes):
+        started = meter.start()
+        frames = mapped.view(start, min(stop, start + chunk_bytes))
+        samples = analysis_samples(frames, sample_width, nchannels, signed_data)
+        meter.record(started, len(frames) // (sample_width * nchannels))
+        yield samples, frames
+
+def mapped_chunk_count(mapped, input_wave):
+    '''Return the number of chunks `mapped_chunked_samples` reads from `mapped`'''
+    chunk_bytes = int(input_wave.getframerate() * CHUNK_MS / 1000.0) * input_wave.getsampwidth() * input_wave.getnchannels()
+    return -(-mapped.size // chunk_bytes)
+
+def sharded_tag_chunks(filename, mapped, input_wave, chunk_seconds, silence_deltas, jobs, channel_stats=None):
+    '''
+    Like `tag_chunks` over `mapped_chunked_samples`, analyzing in parallel
+
+    The input is split into `jobs` shards on chunk boundaries. Chunk
+    statistics don't depend on neighbouring chunks, so shards need no
+    overlap; each is tagged by a worker process. Results are put back in
+    input order, with recorded stats, before the serial `tag_segments`
+    state machine sees them, so the output is identical to a serial run.
+    Per-channel stats go to `channel_stats`, as in `tag_chunks`.
+
+    Yields (chunk_silent, None, chunk_frames) tuples.
+    '''
+    chunk_bytes = int(input_wave.getframerate() * chunk_seconds) * input_wave.getsampwidth() * input_wave.getnchannels()
+    nchunks = (mapped.size + chunk_bytes - 1) // chunk_bytes
+    shard_chunks = max(1, (nchunks + jobs - 1) // jobs)
+    settings = (
+        silence_deltas, INPUT_ENDIANNESS, INPUT_SIGNEDNESS, CHANNEL_POLICY, current_detector(),
+        ANALYSIS_DECIMATION, ANALYSIS_DECIMATION_MODE
+    )
+    shards = [
+        (filename, chunk_seconds, settings, first_chunk, min(nchunks, first_chunk + shard_chunks))
+        for first_chunk in xrange(0, nchunks, shard_chunks)
+    ]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        chunk = 0
+        meter = ReadMeter(input_wave.getframerate())
+        for flags, stats, shard_channel_stats in pool.imap(_tag_shard, shards):
+            for silent, (peak_delta, iqr_delta), (peaks, iqrs) in zip(flags, stats, shard_channel_stats):
+                if channel_stats is not None:
+                    channel_stats(peaks, iqrs)
+                push_stats(
+                    peak_delta=peak_delta,
+                    iqr_delta=iqr_delta,
+                    sample_width=input_wave.getsampwidth()
+                )
+                frames = mapped.view(chunk * chunk_bytes, min(mapped.size, (chunk + 1) * chunk_bytes))
+                # workers can't reach our metrics, count their work as it arrives
+                meter.advance(len(frames) // (input_wave.getsampwidth() * input_wave.getnchannels()))
+                if metrics.enabled:
+                    metrics.count('snarp_chunks_total', kind='silent' if silent else 'audible')
+                yield silent, None, frames
+                chunk += 1
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
-def parse_frames(frames, sample_width, nchannels, signed_data):
+def _tag_shard(shard):
+    global push_stats, metrics
+    filename, chunk_seconds, settings, first_chunk, stop_chunk = shard
+    silence_deltas, endianness, signedness, policy, detector, decimation, decimation_mode = settings
+    stats = []
+    channel_stats = []
+    metrics = NullMetrics()
+    # collect stats here, the parent records them in order
+    push_stats = lambda peak_delta, iqr_delta, sample_width: stats.append((peak_delta, iqr_delta))
+    with analysis_decimation(decimation, decimation_mode):
+        with input_endianness(endianness):
+            with input_signedness(signedness):
+                with channel_policy(policy):
+                    with open(filename, 'rb') as input_file:
+                        input_wave = wave.open(input_file)
+                        mapped = MappedWaveData.open(
+                            input_file, input_wave.getsampwidth() * input_wave.getnchannels()
+                        )
+                        flags = [
+                            silent for silent, samples, frames in tag_chunks(
+                                mapped_chunked_samples(mapped, input_wave, chunk_seconds, first_chunk, stop_chunk),
+                                silence_deltas,
+                                sample_width=input_wave.getsampwidth(),
+                                batch_size=16,
+                                nchannels=input_wave.getnchannels(),
+                                detector=detector,
+                                channel_stats=lambda peaks, iqrs: channel_stats.append(
+                                    ([int(peak) for peak in peaks], [int(iqr) for iqr in iqrs])
+                                )
+                            )
+                        ]
+    return flags, stats, channel_stats
+
+def parse_frames(frames, sample_width, nchannels, signed_data, endianness=None):
     '''
-    Generator to convert wave frames to sample data
+    Convert wave frames to sample data in one bulk operation
+
+    Returns a NumPy integer array when NumPy is available, otherwise an
+    `array.array`. Samples for all channels are decoded and stay
+    interleaved, frame by frame. Samples are widened so that differences
+    between any two of them cannot overflow.
     
     Arguments:
-    frames        frame data 
-    sample_width  sample width in bytes
+    frames        frame data (str, bytearray, buffer or memoryview)
+    sample_width  sample width in bytes, 1 to 4 (3 is packed 24 bit)
     nchannels     number of channels per frame
     signed_data   True if wave data is signed, false if unsigned
+    endianness    'little' or 'big', defaults to INPUT_ENDIANNESS
+    '''
+    if endianness is None:
+        endianness = INPUT_ENDIANNESS
+    nsamples = len(frames) // (sample_width * nchannels) * nchannels
+    if numpy is not None:
+        return _parse_frames_numpy(frames, nsamples, sample_width, signed_data, endianness)
+    return _parse_frames_array(frames, nsamples, sample_width, signed_data, endianness)
+
+def _frame_bytes(frames, nbytes):
+    # zero-copy uint8 view of the first `nbytes` of the frame data
+    if isinstance(frames, memoryview):
+        return numpy.asarray(frames)[:nbytes]
+    return numpy.frombuffer(frames, dtype=numpy.uint8, count=nbytes)
+
+def _parse_frames_numpy(frames, nsamples, sample_width, signed_data, endianness):
+    raw = _frame_bytes(frames, nsamples * sample_width)
+    if sample_width == 3:
+        raw = raw.reshape(nsamples, 3)
+        if endianness == 'little':
+            low, mid, high = raw[:, 0], raw[:, 1], raw[:, 2]
+        else:
+            high, mid, low = raw[:, 0], raw[:, 1], raw[:, 2]
+        samples = low.astype(numpy.int32)
+        samples |= mid.astype(numpy.int32) << 8
+        samples |= high.astype(numpy.int32) << 16
+        if signed_data:
+            samples ^= 0x800000
+            samples -= 0x800000
+        return samples
+    dtype = numpy.dtype('{0}{1}{2}'.format(
+        '<' if endianness == 'little' else '>',
+        'i' if signed_data else 'u',
+        sample_width
+    ))
+    samples = raw.view(dtype)
+    return samples.astype(numpy.int64 if sample_width == 4 else numpy.int32)
+
+def _array_typecode(sample_width, signed_data):
+    for code in ('bhilq' if signed_data else 'BHILQ'):
+        try:
+            if array.array(code).itemsize == sample_width:
+                return code
+        except ValueError:
+            # 'q' and 'Q' are not available everywhere
+            continue
+    raise ValueError("No array type for {0} byte samples".format(sample_width))
+
+def _parse_frames_array(frames, nsamples, sample_width, signed_data, endianness):
+    data = frames[:nsamples * sample_width]
+    data = data.tobytes() if isinstance(data, memoryview) else bytes(data)
+    if sample_width == 3:
+        # pad each sample to a native 32 bit word, the pad byte being
+        # the sign extension of the most significant byte for signed data
+        padded = bytearray(nsamples * 4)
+        order = (0, 1, 2) if endianness == 'little' else (2, 1, 0)
+        if sys.byteorder == 'little':
+            positions = list(order)
+            pad = 3
+        else:
+            positions = [3 - i for i in order]
+            pad = 0
+        for position, byte in zip(positions, range(3)):
+            padded[position::4] = data[byte::3]
+        if signed_data:
+            padded[pad::4] = data[order.index(2)::3].translate(SIGN_EXTEND_TABLE)
+        return array.array(_array_typecode(4, signed_data), bytes(padded))
+    samples = array.array(_array_typecode(sample_width, signed_data), data)
+    if sample_width > 1 and endianness != sys.byteorder:
+        samples.byteswap()
+    return samples
+
+def analysis_samples(frames, sample_width, nchannels, signed_data, endianness=None, decimation=None, mode=None):
+    '''
+    Convert wave frames to the samples analyzed for silence
+
+    Like `parse_frames`, but with a `decimation` factor above 1 only a
+    reduced signal is returned. In 'stride' `mode` it is every
+    decimation-th frame, picked from the frame data before decoding, so
+    decoding gets cheaper too. In 'envelope' mode it is the minimum and
+    then the maximum of every block of decimation frames, which keeps
+    the peaks of every block. `decimation` and `mode` default to
+    ANALYSIS_DECIMATION and ANALYSIS_DECIMATION_MODE.
     '''
-    # todo: coalesce samples for all channels into one?
-    chunk_size = sample_width * nchannels
-    for i in xrange(0, len(frames), chunk_size):
-        frame = frames[i:i + chunk_size]
-        yield frame_to_sample(frame, sample_width, signed_data)
+    decimation = ANALYSIS_DECIMATION if decimation is None else decimation
+    mode = ANALYSIS_DECIMATION_MODE if mode is None else mode
+    if decimation <= 1:
+        return parse_frames(frames, sample_width, nchannels, signed_data, endianness)
+    frame_width = sample_width * nchannels
+    nframes = len(frames) // frame_width
+    if mode == 'stride':
+        if numpy is not None:
+            rows = _frame_bytes(frames, nframes * frame_width).reshape(nframes, frame_width)
+            strided = numpy.ascontiguousarray(rows[::decimation]).reshape(-1)
+        else:
+            data = frames.tobytes() if isinstance(frames, memoryview) else bytes(frames)
+            strided = b''.join(
+                data[i:i + frame_width] for i in xrange(0, nframes * frame_width, decimation * frame_width)
+            )
+        return parse_frames(strided, sample_width, nchannels, signed_data, endianness)
+    samples = parse_frames(frames, sample_width, nchannels, signed_data, endianness)
+    nblocks = (nframes + decimation - 1) // decimation
+    if numpy is not None:
+        envelope = numpy.empty((nblocks, 2, nchannels), dtype=samples.dtype)
+        whole = nframes // decimation
+        blocks = samples[:whole * decimation * nchannels].reshape(whole, decimation, nchannels)
+        envelope[:whole, 0] = blocks.min(axis=1)
+        envelope[:whole, 1] = blocks.max(axis=1)
+        if whole < nblocks:
+            # the short last block
+            rest = samples[whole * decimation * nchannels:].reshape(-1, nchannels)
+            envelope[whole, 0] = rest.min(axis=0)
+            envelope[whole, 1] = rest.max(axis=0)
+        return envelope.reshape(-1)
+    envelope = array.array(samples.typecode)
+    block_samples = decimation * nchannels
+    for start in xrange(0, nframes * nchannels, block_samples):
+        block = samples[start:start + block_samples]
+        channels = [block[channel::nchannels] for channel in xrange(nchannels)]
+        envelope.extend(min(channel) for channel in channels)
+        envelope.extend(max(channel) for channel in channels)
+    return envelope
 
 def frame_to_sample(frame, sample_width, signed_data):
     '''
     Convert one frame to one sample
 
+    This is the scalar reference decoder; `parse_frames` decodes whole
+    buffers at once and should be used for real work.
+
     Note that we expect that the frame data will contain frames for all
     channels of the wave file. However, only the first channel will be 
     processed. The data from the remaining channels will be ignored!
@@ -352,7 +2413,6 @@ def frame_to_sample(frame, sample_width, signed_data):
     sample_width  sample width in bytes
     signed_data   True if wave data is signed, false if unsigned
     '''
-    # todo: accept nchannels and decode all channels
     # handling only the first channel
     frame_data = frame[0:sample_width]
 
@@ -387,91 +2447,1467 @@ def input_is_signed_data(wave_file):
     else:
         return INPUT_SIGNEDNESS == 'signed'
 
-def remove_silences(input_file, output_file, bypass_file=None):
-    input_wave = wave.open(input_file)
+class RF64WaveWriter(object):
+    '''
+    PCM wave writer that turns into RF64 (BW64) past 4 GB
+
+    Writes a plain wave file, as the `wave` module would, but with a JUNK
+    chunk reserving room for an RF64 ds64 chunk in the header. Once the
+    file outgrows the 32 bit RIFF sizes, the header is rewritten as RF64
+    with the real sizes in ds64.
+
+    The header is committed, sizes patched in place, after every
+    writeframes call, so if the process dies the file is valid up to the
+    last call. Wrapped in a BufferedWaveWriter that is once per flush.
+    `output_file` must be seekable; it is not closed by `close`.
+    '''
+    HEADER = struct.Struct('<4sL4s4sL28s4sLHHLLHH4sL')
+    DS64 = struct.Struct('<QQQL')
+    RIFF_LIMIT = 0xFFFFFFFF
+
+    def __init__(self, output_file, params):
+        self.file = output_file
+        self.nchannels, self.sampwidth, self.framerate = params[:3]
+        self.start = output_file.tell()
+        self.data_bytes = 0
+        self._commit()
+
+    def writeframes(self, frames):
+        self.file.write(frames)
+        self.data_bytes += len(frames)
+        self._commit()
+
+    def close(self):
+        if self.data_bytes % 2:
+            # RIFF chunks are padded to an even size
+            self.file.write(b'\0')
+        self._commit()
+        self.file.flush()
+
+    def _commit(self):
+        frame_width = self.nchannels * self.sampwidth
+        riff_bytes = self.HEADER.size - 8 + self.data_bytes + self.data_bytes % 2
+        if riff_bytes > self.RIFF_LIMIT:
+            ds64 = self.DS64.pack(riff_bytes, self.data_bytes, self.data_bytes // frame_width, 0)
+            riff_id, riff_size, junk_id, data_size = b'RF64', 0xFFFFFFFF, b'ds64', 0xFFFFFFFF
+        else:
+            ds64 = b''
+            riff_id, riff_size, junk_id, data_size = b'RIFF', riff_bytes, b'JUNK', self.data_bytes
+        header = self.HEADER.pack(
+            riff_id, riff_size, b'WAVE',
+            junk_id, self.DS64.size, ds64,
+            b'fmt ', 16, 1, self.nchannels, self.framerate,
+            self.framerate * frame_width, frame_width, self.sampwidth * 8,
+            b'data', data_size
+        )
+        end = self.start + self.HEADER.size + self.data_bytes
+        self.file.seek(self.start)
+        self.file.write(header)
+        self.file.seek(end)
+
+class RollingWaveWriter(object):
+    '''
+    Wave writer moving on to a new file every `roll_bytes` or `roll_seconds`
+
+    The first file is `output_file`; later ones are created next to it
+    and named after it with a sequence number: out.wav, out.0001.wav,
+    out.0002.wav and so on. Every file holds whole frames, at most
+    `roll_bytes` of them or `roll_seconds` of audio, whichever is less.
+    Files are written by RF64WaveWriter if `rf64`, otherwise by the
+    `wave` module.
+    '''
+    def __init__(self, output_file, params, roll_bytes=None, roll_seconds=None, rf64=False):
+        name = getattr(output_file, 'name', None)
+        if not isinstance(name, basestring) or name.startswith('<'):
+            raise ValueError("Rolling output needs a named output file")
+        self.root, self.extension = os.path.splitext(name)
+        self.params = params
+        self.rf64 = rf64
+        self.frame_width = params[0] * params[1]
+        limits = []
+        if roll_bytes:
+            limits.append(roll_bytes // self.frame_width)
+        if roll_seconds:
+            limits.append(int(roll_seconds * params[2]))
+        self.roll_frames = max(1, min(limits))
+        self.sequence = 0
+        self.file = None
+        self.wave_writer = open_wave_writer(output_file, params, rf64)
+        self.frames = 0
+
+    def writeframes(self, frames):
+        offset = 0
+        while offset < len(frames):
+            if self.frames == self.roll_frames:
+                self._roll()
+            size = min(len(frames) - offset, (self.roll_frames - self.frames) * self.frame_width)
+            if size == len(frames):
+                self.wave_writer.writeframes(frames)
+            else:
+                self.wave_writer.writeframes(data_view(frames, offset, offset + size))
+            self.frames += size // self.frame_width
+            offset += size
+
+    def close(self):
+        try:
+            self.wave_writer.close()
+        finally:
+            if self.file is not None:
+                self.file.close()
+
+    def _roll(self):
+        self.close()
+        self.sequence += 1
+        filename = '{0}.{1:04d}{2}'.format(self.root, self.sequence, self.extension)
+        logging.info("Rolling over to {0}".format(filename))
+        self.file = None
+        self.file = open(filename, 'wb')
+        self.wave_writer = open_wave_writer(self.file, self.params, self.rf64)
+        self.frames = 0
+
+class StreamWaveWriter(object):
+    '''
+    Writer of frames to a stream, such as a pipe or FIFO, that can't seek
+
+    With `header`, a wave header comes first, with the RIFF and data
+    sizes set to 0xFFFFFFFF as the length is not known, as recorders
+    writing to pipes do. Otherwise the stream is raw PCM. Every write is
+    flushed, so readers see frames as soon as they are written.
+    `output_file` is not closed by `close`.
+    '''
+    HEADER = struct.Struct('<4sL4s4sLHHLLHH4sL')
+    UNKNOWN_SIZE = 0xFFFFFFFF
+
+    def __init__(self, output_file, params, header=True):
+        self.file = output_file
+        nchannels, sampwidth, framerate = params[:3]
+        if header:
+            frame_width = nchannels * sampwidth
+            self.file.write(self.HEADER.pack(
+                b'RIFF', self.UNKNOWN_SIZE, b'WAVE',
+                b'fmt ', 16, 1, nchannels, framerate,
+                framerate * frame_width, frame_width, sampwidth * 8,
+                b'data', self.UNKNOWN_SIZE
+            ))
+            self.file.flush()
+
+    def writeframes(self, frames):
+        if isinstance(frames, memoryview):
+            # Python 2 files only take the old buffer interface
+            frames = frames.tobytes()
+        self.file.write(frames)
+        self.file.flush()
+
+    def close(self):
+        self.file.flush()
+
+class SegmentEvents(object):
+    '''
+    Writer of segment events, as lines of JSON, to `output`
+
+    Call `frames` for all input in order, with whether it is in a silent
+    segment. When an audible segment starts or ends, an event is written
+    and flushed, e.g.
+
+        {"event": "start", "input_frame": 44100, "output_frame": 0, "seconds": 1.0}
+
+    Frames count from the start of the input and of the output; seconds
+    are input time. `close` ends a segment still open. With an `output`
+    of None, nothing is written.
+
+    `written` reports a segment written to a file of its own, see
+    SegmentFiles, with a "file" event giving its `filename`, first
+    `input_frame` and length in `frames`. It may be called from other
+    threads.
+    '''
+    def __init__(self, output, frame_width, frame_rate):
+        self.output = output
+        self.frame_width = frame_width
+        self.frame_rate = frame_rate
+        self.input_frame = self.output_frame = 0
+        self.audible = False
+        self.lock = threading.Lock()
+
+    def frames(self, silent, nbytes):
+        '''Account for `nbytes` more input in a silent segment or not'''
+        if silent == self.audible:
+            self._event('end' if self.audible else 'start')
+            self.audible = not silent
+        nframes = nbytes // self.frame_width
+        self.input_frame += nframes
+        if not silent:
+            self.output_frame += nframes
+
+    def close(self):
+        if self.audible:
+            self._event('end')
+            self.audible = False
+
+    def written(self, filename, input_frame, nframes):
+        '''Report that the segment of `nframes` from `input_frame` is in file `filename`'''
+        self._event('file', filename=filename, input_frame=input_frame, frames=nframes)
+
+    def _event(self, name, **fields):
+        if self.output is None:
+            return
+        if not fields:
+            fields = {'input_frame': self.input_frame, 'output_frame': self.output_frame}
+        event = dict(fields, event=name, seconds=round(float(fields['input_frame']) / self.frame_rate, 6))
+        with self.lock:
+            self.output.write(json.dumps(event, sort_keys=True) + '\n')
+            self.output.flush()
+
+class SegmentFiles(object):
+    '''
+    Writer of every audible segment to a wave file of its own
+
+    Call `start` when an audible segment starts, with its first input
+    frame, `writeframes` with its frames and `end` when it is over. The
+    file is named by formatting `template` with the segment's `index`,
+    counting from 1, its `input_frame`, the input time in `seconds` and
+    the wall clock `time` at which it started, a datetime, e.g.
+
+        'utterance-{time:%Y%m%d-%H%M%S}-{input_frame:09d}.wav'
+
+    Files are opened, written and closed by a pool of `writers` threads,
+    so the caller never waits for them: each segment goes to one thread,
+    which writes its frames in order, and successive segments go to the
+    next thread. The queues to the threads are not bounded. Files are
+    wave files written like the output file, following OUTPUT_RF64.
+    Once a file is complete, it is reported to `events`, a
+    SegmentEvents, if given.
+
+    Errors raised by the threads are re-raised by the next call to
+    start, writeframes or close. `close` ends a segment still open and
+    waits for all files to be complete. `filenames` lists the files
+    started so far.
+    '''
+    def __init__(self, template, params, writers=None, events=None):
+        self.template = template
+        self.params = params
+        self.frame_rate = params[2]
+        self.events = events
+        self.filenames = []
+        self.queue = None
+        self.error = None
+        writers = SPLIT_WRITERS if writers is None else writers
+        self.queues = [Queue.Queue() for i in xrange(writers)]
+        self.threads = [
+            threading.Thread(target=self._write, args=(queue,), name='snarp-segment-writer-{0}'.format(i))
+            for i, queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def start(self, input_frame):
+        '''Start a new segment at `input_frame`, ending the current one'''
+        self._check_error()
+        self.end()
+        filename = self.template.format(
+            index=len(self.filenames) + 1,
+            input_frame=input_frame,
+            seconds=float(input_frame) / self.frame_rate,
+            time=datetime.datetime.now(),
+        )
+        self.filenames.append(filename)
+        self.queue = self.queues[(len(self.filenames) - 1) % len(self.queues)]
+        self.queue.put(('start', filename, input_frame))
+
+    def writeframes(self, frames):
+        self._check_error()
+        if not is_immutable(frames):
+            # the caller may reuse its buffer once we return
+            frames = bytearray(frames)
+        self.queue.put(('frames', frames))
+
+    def end(self):
+        '''End the current segment, if any'''
+        if self.queue is not None:
+            self.queue.put(('end',))
+            self.queue = None
+
+    def close(self):
+        try:
+            self.end()
+        finally:
+            for queue in self.queues:
+                queue.put(None)
+            for thread in self.threads:
+                thread.join()
+        self._check_error()
+
+    def _write(self, queue):
+        output_file = output_wave = None
+        while True:
+            item = queue.get()
+            if item is None:
+                return
+            if item[0] != 'start' and output_wave is None:
+                # the segment's file failed, which is reported already
+                continue
+            try:
+                if item[0] == 'start':
+                    kind, filename, input_frame = item
+                    output_file = open(filename, 'wb')
+                    output_wave = BufferedWaveWriter(
+                        open_wave_writer(output_file, self.params, OUTPUT_RF64), threaded=False, name='segment'
+                    )
+                elif item[0] == 'frames':
+                    output_wave.writeframes(item[1])
+                else:
+                    try:
+                        output_wave.close()
+                    finally:
+                        output_file.close()
+                    nframes = output_wave.bytes_written // (self.params[0] * self.params[1])
+                    logging.info("Wrote segment file {0}".format(filename))
+                    if self.events is not None:
+                        self.events.written(filename, input_frame, nframes)
+                    output_file = output_wave = None
+            except Exception:
+                self.error = sys.exc_info()
+                if output_file is not None:
+                    output_file.close()
+                output_file = output_wave = None
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error[0], error[1], error[2]
+
+def open_segment_files(params, events=None):
+    '''Return SegmentFiles following SPLIT_OUTPUT and SPLIT_WRITERS, None without SPLIT_OUTPUT'''
+    if SPLIT_OUTPUT is None:
+        return None
+    return SegmentFiles(SPLIT_OUTPUT, params, events=events)
+
+class NullWaveWriter(object):
+    '''
+    Writer that discards frames, counting them as BufferedWaveWriter does
+
+    Stands in for the output when only segment files are wanted.
+    '''
+    def __init__(self):
+        self.bytes_written = 0
+
+    def writeframes(self, frames):
+        self.bytes_written += len(frames)
+
+    def flush(self):
+        pass
 
+    def close(self):
+        pass
+
+def open_wave_writer(output_file, params, rf64=False):
+    '''
+    Open an unbuffered wave writer for `output_file`: RF64WaveWriter if
+    `rf64`, otherwise the `wave` module's
+    '''
+    if rf64:
+        return RF64WaveWriter(output_file, params)
     output_wave = wave.open(output_file, 'wb')
     output_wave.setparams((
-        input_wave.getnchannels(),
-        input_wave.getsampwidth(),
-        input_wave.getframerate(),
+        params[0],
+        params[1],
+        params[2],
         0,
         'NONE',
         'not compressed'
     ))
+    return output_wave
 
-    bypass_wave = None
-    if bypass_file is not None:
-        bypass_wave = wave.open(bypass_file, 'wb')
-        bypass_wave.setparams((
-            input_wave.getnchannels(),
-            input_wave.getsampwidth(),
-            input_wave.getframerate(),
-            0,
-            'NONE',
-            'not compressed'
-        ))
+def open_output_wave(output_file, params, name='output', stream=None):
+    '''
+    Open a buffered wave writer for `output_file` with the given input params
 
-    # Print audio setup
-    logging.debug('Input wave params: {0}'.format(input_wave.getparams()))
-    logging.debug('Frame rate: {0} Hz'.format(input_wave.getframerate()))
+    The file format and rolling over to new files follow OUTPUT_RF64,
+    ROLL_BYTES and ROLL_SECONDS. With `stream`, 'raw' or 'wav' as in
+    OUTPUT_STREAM, these are ignored and output is written to the stream
+    unbuffered. `name` labels the writer's metrics. With an `output_file`
+    of None, the output is discarded.
+    '''
+    if output_file is None:
+        return NullWaveWriter()
+    if stream is not None:
+        stream_wave = StreamWaveWriter(output_file, params, header=stream == 'wav')
+        return BufferedWaveWriter(stream_wave, flush_bytes=0, name=name)
+    if ROLL_BYTES or ROLL_SECONDS:
+        output_wave = RollingWaveWriter(output_file, params, ROLL_BYTES, ROLL_SECONDS, OUTPUT_RF64)
+    else:
+        output_wave = open_wave_writer(output_file, params, OUTPUT_RF64)
+    return BufferedWaveWriter(output_wave, name=name)
 
-    delta_limits = (
-        dbfs_to_sample_delta(SILENCE_PEAK_LIMIT, input_wave.getsampwidth()),
-        dbfs_to_sample_delta(SILENCE_IQR_LIMIT, input_wave.getsampwidth())
-    )
+SilenceRemovalResult = collections.namedtuple(
+    'SilenceRemovalResult', 'input_frames output_frames frame_rate'
+)
+
+def input_delta_limits(input_wave):
+    '''Return the current detector's silence limits for `input_wave`'''
+    return current_detector().silence_deltas(input_wave.getsampwidth())
+
+def tag_input_chunks(input_file, input_wave, mapped, jobs=1, channel_stats=None):
+    '''
+    Return the tagged chunk generator for an opened input
+
+    Chunks come from `mapped` if it is not None, analyzed by `jobs`
+    processes when the input is a named file, and from `input_wave`
+    otherwise. Per-channel stats go to `channel_stats`, as in
+    `tag_chunks`.
+    '''
+    delta_limits = input_delta_limits(input_wave)
 
     logging.debug("dBFS delta limits: {0}".format(delta_limits))
     logging.debug("{0} bit delta limits: {1}".format(input_wave.getsampwidth() * 8, delta_limits))
 
-    try:
-        for silent_segment, segment in \
-            segmenter(
-                tag_segments(
-                    tag_chunks(
-                        chunked_samples(input_wave, CHUNK_MS / 1000.0),
-                        delta_limits,
-                        sample_width=input_wave.getsampwidth()
-                    )
-                )
-            ):
-            logging.info("Starting {0} segment.".format("silent" if silent_segment else "audible"))
-            if silent_segment:
-                if bypass_wave is not None:
-                    for chunk_frames in segment:
-                        bypass_wave.writeframes(chunk_frames)
-            else:
-                for chunk_frames in segment:
-                    output_wave.writeframes(chunk_frames)
-                    if bypass_wave is not None:
-                        bypass_wave.writeframes(chunk_frames)
+    if mapped is not None and jobs > 1 and (ADAPTIVE_WINDOW_MS is not None or window_chunks() > 1):
+        # each chunk's stats or limits depend on chunks before it
+        logging.info("Adaptive thresholds and sliding windows need serial analysis, ignoring --jobs.")
+    elif mapped is not None and jobs > 1 and hasattr(input_file, 'name'):
+        return sharded_tag_chunks(
+            input_file.name, mapped, input_wave, CHUNK_MS / 1000.0, delta_limits, jobs, channel_stats
+        )
 
-    except KeyboardInterrupt:
-        pass
-    finally:
-        input_wave.close()
-        output_wave.close()
-        if bypass_wave is not None:
-            bypass_wave.close()
+    if mapped is not None:
+        chunks = mapped_chunked_samples(mapped, input_wave, CHUNK_MS / 1000.0)
+    else:
+        chunks = chunked_samples(input_wave, CHUNK_MS / 1000.0)
+    return tag_chunks(
+        chunks,
+        delta_limits,
+        sample_width=input_wave.getsampwidth(),
+        # batching adds latency, which only matters for streams
+        batch_size=1 if mapped is None else 16,
+        nchannels=input_wave.getnchannels(),
+        channel_stats=channel_stats
+    )
 
-def main(*argv):
-    parser = argparse.ArgumentParser(description='Remove silence from wave audio data.')
-    parser.add_argument(
-        '-i',
-        '--input_filename', 
-        default='-',
-        help='Filename to read. Defaults to - for STDIN.'
+class AnalysisCache(object):
+    '''
+    Per-channel chunk stats of input files, kept on disk in `directory`
+
+    Entries are keyed by the identity of the input file (device, inode,
+    size and modification time) and every setting that changes the
+    stats: input format overrides, analyzed channels, chunk and window
+    length, decimation and the detector. Silence limits, adaptive
+    thresholds and segment timings are applied to the stats afterwards,
+    so they are not part of the key. The stats are stored as doubles,
+    which hold the deltas of 32 bit input exactly.
+
+    Entries are written atomically. Reading an entry marks it as
+    recently used; after every store the least recently used entries are
+    removed until the cache is within `max_bytes`.
+    '''
+    MAGIC = b'SNARPCCH'
+    VERSION = 2
+    HEADER = struct.Struct('<8sHHL')
+    SUFFIX = '.chunks'
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, input_file, input_wave):
+        '''Return the cache key for an opened input, None if it has no stable identity'''
+        try:
+            st = os.fstat(input_file.fileno())
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        policy = CHANNEL_POLICY
+        return json.dumps({
+            'version': self.VERSION,
+            'file': [st.st_dev, st.st_ino, st.st_size, repr(st.st_mtime)],
+            'endianness': INPUT_ENDIANNESS,
+            'signedness': INPUT_SIGNEDNESS,
+            'channels': policy if policy == 'mix' or isinstance(policy, int) else 'each',
+            'chunk_frames': int(input_wave.getframerate() * CHUNK_MS / 1000.0),
+            'window_chunks': window_chunks(),
+            'detector': DETECTOR,
+            'decimation': [ANALYSIS_DECIMATION, ANALYSIS_DECIMATION_MODE],
+        }, sort_keys=True)
+
+    def filename(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key).hexdigest() + self.SUFFIX)
+
+    def load(self, key, nchunks=None):
+        '''
+        Return the cached list of (peak_deltas, iqr_deltas) for `key`, or None
+
+        Entries that are corrupt, truncated or, if `nchunks` is given, not
+        of that many chunks count as missing.
+        '''
+        filename = self.filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                magic, version, nchannels, key_bytes = self.HEADER.unpack(f.read(self.HEADER.size))
+                if magic != self.MAGIC or version != self.VERSION or f.read(key_bytes) != key:
+                    return None
+                data = f.read()
+            deltas = array.array('d')
+            deltas.fromstring(data)
+        except (IOError, struct.error, ValueError):
+            return None
+        row = 2 * nchannels
+        if not row or len(deltas) % row or (nchunks is not None and len(deltas) != nchunks * row):
+            logging.info("Ignoring damaged analysis cache entry {0}".format(filename))
+            return None
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        deltas = [int(delta) for delta in deltas]
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        metrics.count('snarp_analysis_cache_total', result='hit')
+        return [
+            (deltas[i:i + nchannels], deltas[i + nchannels:i + row])
+            for i in xrange(0, len(deltas) - row + 1, row)
+        ]
+
+    def store(self, key, cached_stats):
+        '''Store a list of (peak_deltas, iqr_deltas) under `key`, then evict'''
+        metrics.count('snarp_analysis_cache_total', result='miss')
+        if not cached_stats:
+            return
+        nchannels = len(cached_stats[0][0])
+        deltas = array.array('d')
+        for peaks, iqrs in cached_stats:
+            deltas.extend(float(peak) for peak in peaks)
+            deltas.extend(float(iqr) for iqr in iqrs)
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        filename = self.filename(key)
+        temp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(temp_filename, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.VERSION, nchannels, len(key)))
+            f.write(key)
+            f.write(deltas.tostring())
+        os.rename(temp_filename, filename)
+        self.evict()
+
+    def evict(self):
+        '''Remove least recently used entries until the cache fits in max_bytes'''
+        # other processes may be evicting the same entries at the same time
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for mtime, size, name in entries)
+        for mtime, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info("Evicting {0} from the analysis cache".format(name))
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            total -= size
+
+def _input_cache(input_file, input_wave):
+    # the analysis cache and key for an input, (None, None) without them
+    if ANALYSIS_CACHE_DIR is None:
+        return None, None
+    cache = AnalysisCache(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_BYTES)
+    return cache, cache.key(input_file, input_wave)
+
+def input_chunk_stats(input_file, input_wave, mapped, jobs=1):
+    '''
+    Return the per-channel (peak_deltas, iqr_deltas) of every chunk of mapped input
+
+    The stats come from the analysis cache if ANALYSIS_CACHE_DIR is set
+    and it has them; otherwise the input is analyzed, and the stats are
+    stored in the cache if set.
+    '''
+    cache, key = _input_cache(input_file, input_wave)
+    cached_stats = None if key is None else cache.load(key, mapped_chunk_count(mapped, input_wave))
+    if cached_stats is not None:
+        return cached_stats
+    recorded = []
+    for tagged in tag_input_chunks(
+        input_file, input_wave, mapped, jobs,
+        channel_stats=lambda peaks, iqrs: recorded.append((peaks, iqrs))
+    ):
+        pass
+    if key is not None:
+        cache.store(key, recorded)
+    return recorded
+
+def input_flags(input_file, input_wave, mapped, jobs=1):
+    '''
+    Return the chunk_silent flags of every chunk of mapped input
+
+    With ANALYSIS_CACHE_DIR set, the chunk stats come from the analysis
+    cache if it has them, and are stored there otherwise.
+    '''
+    cache, key = _input_cache(input_file, input_wave)
+    cached_stats = None if key is None else cache.load(key, mapped_chunk_count(mapped, input_wave))
+    if cached_stats is not None:
+        logging.info("Using cached chunk stats")
+        return [
+            silent for silent, samples, frames in tag_cached_chunks(
+                cached_stats, input_delta_limits(input_wave), input_wave.getsampwidth()
+            )
+        ]
+    recorded = []
+    flags = [
+        silent for silent, samples, frames in tag_input_chunks(
+            input_file, input_wave, mapped, jobs,
+            channel_stats=None if key is None else lambda peaks, iqrs: recorded.append((peaks, iqrs))
+        )
+    ]
+    if key is not None:
+        cache.store(key, recorded)
+    return flags
+
+def mapped_segments(input_file, input_wave, mapped, jobs=1):
+    '''
+    Return the segments of mapped wave input as byte ranges
+
+    Every chunk is analyzed first, or its stats taken from the analysis
+    cache, then the flags are segmented at once by `segment_flags`.
+    Returns a list of (segment_silent, start, stop) byte offsets into
+    `mapped`.
+    '''
+    flags = input_flags(input_file, input_wave, mapped, jobs)
+    chunk_bytes = int(input_wave.getframerate() * CHUNK_MS / 1000.0) * input_wave.getsampwidth() * input_wave.getnchannels()
+    return [
+        (silent, start * chunk_bytes, min(mapped.size, stop * chunk_bytes))
+        for silent, start, stop in segment_flags(flags)
+    ]
+
+def remove_silences(input_file, output_file, bypass_file=None, map_input=True, jobs=1):
+    '''
+    Copy the audible segments of wave `input_file` to `output_file`
+
+    The input is raw PCM instead if RAW_INPUT_FORMAT is set.
+
+    If `bypass_file` is given, all input is copied there too. Regular
+    input files are memory mapped unless `map_input` is False or
+    OUTPUT_STREAM is set; they are analyzed in full before any output is
+    written, then segmented by `mapped_segments` and each segment is
+    written as one contiguous range of the input. Mapped files named on
+    disk are analyzed by `jobs` processes in parallel. Other input is
+    written as it is analyzed. Segment events go to
+    SEGMENT_EVENTS_OUTPUT, see SegmentEvents. With SPLIT_OUTPUT, every
+    audible segment is written to a file of its own too, see
+    SegmentFiles; `output_file` may then be None to write only those.
+
+    Returns a SilenceRemovalResult with the number of frames read and
+    written.
+    '''
+    input_wave = open_input_wave(input_file)
+    frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+    # raw input has no data chunk to map, and mapped input is analyzed in
+    # full before any output is written, too late for streamed output
+    if map_input and RAW_INPUT_FORMAT is None and OUTPUT_STREAM is None:
+        mapped = MappedWaveData.open(input_file, frame_width)
+    else:
+        mapped = None
+
+    # only the output is streamed, the bypass file is a file as usual
+    output_wave = open_output_wave(output_file, input_wave.getparams(), stream=OUTPUT_STREAM)
+
+    bypass_wave = None
+    if bypass_file is not None:
+        bypass_wave = open_output_wave(bypass_file, input_wave.getparams(), name='bypass')
+
+    # Print audio setup
+    logging.debug('Input wave params: {0}'.format(input_wave.getparams()))
+    logging.debug('Frame rate: {0} Hz'.format(input_wave.getframerate()))
+
+    events = SegmentEvents(SEGMENT_EVENTS_OUTPUT, frame_width, input_wave.getframerate())
+    segment_files = open_segment_files(input_wave.getparams(), events)
+    offset = 0
+    try:
+        if mapped is not None:
+            segments = mapped_segments(input_file, input_wave, mapped, jobs)
+        else:
+            segments = segmenter(tag_segments(tag_input_chunks(input_file, input_wave, mapped, jobs)))
+        for segment in segments:
+            if mapped is not None:
+                silent_segment, start, offset = segment
+                segment = mapped.views(start, offset)
+            else:
+                silent_segment, segment = segment
+            logging.info("Starting {0} segment.".format("silent" if silent_segment else "audible"))
+            if silent_segment:
+                if bypass_wave is not None or mapped is None:
+                    for chunk_frames in segment:
+                        events.frames(True, len(chunk_frames))
+                        if bypass_wave is not None:
+                            bypass_wave.writeframes(chunk_frames)
+                else:
+                    events.frames(True, offset - start)
+            else:
+                if segment_files is not None:
+                    segment_files.start(events.input_frame)
+                for chunk_frames in segment:
+                    events.frames(False, len(chunk_frames))
+                    output_wave.writeframes(chunk_frames)
+                    if segment_files is not None:
+                        segment_files.writeframes(chunk_frames)
+                    if bypass_wave is not None:
+                        bypass_wave.writeframes(chunk_frames)
+                if segment_files is not None:
+                    segment_files.end()
+        events.close()
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        input_frames = offset // frame_width if mapped is not None else input_wave.tell()
+        input_wave.close()
+        try:
+            output_wave.close()
+        finally:
+            try:
+                if bypass_wave is not None:
+                    bypass_wave.close()
+            finally:
+                if segment_files is not None:
+                    segment_files.close()
+
+    return SilenceRemovalResult(
+        input_frames,
+        output_wave.bytes_written // frame_width,
+        input_wave.getframerate()
     )
-    parser.add_argument(
-        '-b',
-        '--bypass_filename',
-        default=None,
-        help='Filename to write bypass audio to. All audio data read from the input will be passed through.'
+
+class LivePipeline(object):
+    '''
+    Silence removal for live input with one thread per stage
+
+    A reader thread reads chunks from `input_wave`, an analyzer thread
+    runs `tag_chunks` and `tag_segments` on them, and `run` writes the
+    tagged chunks in the calling thread. Stages are connected by queues
+    of at most `queue_chunks` chunks.
+
+    The reader never waits for the analyzer, so the input pipe is always
+    drained. If the analysis queue is full the chunk is held back (a
+    backpressure event); once more than `spill_chunks` chunks are held
+    back the oldest is dropped (an overrun). `counters` holds these and
+    other counts and is safe to read while the pipeline runs; they are
+    also recorded to the metrics, along with the queue depths.
+
+    With SPLIT_OUTPUT, audible segments are also written to files of
+    their own by `segment_files`, whose threads open, write and close
+    the files, so the writing stage only hands them frames.
+    '''
+    def __init__(self, input_wave, output_wave, bypass_wave=None, queue_chunks=None, spill_chunks=None):
+        self.input_wave = input_wave
+        self.output_wave = output_wave
+        self.bypass_wave = bypass_wave
+        self.events = SegmentEvents(
+            SEGMENT_EVENTS_OUTPUT,
+            input_wave.getsampwidth() * input_wave.getnchannels(),
+            input_wave.getframerate()
+        )
+        self.segment_files = open_segment_files(input_wave.getparams(), self.events)
+        self.frames_per_chunk = int(input_wave.getframerate() * CHUNK_MS / 1000.0)
+        self.spill_chunks = LIVE_SPILL_CHUNKS if spill_chunks is None else spill_chunks
+        queue_chunks = LIVE_QUEUE_CHUNKS if queue_chunks is None else queue_chunks
+        self.analysis_queue = Queue.Queue(maxsize=queue_chunks)
+        self.write_queue = Queue.Queue(maxsize=queue_chunks)
+        self.stopping = False
+        self.error = None
+        self.counters = {
+            'frames_read': 0,
+            'chunks_read': 0,
+            'chunks_written': 0,
+            'backpressure_events': 0,
+            'overruns': 0,
+            'max_spilled_chunks': 0,
+        }
+
+    def run(self):
+        '''Process the input until it ends; return the number of frames read'''
+        threads = [
+            threading.Thread(target=self._guard(self._read), name='snarp-reader'),
+            threading.Thread(target=self._guard(self._analyze), name='snarp-analyzer'),
+        ]
+        for thread in threads:
+            # a reader blocked on a silent pipe must not keep us alive
+            thread.daemon = True
+            thread.start()
+        try:
+            self._write()
+        except PipelineStopped:
+            # another stage failed, its error is raised below
+            if self.error is None:
+                raise
+        finally:
+            self.stopping = True
+            # the reader may be stuck reading a quiet pipe, but the
+            # analyzer notices `stopping` within one queue timeout
+            threads[1].join(1.0)
+            logging.info("Live pipeline counters: {0}".format(self.counters))
+            if self.segment_files is not None:
+                self.segment_files.close()
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.counters['frames_read']
+
+    def _guard(self, target):
+        def guarded():
+            try:
+                target()
+            except PipelineStopped:
+                pass
+            except Exception:
+                self.error = sys.exc_info()
+                self.stopping = True
+        return guarded
+
+    def _read(self):
+        spilled = collections.deque()
+        frame_width = self.input_wave.getsampwidth() * self.input_wave.getnchannels()
+        meter = ReadMeter(self.input_wave.getframerate())
+        frames = True
+        while frames and not self.stopping:
+            started = meter.start()
+            frames = self.input_wave.readframes(self.frames_per_chunk)
+            if not is_immutable(frames):
+                # a view of a raw input buffer, which is reused
+                frames = frames.tobytes()
+            meter.record(started, len(frames) // frame_width)
+            self.counters['frames_read'] += len(frames) // frame_width
+            self.counters['chunks_read'] += 1
+            # an empty string marks the end of the input
+            spilled.append(frames)
+            while spilled:
+                try:
+                    self.analysis_queue.put_nowait(spilled[0])
+                except Queue.Full:
+                    self.counters['backpressure_events'] += 1
+                    metrics.count('snarp_live_backpressure_events_total')
+                    break
+                spilled.popleft()
+            if len(spilled) > self.spill_chunks:
+                spilled.popleft()
+                self.counters['overruns'] += 1
+                metrics.count('snarp_live_overruns_total')
+                logging.warning("Live pipeline overrun, dropped a chunk of input.")
+            self.counters['max_spilled_chunks'] = max(self.counters['max_spilled_chunks'], len(spilled))
+            if metrics.enabled:
+                metrics.gauge('snarp_live_spilled_chunks', len(spilled))
+                metrics.gauge('snarp_live_queued_chunks', self.analysis_queue.qsize(), queue='analysis')
+        # the input is exhausted, nothing left to drain
+        for frames in spilled:
+            self._put(self.analysis_queue, frames)
+
+    def _chunks(self):
+        sample_width = self.input_wave.getsampwidth()
+        nchannels = self.input_wave.getnchannels()
+        signed_data = input_is_signed_data(self.input_wave)
+        while True:
+            frames = self._get(self.analysis_queue)
+            yield analysis_samples(frames, sample_width, nchannels, signed_data), frames
+            if not frames:
+                return
+
+    def _analyze(self):
+        for tagged in tag_segments(tag_chunks(
+            self._chunks(),
+            input_delta_limits(self.input_wave),
+            sample_width=self.input_wave.getsampwidth(),
+            nchannels=self.input_wave.getnchannels()
+        )):
+            silent, frames = tagged
+            if not is_immutable(frames):
+                # a view of the roll buffer, which tag_segments reuses
+                tagged = silent, bytearray(frames)
+            self._put(self.write_queue, tagged)
+        self._put(self.write_queue, None)
+
+    def _write(self):
+        segment_silent = None
+        events = self.events
+        while True:
+            tagged = self._get(self.write_queue)
+            if tagged is None:
+                events.close()
+                return
+            silent, frames = tagged
+            if metrics.enabled:
+                metrics.gauge('snarp_live_queued_chunks', self.write_queue.qsize(), queue='write')
+            if silent != segment_silent:
+                logging.info("Starting {0} segment.".format("silent" if silent else "audible"))
+                segment_silent = silent
+                if self.segment_files is not None:
+                    if silent:
+                        self.segment_files.end()
+                    else:
+                        self.segment_files.start(events.input_frame)
+            events.frames(silent, len(frames))
+            if not silent:
+                self.output_wave.writeframes(frames)
+                if self.segment_files is not None:
+                    self.segment_files.writeframes(frames)
+            if self.bypass_wave is not None:
+                self.bypass_wave.writeframes(frames)
+            self.counters['chunks_written'] += 1
+
+    def _put(self, queue, item):
+        # time out now and then so KeyboardInterrupt and errors get through
+        while not self.stopping:
+            try:
+                queue.put(item, timeout=0.1)
+                return
+            except Queue.Full:
+                pass
+        raise PipelineStopped()
+
+    def _get(self, queue):
+        while not self.stopping:
+            try:
+                return queue.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        raise PipelineStopped()
+
+class PipelineStopped(Exception):
+    '''Raised in pipeline stages when the pipeline is shutting down'''
+
+def live_remove_silences(input_file, output_file, bypass_file=None):
+    '''
+    Like `remove_silences`, but for live input, using a `LivePipeline`
+
+    Returns a SilenceRemovalResult.
+    '''
+    input_wave = open_input_wave(input_file)
+    frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+
+    # only the output is streamed, the bypass file is a file as usual
+    output_wave = open_output_wave(output_file, input_wave.getparams(), stream=OUTPUT_STREAM)
+
+    bypass_wave = None
+    if bypass_file is not None:
+        bypass_wave = open_output_wave(bypass_file, input_wave.getparams(), name='bypass')
+
+    pipeline = LivePipeline(input_wave, output_wave, bypass_wave)
+    try:
+        pipeline.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        input_wave.close()
+        try:
+            output_wave.close()
+        finally:
+            if bypass_wave is not None:
+                bypass_wave.close()
+
+    return SilenceRemovalResult(
+        pipeline.counters['frames_read'],
+        output_wave.bytes_written // frame_width,
+        input_wave.getframerate()
     )
-    parser.add_argument(
-        'output_filename', 
-        help='Filename to write to.'
+
+def ignore_stats(peak_delta, iqr_delta, sample_width):
+    '''Stats sink that drops all stats'''
+
+class SilenceDetector(object):
+    '''
+    Silence detection with settings of its own
+
+    The module functions take their settings from module globals, which
+    the context managers change for every thread at once. A detector
+    copies the current globals when it is created, overridden by any of
+    the keyword settings below, and passes its settings to the functions
+    explicitly. Detectors with different settings can thus run side by
+    side on threads, and one detector can serve many streams at once, as
+    every call keeps its buffers to itself.
+
+    Settings:
+    detector               name of the chunk detector, see DETECTORS
+    peak_limit, iqr_limit, rms_limit, zcr_limit
+                           silence limits, see SILENCE_*_LIMIT
+    endianness             input endianness, 'little' or 'big'
+    signedness             'signed', 'unsigned' or None to follow the Wave spec
+    channel_policy         see CHANNEL_POLICY
+    chunk_ms               milliseconds per analyzed chunk
+    window_ms              milliseconds analyzed per chunk, None for chunk_ms
+    decimation, decimation_mode
+                           see ANALYSIS_DECIMATION
+    hysteresis_ms, pre_roll_ms, post_roll_ms
+                           segment timings, multiples of chunk_ms
+    adaptive               AdaptiveSettings, window in chunks
+    stats_sink             called like push_stats for every chunk, or None
+    '''
+    SETTINGS = (
+        'detector', 'peak_limit', 'iqr_limit', 'rms_limit', 'zcr_limit', 'endianness', 'signedness', 'channel_policy',
+        'chunk_ms', 'window_ms', 'decimation', 'decimation_mode', 'hysteresis_ms', 'pre_roll_ms', 'post_roll_ms',
+        'adaptive', 'stats_sink',
     )
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(self.SETTINGS)
+        if unknown:
+            raise TypeError("Unknown detector settings: {0}".format(', '.join(sorted(unknown))))
+        values = dict(
+            detector=DETECTOR,
+            peak_limit=SILENCE_PEAK_LIMIT,
+            iqr_limit=SILENCE_IQR_LIMIT,
+            rms_limit=SILENCE_RMS_LIMIT,
+            zcr_limit=SILENCE_ZCR_LIMIT,
+            endianness=INPUT_ENDIANNESS,
+            signedness=INPUT_SIGNEDNESS,
+            channel_policy=CHANNEL_POLICY,
+            chunk_ms=CHUNK_MS,
+            window_ms=WINDOW_MS,
+            decimation=ANALYSIS_DECIMATION,
+            decimation_mode=ANALYSIS_DECIMATION_MODE,
+            hysteresis_ms=HYSTERESIS_MS,
+            pre_roll_ms=PRE_ROLL_MS,
+            post_roll_ms=POST_ROLL_MS,
+            adaptive=current_adaptive_settings(),
+            stats_sink=None,
+        )
+        values.update(settings)
+        if values['window_ms'] is None:
+            # resolved now, or the window would follow WINDOW_MS as it changes
+            values['window_ms'] = values['chunk_ms']
+        for name in self.SETTINGS:
+            setattr(self, name, values[name])
+
+    def copy(self, **settings):
+        '''Return a detector with the same settings except those given'''
+        values = dict((name, getattr(self, name)) for name in self.SETTINGS)
+        values.update(settings)
+        return SilenceDetector(**values)
+
+    def chunk_detector(self):
+        '''Return our ChunkDetector, with our limits'''
+        return DETECTORS[self.detector](SilenceLimits(self.peak_limit, self.iqr_limit, self.rms_limit, self.zcr_limit))
+
+    def silence_deltas(self, sample_width):
+        '''Return our chunk detector's limits'''
+        return self.chunk_detector().silence_deltas(sample_width)
+
+    def signed_data(self, input_wave):
+        '''Like input_is_signed_data, with our signedness'''
+        if self.signedness is None:
+            return input_wave.getsampwidth() > 1
+        return self.signedness == 'signed'
+
+    def timings(self):
+        '''Return the (hysteresis, pre-roll, post-roll) timings in chunks'''
+        return tuple(
+            int(float(ms) / self.chunk_ms) for ms in (self.hysteresis_ms, self.pre_roll_ms, self.post_roll_ms)
+        )
+
+    def chunked_samples(self, input_wave):
+        return chunked_samples(
+            input_wave, self.chunk_ms / 1000.0, self.signed_data(input_wave), self.endianness,
+            self.decimation, self.decimation_mode
+        )
+
+    def tag_chunks(self, chunk_gen, sample_width, nchannels=1, batch_size=1):
+        detector = self.chunk_detector()
+        return tag_chunks(
+            chunk_gen,
+            detector.silence_deltas(sample_width),
+            sample_width,
+            batch_size,
+            nchannels,
+            policy=self.channel_policy,
+            adaptive=self.adaptive,
+            stats=ignore_stats if self.stats_sink is None else self.stats_sink,
+            window=window_chunks(self.chunk_ms, self.window_ms),
+            detector=detector
+        )
+
+    def tag_segments(self, tagged_chunks):
+        return tag_segments(tagged_chunks, *self.timings())
+
+    def segments(self, input_wave, batch_size=1):
+        '''
+        Generator returning (chunk_in_silent_segment, chunk_frames) for
+        every chunk of `input_wave`, as `tag_segments`
+        '''
+        return self.tag_segments(self.tag_chunks(
+            self.chunked_samples(input_wave),
+            input_wave.getsampwidth(),
+            input_wave.getnchannels(),
+            batch_size
+        ))
+
+    def process(self, input_wave, output_wave, bypass_wave=None, stopping=None):
+        '''
+        Write the audible chunks of `input_wave` to `output_wave`
+
+        All chunks are also written to `bypass_wave`, if given. Stops
+        early once `stopping`, if given, returns True. Returns a
+        SilenceRemovalResult.
+        '''
+        frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+        output_bytes = 0
+        for silent, frames in self.segments(input_wave):
+            if not silent:
+                output_wave.writeframes(frames)
+                output_bytes += len(frames)
+            if bypass_wave is not None:
+                bypass_wave.writeframes(frames)
+            if stopping is not None and stopping():
+                break
+        return SilenceRemovalResult(
+            input_wave.tell(),
+            output_bytes // frame_width,
+            input_wave.getframerate()
+        )
+
+class StreamServer(object):
+    '''
+    Remove silence from many wave streams at once, one thread per stream
+
+    Every stream is processed by `detector`, which all streams share, and
+    its audible parts are written to `output_dir` under the stream's
+    name. `results` maps the names of ended streams to their
+    SilenceRemovalResult, or to the exception that ended them.
+    '''
+    def __init__(self, detector, output_dir):
+        self.detector = detector
+        self.output_dir = output_dir
+        self.stopping = False
+        self.threads = []
+        self.results = {}
+        self.listener = None
+
+    def add_stream(self, name, open_input):
+        '''Process the wave stream returned by `open_input()` on a new thread'''
+        thread = threading.Thread(target=self._run, args=(name, open_input), name='snarp-stream-' + name)
+        # a stream blocked on a quiet pipe must not keep us alive
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def add_fifo(self, filename):
+        '''Process the wave stream written to FIFO (or file) `filename`'''
+        name = os.path.splitext(os.path.basename(filename))[0]
+        self.add_stream(name, lambda: open(filename, 'rb'))
+
+    def listen(self, host, port):
+        '''
+        Accept wave streams over TCP on (`host`, `port`), one per connection
+
+        Returns the address listened on.
+        '''
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(16)
+        thread = threading.Thread(target=self._accept, name='snarp-listener')
+        thread.daemon = True
+        thread.start()
+        return self.listener.getsockname()
+
+    def wait(self):
+        '''Wait until all streams have ended, forever when listening; then stop'''
+        try:
+            while self.listener is not None or any(thread.is_alive() for thread in list(self.threads)):
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        '''Stop accepting streams and wait a little for running ones to stop'''
+        self.stopping = True
+        if self.listener is not None:
+            try:
+                # wakes up the accepting thread
+                self.listener.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.listener.close()
+        for thread in list(self.threads):
+            thread.join(1.0)
+
+    def _accept(self):
+        count = 0
+        while not self.stopping:
+            try:
+                connection, address = self.listener.accept()
+            except socket.error:
+                if self.stopping:
+                    return
+                raise
+            count += 1
+            name = '{0}-{1}-{2}'.format(time.strftime('%Y%m%d-%H%M%S'), address[0], count)
+            self.add_stream(name, lambda connection=connection: self._socket_input(connection))
+
+    def _socket_input(self, connection):
+        input_file = connection.makefile('rb')
+        # the file keeps the connection open until it is closed itself
+        connection.close()
+        return input_file
+
+    def _run(self, name, open_input):
+        try:
+            input_file = open_input()
+            output_file = None
+            try:
+                input_wave = wave.open(input_file)
+                # RF64 and rolling output need a file object, not a path
+                output_file = open(os.path.join(self.output_dir, name + '.wav'), 'wb')
+                output_wave = open_output_wave(output_file, input_wave.getparams())
+                try:
+                    result = self.detector.process(input_wave, output_wave, stopping=lambda: self.stopping)
+                finally:
+                    output_wave.close()
+            finally:
+                try:
+                    input_file.close()
+                finally:
+                    if output_file is not None:
+                        output_file.close()
+        except Exception as e:
+            logging.exception("Stream {0} failed.".format(name))
+            self.results[name] = e
+            return
+        logging.info("Stream {0} ended, {1} frames in, {2} frames out.".format(
+            name, result.input_frames, result.output_frames
+        ))
+        self.results[name] = result
+
+# Version of the segment index format written by index_silences
+INDEX_VERSION = 1
+
+def index_silences(input_file, index_file, with_stats=False, jobs=1):
+    '''
+    Write a segment index of wave `input_file` to `index_file`
+
+    The input is raw PCM instead if RAW_INPUT_FORMAT is set.
+
+    Runs the same analysis as `remove_silences` but, instead of copying
+    audio, records the [start, end) frame range of every audible segment
+    as JSON. With `with_stats`, the raw peak and IQR sample deltas of
+    every chunk are included. Use `splice` to write audio from indexes.
+
+    Returns a SilenceRemovalResult with the number of frames read and
+    the number of frames in audible segments.
+    '''
+    input_wave = open_input_wave(input_file)
+    frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+    mapped = MappedWaveData.open(input_file, frame_width) if RAW_INPUT_FORMAT is None else None
+
+    chunk_stats = []
+    def record_stats(peak_delta, iqr_delta, sample_width):
+        chunk_stats.append((int(peak_delta), int(iqr_delta)))
+        previous_push_stats(peak_delta, iqr_delta, sample_width)
+    previous_push_stats = push_stats
+
+    segments = []
+    frame = 0
+    try:
+        with stats_sink(record_stats if with_stats else push_stats):
+            if mapped is not None:
+                lengths = [
+                    (silent, (stop - start) // frame_width)
+                    for silent, start, stop in mapped_segments(input_file, input_wave, mapped, jobs)
+                ]
+            else:
+                lengths = (
+                    (silent, sum(len(chunk_frames) for chunk_frames in segment) // frame_width)
+                    for silent, segment in segmenter(tag_segments(
+                        tag_input_chunks(input_file, input_wave, mapped, jobs)
+                    ))
+                )
+            for silent_segment, nframes in lengths:
+                if not silent_segment:
+                    segments.append((frame, frame + nframes))
+                frame += nframes
+    finally:
+        input_wave.close()
+
+    name = getattr(input_file, 'name', None)
+    index = {
+        'version': INDEX_VERSION,
+        'input': os.path.abspath(name) if isinstance(name, basestring) and name != '<stdin>' else None,
+        'nchannels': input_wave.getnchannels(),
+        'sampwidth': input_wave.getsampwidth(),
+        'framerate': input_wave.getframerate(),
+        'nframes': frame,
+        'chunk_frames': int(input_wave.getframerate() * CHUNK_MS / 1000.0),
+        'segments': segments,
+    }
+    if with_stats:
+        index['chunk_stats'] = chunk_stats
+    json.dump(index, index_file, separators=(',', ':'), sort_keys=True)
+    index_file.write('\n')
+
+    return SilenceRemovalResult(
+        frame,
+        sum(end - start for start, end in segments),
+        input_wave.getframerate()
+    )
+
+def splice(indexes, output_file):
+    '''
+    Write the audible segments listed in `indexes` to `output_file`
+
+    `indexes` are index dicts as written by `index_silences`; segments of
+    all of them are concatenated in order. Their inputs are read with
+    large sequential reads and must all have the same wave format.
+
+    Returns the number of frames written.
+    '''
+    params = None
+    output_wave = None
+    try:
+        for index in indexes:
+            if index.get('version') != INDEX_VERSION:
+                raise ValueError("Unsupported index version {0!r}".format(index.get('version')))
+            if index['input'] is None:
+                raise ValueError("Index does not name its input file")
+            index_params = (index['nchannels'], index['sampwidth'], index['framerate'])
+            if params is None:
+                params = index_params
+                output_wave = open_output_wave(output_file, params)
+            elif index_params != params:
+                raise ValueError("{0} has format {1}, expected {2}".format(index['input'], index_params, params))
+            frame_width = index['nchannels'] * index['sampwidth']
+            with open(index['input'], 'rb') as input_file:
+                input_wave = wave.open(input_file)
+                if input_wave.getnframes() < index['nframes']:
+                    raise ValueError("{0} is shorter than when it was indexed".format(index['input']))
+                mapped = MappedWaveData.open(input_file, frame_width)
+                for start, end in index['segments']:
+                    for frames in mapped.views(start * frame_width, end * frame_width):
+                        output_wave.writeframes(frames)
+    finally:
+        if output_wave is not None:
+            output_wave.close()
+    return 0 if output_wave is None else output_wave.bytes_written // frame_width
+
+SweepConfiguration = collections.namedtuple(
+    'SweepConfiguration', 'peak_limit iqr_limit hysteresis_ms pre_roll_ms post_roll_ms'
+)
+
+SweepResult = collections.namedtuple(
+    'SweepResult', 'configuration kept_frames frame_rate segments min_seconds median_seconds p90_seconds max_seconds'
+)
+
+def sweep_configurations(peak_limits, iqr_limits, hysteresis_ms, pre_roll_ms, post_roll_ms):
+    '''Return the grid of every combination of the given settings as SweepConfigurations'''
+    return [
+        SweepConfiguration(*settings)
+        for settings in itertools.product(peak_limits, iqr_limits, hysteresis_ms, pre_roll_ms, post_roll_ms)
+    ]
+
+def sweep(input_file, configurations, jobs=1):
+    '''
+    Evaluate silence removal settings on wave `input_file` without writing audio
+
+    The input is analyzed once (or its stats taken from the analysis
+    cache); every SweepConfiguration in `configurations` is then applied
+    to the chunk stats by `tag_cached_chunks` and `segment_flags`, by
+    `jobs` processes. Everything else - format overrides, channel
+    policy, chunk, window and adaptive settings and the detector -
+    follows the globals. The rms and zcr detectors take their RMS limit
+    from the IQR limits swept unless SILENCE_RMS_LIMIT is set.
+
+    Returns a SweepResult for each configuration, in order: the frames
+    that would be kept, the input frame rate, the number of audible segments and the shortest,
+    median, 90th percentile and longest segment in seconds.
+    '''
+    input_wave = wave.open(input_file)
+    frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+    mapped = MappedWaveData.open(input_file, frame_width)
+    if mapped is None:
+        raise ValueError("Sweeping needs a regular wave file")
+    try:
+        cached_stats = input_chunk_stats(input_file, input_wave, mapped, jobs)
+    finally:
+        input_wave.close()
+    state = (
+        cached_stats,
+        input_wave.getsampwidth(),
+        input_wave.getframerate(),
+        mapped.size // frame_width,
+        CHUNK_MS,
+        CHANNEL_POLICY,
+        current_adaptive_settings(),
+        current_detector(),
+    )
+    if jobs <= 1:
+        _sweep_init(state)
+        return [_sweep_job(configuration) for configuration in configurations]
+    pool = multiprocessing.Pool(jobs, initializer=_sweep_init, initargs=(state,))
+    try:
+        results = pool.map(_sweep_job, configurations)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+# the chunk stats and settings shared by all configurations of a sweep
+_sweep_state = None
+
+def _sweep_init(state):
+    global _sweep_state, metrics
+    _sweep_state = state
+    if multiprocessing.current_process().name != 'MainProcess':
+        metrics = NullMetrics()
+
+def _sweep_job(configuration):
+    cached_stats, sample_width, frame_rate, nframes, chunk_ms, policy, adaptive, detector = _sweep_state
+    detector = type(detector)(detector.limits._replace(peak=configuration.peak_limit, iqr=configuration.iqr_limit))
+    flags = [
+        silent for silent, samples, frames in tag_cached_chunks(
+            cached_stats, detector.silence_deltas(sample_width), sample_width, policy, adaptive, ignore_stats, detector
+        )
+    ]
+    chunk_frames = int(frame_rate * chunk_ms / 1000.0)
+    lengths = sorted(
+        min(nframes, stop * chunk_frames) - start * chunk_frames
+        for silent, start, stop in segment_flags(
+            flags,
+            int(float(configuration.hysteresis_ms) / chunk_ms),
+            int(float(configuration.pre_roll_ms) / chunk_ms),
+            int(float(configuration.post_roll_ms) / chunk_ms)
+        )
+        if not silent
+    )
+    seconds = [float(length) / frame_rate for length in lengths] or [0.0]
+    return SweepResult(
+        configuration,
+        sum(lengths),
+        frame_rate,
+        len(lengths),
+        seconds[0],
+        seconds[len(seconds) // 2],
+        seconds[min(len(seconds) - 1, int(len(seconds) * 0.9))],
+        seconds[-1]
+    )
+
+def channel_policy_arg(value):
+    '''argparse type for --channel-policy'''
+    if value in ('any', 'all', 'mix'):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected any, all, mix or a channel number, got {0!r}".format(value))
+
+def add_settings_arguments(parser):
+    '''
+    Add the silence detection and output options shared by all commands
+    '''
     parser.add_argument(
         '--whisper',
         action='store_true',
@@ -497,6 +3933,27 @@ def main(*argv):
         type=float,
         help='50th percential sample level, in dBFS (thus negative), to consider a sample "silent." Overrides preset values.'
     )
+    parser.add_argument(
+        '--detector',
+        choices=sorted(DETECTORS),
+        default=DETECTOR,
+        help='How chunks are judged: "peak-iqr" by their peak and IQR levels (the default), "rms" by their '
+            'RMS level, which is cheaper, or "zcr" by their RMS level and zero crossing rate, which ignores steady hiss.'
+    )
+    parser.add_argument(
+        '--silence-rms-limit',
+        type=float,
+        default=None,
+        help='RMS level, in dBFS, to consider a chunk "silent" with the rms and zcr detectors. '
+            'Defaults to the IQR limit.'
+    )
+    parser.add_argument(
+        '--silence-zcr-limit',
+        type=float,
+        default=SILENCE_ZCR_LIMIT,
+        help='With the zcr detector, zero crossings per sample above which a chunk is noise. '
+            'Defaults to {0:g}.'.format(SILENCE_ZCR_LIMIT)
+    )
     parser.add_argument(
         '--input-big-endian',
         action='store_true',
@@ -508,12 +3965,602 @@ def main(*argv):
         default=None,
         help='Ignore the Wave spec and interpret input with given signedness. Not recommended.'
     )
+    parser.add_argument(
+        '--channel-policy',
+        type=channel_policy_arg,
+        default=CHANNEL_POLICY,
+        help='How channels decide whether a chunk is silent: "any" (audible if any channel is audible, the default), '
+            '"all" (audible only if every channel is), "mix" (analyze the mixdown) or a channel number counting from 0.'
+    )
+    parser.add_argument(
+        '--hop',
+        type=int,
+        default=CHUNK_MS,
+        help='Milliseconds between silence decisions. Hysteresis, pre- and post-roll are rounded down to '
+            'whole hops. Defaults to {0}.'.format(CHUNK_MS)
+    )
+    parser.add_argument(
+        '--window',
+        type=int,
+        default=None,
+        help='Milliseconds of audio each decision is based on, a multiple of --hop. Defaults to one hop.'
+    )
+    parser.add_argument(
+        '--decimate',
+        type=int,
+        default=1,
+        help='Analyze only every Nth frame (or block of N frames, see --decimate-mode) for cheaper analysis '
+            'of high rate input. The output is not decimated. Defaults to 1, analyzing every frame.'
+    )
+    parser.add_argument(
+        '--decimate-mode',
+        choices=DECIMATION_MODES,
+        default=ANALYSIS_DECIMATION_MODE,
+        help='With --decimate, analyze every Nth frame ("stride", the default) or the minimum and maximum '
+            'of every N frames ("envelope"), which keeps short peaks.'
+    )
+    parser.add_argument(
+        '--adaptive-window',
+        type=float,
+        default=None,
+        help='Adapt the silence limits to the noise floor of about this many seconds of input. '
+            'The preset or given limits are the lowest the limits go.'
+    )
+    parser.add_argument(
+        '--adaptive-quantile',
+        type=float,
+        default=ADAPTIVE_QUANTILE,
+        help='With --adaptive-window, the fraction of chunks at or below the noise floor. Defaults to {0:g}.'.format(
+            ADAPTIVE_QUANTILE
+        )
+    )
+    parser.add_argument(
+        '--adaptive-margin',
+        type=float,
+        default=ADAPTIVE_MARGIN_DB,
+        help='With --adaptive-window, set the limits this many dB above the noise floor. Defaults to {0:g}.'.format(
+            ADAPTIVE_MARGIN_DB
+        )
+    )
+    parser.add_argument(
+        '--adaptive-max-rise',
+        type=float,
+        default=ADAPTIVE_MAX_RISE_DB,
+        help='With --adaptive-window, raise the limits at most this many dB. Defaults to {0:g}.'.format(
+            ADAPTIVE_MAX_RISE_DB
+        )
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='Keep the chunk stats of input files in this directory, so re-runs on the same files with '
+            'other limits or timings skip decoding them.'
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=ANALYSIS_CACHE_BYTES,
+        help='With --cache-dir, evict the least recently used stats beyond this many bytes. Defaults to {0}.'.format(
+            ANALYSIS_CACHE_BYTES
+        )
+    )
+    add_buffering_arguments(parser)
+
+def add_buffering_arguments(parser):
+    '''
+    Add the output buffering options
+    '''
+    parser.add_argument(
+        '--flush-size',
+        type=int,
+        default=FLUSH_BYTES,
+        help='Buffer up to this many bytes of output before writing them out. Defaults to {0}.'.format(FLUSH_BYTES)
+    )
+    parser.add_argument(
+        '--flush-interval',
+        type=float,
+        default=FLUSH_SECONDS,
+        help='Write out buffered output at least this often, in seconds. Defaults to {0:g}.'.format(FLUSH_SECONDS)
+    )
+    parser.add_argument(
+        '--write-behind',
+        action='store_true',
+        help='Write output on a background thread so slow storage does not stall reading the input.'
+    )
+    parser.add_argument(
+        '--rf64',
+        action='store_true',
+        help='Write output files that turn into RF64 files instead of failing once they reach 4 GB.'
+    )
+    parser.add_argument(
+        '--roll-size',
+        type=int,
+        default=None,
+        help='Start a new output file, numbered after the first, whenever the current one holds this many bytes.'
+    )
+    parser.add_argument(
+        '--roll-interval',
+        type=float,
+        default=None,
+        help='Start a new output file, numbered after the first, whenever the current one holds this many '
+            'seconds of audio.'
+    )
+
+def add_metrics_arguments(parser):
+    '''
+    Add the metrics export options
+    '''
+    parser.add_argument(
+        '--metrics-textfile',
+        default=None,
+        help='Periodically rewrite this file with metrics in the Prometheus text format, '
+            'e.g. in the node exporter\'s textfile collector directory.'
+    )
+    parser.add_argument(
+        '--metrics-jsonl',
+        default=None,
+        help='Periodically append metrics to this file as lines of JSON.'
+    )
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=METRICS_INTERVAL,
+        help='Seconds between metrics exports. Defaults to {0:g}.'.format(METRICS_INTERVAL)
+    )
+
+def add_raw_input_arguments(parser):
+    '''
+    Add the raw PCM input options
+    '''
+    parser.add_argument(
+        '--raw-format',
+        choices=sorted(RAW_FORMATS),
+        default=None,
+        help='Read headerless PCM in this ALSA sample format, as "arecord -t raw -f FORMAT" writes it, '
+            'instead of a wave file. The output is a wave file as usual.'
+    )
+    parser.add_argument(
+        '--raw-rate',
+        type=int,
+        default=RAW_INPUT_RATE,
+        help='With --raw-format, frames per second. Defaults to {0}.'.format(RAW_INPUT_RATE)
+    )
+    parser.add_argument(
+        '--raw-channels',
+        type=int,
+        default=RAW_INPUT_CHANNELS,
+        help='With --raw-format, the number of channels. Defaults to {0}.'.format(RAW_INPUT_CHANNELS)
+    )
+    parser.add_argument(
+        '--raw-read-chunks',
+        type=int,
+        default=RAW_READ_CHUNKS,
+        help='With --raw-format, read the input this many chunks at a time. Defaults to {0}.'.format(
+            RAW_READ_CHUNKS
+        )
+    )
+
+def metrics_arg(args):
+    '''Return the Metrics selected by add_metrics_arguments, NullMetrics if none'''
+    exporters = []
+    if args.metrics_textfile is not None:
+        exporters.append(PrometheusTextfileExporter(args.metrics_textfile))
+    if args.metrics_jsonl is not None:
+        exporters.append(JsonLinesExporter(args.metrics_jsonl))
+    if not exporters:
+        return NullMetrics()
+    return Metrics(exporters, args.metrics_interval)
+
+def silence_limits_arg(args):
+    '''Return the (peak, iqr) dBFS limits selected by presets and overrides'''
+    if args.whisper:
+        delta_limits = list(SILENCE_PRESET_LIMITS['whisper'])
+    elif args.conversational:
+        delta_limits = list(SILENCE_PRESET_LIMITS['conversational'])
+    else:
+        delta_limits = list(SILENCE_PRESET_LIMITS['quiet'])
+
+    if args.silence_peak_limit is not None:
+        delta_limits[0] = args.silence_peak_limit
+    if args.silence_iqr_limit is not None:
+        delta_limits[1] = args.silence_iqr_limit
+    return tuple(delta_limits)
+
+@contextlib.contextmanager
+def configured(args):
+    '''Apply the settings parsed by add_settings_arguments for the duration'''
+    with silence_limits(*silence_limits_arg(args)):
+        with chunk_detector(args.detector, args.silence_rms_limit, args.silence_zcr_limit):
+            with input_endianness('big' if args.input_big_endian else 'little'):
+                with input_signedness(args.input_override_signedness):
+                    with channel_policy(args.channel_policy):
+                        with analysis_timing(args.hop, args.window):
+                            with analysis_decimation(args.decimate, args.decimate_mode):
+                                with adaptive_thresholds(
+                                    None if args.adaptive_window is None else args.adaptive_window * 1000,
+                                    args.adaptive_quantile,
+                                    args.adaptive_margin,
+                                    args.adaptive_max_rise
+                                ):
+                                    with output_buffering(args.flush_size, args.flush_interval, args.write_behind):
+                                        with output_files(args.rf64, args.roll_size, args.roll_interval):
+                                            with analysis_cache(args.cache_dir, args.cache_size):
+                                                yield
+
+def _batch_job(job):
+    args, input_filename, output_filename = job
+    start = time.time()
+    try:
+        with configured(args):
+            with open(input_filename, 'rb') as input_file:
+                with open(output_filename, 'wb') as output_file:
+                    result = remove_silences(input_file, output_file)
+    except Exception as e:
+        # one bad file must not take the whole batch down
+        return input_filename, None, "{0}: {1}".format(type(e).__name__, e), time.time() - start
+    return input_filename, result, None, time.time() - start
+
+def _batch_worker_init():
+    # per-segment logging from many workers is just noise
+    logging.getLogger().setLevel(logging.WARNING)
+
+def batch_main(*argv):
+    parser = argparse.ArgumentParser(
+        prog='snarp.py batch',
+        description='Remove silence from every wave file in a directory, using several processes.'
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of worker processes. Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        'input_dir',
+        help='Directory of .wav files to read.'
+    )
+    parser.add_argument(
+        'output_dir',
+        help='Directory to write output files to, under the same names.'
+    )
+    add_settings_arguments(parser)
+    args = parser.parse_args(argv[2:])
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    jobs = [
+        (args, os.path.join(args.input_dir, name), os.path.join(args.output_dir, name))
+        for name in sorted(os.listdir(args.input_dir))
+        if name.lower().endswith('.wav')
+    ]
+
+    pool = multiprocessing.Pool(max(1, args.jobs), initializer=_batch_worker_init)
+    failures = 0
+    total_input_seconds = total_output_seconds = 0.0
+    start = time.time()
+    try:
+        for input_filename, result, error, elapsed in pool.imap_unordered(_batch_job, jobs):
+            if error is not None:
+                failures += 1
+                print("{0}: FAILED: {1}".format(input_filename, error))
+                continue
+            input_seconds = float(result.input_frames) / result.frame_rate
+            total_input_seconds += input_seconds
+            total_output_seconds += float(result.output_frames) / result.frame_rate
+            print("{0}: {1} frames in, {2} frames out, {3:.1f}x realtime".format(
+                input_filename,
+                result.input_frames,
+                result.output_frames,
+                input_seconds / max(elapsed, 1e-6)
+            ))
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    elapsed = time.time() - start
+    print("{0} files, {1} failed, {2:.1f} s of audio in, {3:.1f} s out, {4:.1f}x realtime overall".format(
+        len(jobs),
+        failures,
+        total_input_seconds,
+        total_output_seconds,
+        total_input_seconds / max(elapsed, 1e-6)
+    ))
+    return 1 if failures else 0
+
+def serve_main(*argv):
+    parser = argparse.ArgumentParser(
+        prog='snarp.py serve',
+        description='Remove silence from many live wave streams at once, in one process.'
+    )
+    parser.add_argument(
+        'output_dir',
+        help='Directory to write one output file per stream to.'
+    )
+    parser.add_argument(
+        'inputs',
+        nargs='*',
+        help='FIFOs (or files) to read wave streams from, each until it ends. '
+            'Output files are named after them.'
+    )
+    parser.add_argument(
+        '--listen',
+        metavar='HOST:PORT',
+        default=None,
+        help='Also accept wave streams over TCP on this address, one per connection, until interrupted.'
+    )
+    add_settings_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv[2:])
+    if not args.inputs and args.listen is None:
+        parser.error("give input FIFOs, --listen or both")
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    with configured(args):
+        with metrics_sink(metrics_arg(args)):
+            server = StreamServer(SilenceDetector(), args.output_dir)
+            for filename in args.inputs:
+                server.add_fifo(filename)
+            if args.listen is not None:
+                host, _, port = args.listen.rpartition(':')
+                server.listen(host, int(port))
+            server.wait()
+    failures = [name for name, result in server.results.items() if isinstance(result, Exception)]
+    return 1 if failures else 0
+
+def sweep_main(*argv):
+    parser = argparse.ArgumentParser(
+        prog='snarp.py sweep',
+        description='Report how much audio every combination of silence limits and timings would keep, '
+            'analyzing the input only once. No audio is written.'
+    )
+    parser.add_argument(
+        'input_filename',
+        help='Wave file to read.'
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=multiprocessing.cpu_count(),
+        help='Number of processes analyzing the input and evaluating settings. Defaults to the number of CPUs.'
+    )
+    parser.add_argument(
+        '--peak-limits',
+        type=float,
+        nargs='+',
+        default=None,
+        help='Peak limits to try, in dBFS. Defaults to the one selected by the other options.'
+    )
+    parser.add_argument(
+        '--iqr-limits',
+        type=float,
+        nargs='+',
+        default=None,
+        help='IQR limits to try, in dBFS. Defaults to the one selected by the other options.'
+    )
+    parser.add_argument(
+        '--hysteresis',
+        type=int,
+        nargs='+',
+        default=[HYSTERESIS_MS],
+        help='Hysteresis lengths to try, in milliseconds. Defaults to {0}.'.format(HYSTERESIS_MS)
+    )
+    parser.add_argument(
+        '--pre-roll',
+        type=int,
+        nargs='+',
+        default=[PRE_ROLL_MS],
+        help='Pre-roll lengths to try, in milliseconds. Defaults to {0}.'.format(PRE_ROLL_MS)
+    )
+    parser.add_argument(
+        '--post-roll',
+        type=int,
+        nargs='+',
+        default=[POST_ROLL_MS],
+        help='Post-roll lengths to try, in milliseconds. Defaults to {0}.'.format(POST_ROLL_MS)
+    )
+    add_settings_arguments(parser)
+    args = parser.parse_args(argv[2:])
+
+    peak_limit, iqr_limit = silence_limits_arg(args)
+    configurations = sweep_configurations(
+        args.peak_limits or [peak_limit],
+        args.iqr_limits or [iqr_limit],
+        args.hysteresis,
+        args.pre_roll,
+        args.post_roll
+    )
+    with configured(args):
+        with open(args.input_filename, 'rb') as input_file:
+            results = sweep(input_file, configurations, max(1, args.jobs))
+
+    print("peak_dbfs iqr_dbfs hysteresis_ms pre_roll_ms post_roll_ms kept_seconds segments "
+        "min_seconds median_seconds p90_seconds max_seconds")
+    for result in results:
+        print("{0:g} {1:g} {2} {3} {4} {5:.2f} {6} {7:.2f} {8:.2f} {9:.2f} {10:.2f}".format(
+            result.configuration.peak_limit,
+            result.configuration.iqr_limit,
+            result.configuration.hysteresis_ms,
+            result.configuration.pre_roll_ms,
+            result.configuration.post_roll_ms,
+            float(result.kept_frames) / result.frame_rate,
+            result.segments,
+            result.min_seconds,
+            result.median_seconds,
+            result.p90_seconds,
+            result.max_seconds
+        ))
+    return 0
+
+def stats_csv_main(*argv):
+    parser = argparse.ArgumentParser(
+        prog='snarp.py stats-csv',
+        description='Convert a binary stats file (see --stats-file) to CSV in dBFS.'
+    )
+    parser.add_argument(
+        'stats_filename',
+        help='Binary stats file to read.'
+    )
+    parser.add_argument(
+        'csv_filename',
+        help='CSV file to write.'
+    )
+    args = parser.parse_args(argv[2:])
+
+    with open(args.stats_filename, 'rb') as stats:
+        with open(args.csv_filename, 'wb') as csv_file:
+            for peak_delta, iqr_delta, sample_width in read_stats(stats):
+                csv_file.write(stats_csv_line(peak_delta, iqr_delta, sample_width))
+    return 0
+
+def splice_main(*argv):
+    parser = argparse.ArgumentParser(
+        prog='snarp.py splice',
+        description='Write the audible segments listed in segment indexes (see --index-only) to a wave file.'
+    )
+    parser.add_argument(
+        'output_filename',
+        help='Filename to write to.'
+    )
+    parser.add_argument(
+        'index_filenames',
+        nargs='+',
+        help='Segment index files. Segments of all of them are concatenated in order.'
+    )
+    add_buffering_arguments(parser)
+    args = parser.parse_args(argv[2:])
+
+    indexes = []
+    for index_filename in args.index_filenames:
+        with open(index_filename, 'rb') as index_file:
+            indexes.append(json.load(index_file))
+
+    with output_buffering(args.flush_size, args.flush_interval, args.write_behind):
+        with output_files(args.rf64, args.roll_size, args.roll_interval):
+            with open(args.output_filename, 'wb') as output_file:
+                splice(indexes, output_file)
+    return 0
+
+# Subcommands, selected by the first argument
+COMMANDS = {
+    'batch': batch_main,
+    'serve': serve_main,
+    'splice': splice_main,
+    'stats-csv': stats_csv_main,
+    'sweep': sweep_main,
+}
+
+@contextlib.contextmanager
+def opened_output(filename, mode='wb'):
+    '''
+    Open `filename` for writing for the duration, - for STDOUT, which
+    stays open. A `filename` of None gives None.
+    '''
+    if filename is None or filename == '-':
+        yield sys.stdout if filename == '-' else None
+    else:
+        with open(filename, mode) as output_file:
+            yield output_file
+
+def main(*argv):
+    if len(argv) > 1 and argv[1] in COMMANDS:
+        return COMMANDS[argv[1]](*argv)
+
+    parser = argparse.ArgumentParser(
+        description='Remove silence from wave audio data.',
+        epilog='Other commands: {0}. Run "snarp.py COMMAND -h" for their options.'.format(
+            ', '.join(sorted(COMMANDS))
+        )
+    )
+    parser.add_argument(
+        '-i',
+        '--input_filename', 
+        default='-',
+        help='Filename to read. Defaults to - for STDIN.'
+    )
+    parser.add_argument(
+        '-b',
+        '--bypass_filename',
+        default=None,
+        help='Filename to write bypass audio to. All audio data read from the input will be passed through.'
+    )
+    parser.add_argument(
+        'output_filename', 
+        nargs='?',
+        default=None,
+        help='Filename to write to, - for STDOUT. May be left out with --split.'
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        help='Number of processes analyzing the input in parallel. Only used when the input is a regular file.'
+    )
+    add_settings_arguments(parser)
+    parser.add_argument(
+        '--stream',
+        choices=('raw', 'wav'),
+        default=None,
+        help='Write audible frames as soon as they are known, as raw PCM or as a wave file whose header '
+            'leaves the length open, e.g. to STDOUT or a FIFO for an encoder to read. '
+            'Defaults to wav when writing to STDOUT.'
+    )
+    parser.add_argument(
+        '--events-fd',
+        type=int,
+        default=None,
+        help='Write a line of JSON to this file descriptor whenever an audible segment starts or ends, '
+            'with its input and output frame offsets.'
+    )
+    parser.add_argument(
+        '--split',
+        metavar='TEMPLATE',
+        default=None,
+        help='Also write every audible segment to a wave file of its own, named by formatting TEMPLATE '
+            'with {index}, {input_frame}, {seconds} and {time}, the wall clock time the segment started, '
+            'e.g. "utterance-{time:%%H%%M%%S}-{index:04d}.wav".'
+    )
+    parser.add_argument(
+        '--split-writers',
+        type=int,
+        default=SPLIT_WRITERS,
+        help='With --split, the number of threads opening, writing and closing segment files. '
+            'Defaults to {0}.'.format(SPLIT_WRITERS)
+    )
     parser.add_argument(
         '--stats-file',
         default=None,
-        help='Record '
+        help='Record the peak and IQR levels of every chunk to this file: in dBFS as CSV if the filename '
+            'ends in .csv, otherwise as raw sample deltas in a compact binary format. '
+            'Convert binary files to CSV with "snarp.py stats-csv".'
+    )
+    parser.add_argument(
+        '--live',
+        action='store_true',
+        help='Read, analyze and write on separate threads, so slow output never stalls reading live input.'
+    )
+    parser.add_argument(
+        '--index-only',
+        action='store_true',
+        help='Write a JSON index of audible segments to the output file instead of audio. '
+            'Use "snarp.py splice" to write the audio later.'
     )
+    parser.add_argument(
+        '--index-stats',
+        action='store_true',
+        help='With --index-only, include the peak and IQR sample deltas of every chunk in the index.'
+    )
+    add_raw_input_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args(argv[1:])
+    if args.output_filename is None and (args.split is None or args.index_only):
+        parser.error("an output filename is required unless --split is given")
 
     input_filename = args.input_filename
     output_filename = args.output_filename
@@ -524,27 +4571,30 @@ def main(*argv):
     if args.bypass_filename is not None:
         bypass_file = open(args.bypass_filename, 'wb')
 
-    if args.whisper:
-        delta_limits = SILENCE_PRESET_LIMITS['whisper']
-    elif args.whisper:
-        delta_limits = SILENCE_PRESET_LIMITS['conversational']
-    else:
-        delta_limits = SILENCE_PRESET_LIMITS['quiet']
+    stream = args.stream
+    if stream is None and output_filename == '-' and not args.index_only:
+        # STDOUT can't seek back to fix up a wave header
+        stream = 'wav'
+    events_file = None if args.events_fd is None else os.fdopen(args.events_fd, 'w')
 
-    if args.silence_peak_limit:
-        delta_limits[0] = args.silence_peak_limit
-    if args.silence_iqr_limit:
-        delta_limits[1] = args.silence_iqr_limit
-
-    with silence_limits(*delta_limits):
-        with stats_file(args.stats_file):
-            with input_endianness('big' if args.input_big_endian else 'little'):
-                with input_signedness(args.input_override_signedness):
-                    with open(output_filename, 'wb') as output_file:
-                        remove_silences(input_file, output_file, bypass_file)
+    with configured(args):
+        with raw_input_format(args.raw_format, args.raw_rate, args.raw_channels, args.raw_read_chunks):
+            with output_stream(stream):
+                with segment_events(events_file):
+                    with split_output(args.split, args.split_writers):
+                        with stats_file(args.stats_file):
+                            with metrics_sink(metrics_arg(args)):
+                                if args.index_only:
+                                    with opened_output(output_filename, 'w') as index_file:
+                                        index_silences(input_file, index_file, args.index_stats, jobs=args.jobs)
+                                elif args.live:
+                                    with opened_output(output_filename) as output_file:
+                                        live_remove_silences(input_file, output_file, bypass_file)
+                                else:
+                                    with opened_output(output_filename) as output_file:
+                                        remove_silences(input_file, output_file, bypass_file, jobs=args.jobs)
 
     return 0
 
 if __name__ == '__main__':
     sys.exit(main(*sys.argv))
-
@@ -2,6 +2,18 @@
 import snarp
 import wave
 import os
+import random
+import struct
+import itertools
+import io
+import json
+import time
+import shutil
+import tempfile
+import array
+import math
+import threading
+import socket
 
 OUTPUT_FILENAME = "/tmp/output.wav"
 
@@ -42,6 +54,1058 @@ def check_basic_functionality(filename, expected_input_frames, expected_output_f
 	# cleanup, delete temp output file
 	os.unlink(OUTPUT_FILENAME)
 
+def random_frames(nframes, sample_width, nchannels, seed=0):
+	rng = random.Random(seed)
+	return bytes(bytearray(rng.randrange(256) for i in range(nframes * sample_width * nchannels)))
+
+def check_parse_frames(parse, frames, sample_width, nchannels, signed_data, endianness):
+	with snarp.input_endianness(endianness):
+		expected = [
+			snarp.frame_to_sample(frames[i:i + sample_width], sample_width, signed_data)
+			for i in range(0, len(frames), sample_width)
+		]
+	nsamples = len(frames) // sample_width
+	actual = parse(frames, nsamples, sample_width, signed_data, endianness)
+	assert_eq(list(actual), expected)
+
+def test_parse_frames_matches_scalar_decoder():
+	parsers = [snarp._parse_frames_array]
+	if snarp.numpy is not None:
+		parsers.append(snarp._parse_frames_numpy)
+	for parse in parsers:
+		for sample_width in (1, 2, 4):
+			for nchannels in (1, 2):
+				frames = random_frames(257, sample_width, nchannels)
+				for signed_data in (True, False):
+					for endianness in ('little', 'big'):
+						check_parse_frames(parse, frames, sample_width, nchannels, signed_data, endianness)
+
+def test_parse_frames_24bit():
+	values = [0, 1, -1, 0x7fffff, -0x800000, 123456, -654321]
+	little = b''.join(struct.pack('<i', v)[:3] for v in values)
+	big = b''.join(struct.pack('>i', v)[1:] for v in values)
+	unsigned = [v & 0xffffff for v in values]
+	parsers = [snarp._parse_frames_array]
+	if snarp.numpy is not None:
+		parsers.append(snarp._parse_frames_numpy)
+	for parse in parsers:
+		assert_eq(list(parse(little, len(values), 3, True, 'little')), values)
+		assert_eq(list(parse(big, len(values), 3, True, 'big')), values)
+		assert_eq(list(parse(little, len(values), 3, False, 'little')), unsigned)
+	# memoryview input is decoded without copying into a bytes object first
+	assert_eq(list(snarp.parse_frames(memoryview(little), 3, 1, True, 'little')), values)
+	# stereo, channels stay interleaved
+	stereo = b''.join(little[i:i + 3] * 2 for i in range(0, len(little), 3))
+	assert_eq(list(snarp.parse_frames(stereo, 3, 2, True, 'little')), [v for v in values for c in (0, 1)])
+
+def sorted_chunk_stats(samples):
+	# the original sort based definition used by tag_chunks
+	samples = sorted(samples)
+	count = len(samples)
+	first, last = samples[:int(count/2)], samples[int(count/2):]
+	q1, q3 = first[int(len(first)/2):][0], last[int(len(last)/2):][0]
+	return samples[count - 1] - samples[0], q3 - q1
+
+def test_chunk_stats_match_sorted_quartiles():
+	rng = random.Random(1)
+	for count in list(range(2, 12)) + [441, 2205, 4410]:
+		samples = [rng.randrange(-32768, 32768) for i in range(count)]
+		assert_eq(tuple(snarp.chunk_stats(samples)), sorted_chunk_stats(samples))
+		if snarp.numpy is not None:
+			array_samples = snarp.numpy.array(samples, dtype=snarp.numpy.int32)
+			assert_eq(tuple(snarp.chunk_stats(array_samples)), sorted_chunk_stats(samples))
+	chunks = [[rng.randrange(-(1 << i), 1 << i) for j in range(441)] for i in range(1, 16)]
+	if snarp.numpy is not None:
+		chunks = [snarp.numpy.array(chunk, dtype=snarp.numpy.int32) for chunk in chunks]
+	expected = [sorted_chunk_stats(chunk) for chunk in chunks]
+	peaks, iqrs = snarp.chunk_stats_batch(chunks)
+	assert_eq([(int(peak[0]), int(iqr[0])) for peak, iqr in zip(peaks, iqrs)], expected)
+
+def direct_level_stats(samples):
+	count = float(len(samples))
+	mean = sum(samples) / count
+	rms = (sum((sample - mean) ** 2 for sample in samples) / count) ** 0.5
+	above = [sample >= mean for sample in samples]
+	crossings = sum(1 for i in range(1, len(samples)) if above[i] != above[i - 1])
+	return 2 * rms, crossings * 1000.0 / (len(samples) - 1)
+
+def test_level_stats_match_direct_computation():
+	rng = random.Random(2)
+	tone = [int(8000 * math.sin(2 * math.pi * i / 40.0)) for i in range(882)]
+	noise = [rng.randrange(-2000, 2000) for i in range(882)]
+	stereo = [sample for pair in zip(tone, noise) for sample in pair]
+	numpy = snarp.numpy
+	try:
+		for use_numpy in [True, False]:
+			snarp.numpy = numpy if use_numpy else None
+			chunks = [stereo, stereo[2:] + stereo[:2]]
+			if snarp.numpy is not None:
+				chunks = [snarp.numpy.array(chunk, dtype=snarp.numpy.int32) for chunk in chunks]
+			rms_deltas, crossings = snarp.level_stats_batch(chunks, 2, 2, with_crossings=True)
+			for channel, samples in enumerate([tone, noise]):
+				rms_delta, crossing_rate = direct_level_stats(samples)
+				for row in range(2):
+					assert abs(rms_deltas[row][channel] - rms_delta) <= 1
+					assert abs(crossings[row][channel] - crossing_rate) <= 1
+	finally:
+		snarp.numpy = numpy
+	assert_eq(snarp.level_stats_batch([stereo], 2, 2)[1], None)
+	# a 440 Hz tone crosses zero rarely, noise about every other sample
+	assert crossings[0][0] < 100 < 350 < crossings[0][1]
+
+def test_chunk_detectors():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	expected = detect(snarp.SilenceDetector(), filename)
+	for name in ["rms", "zcr"]:
+		assert_eq(detect(snarp.SilenceDetector(detector=name), filename), expected)
+		with snarp.chunk_detector(name):
+			result, output = remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+		assert_eq(result.output_frames, expected[0].output_frames)
+	os.unlink(OUTPUT_FILENAME)
+	# an RMS limit above the beeps leaves nothing audible
+	assert_eq(detect(snarp.SilenceDetector(detector="rms", rms_limit=-1), filename)[0].output_frames, 0)
+	# the beeps are steady tones, the zcr detector must not take them for noise
+	assert_eq(detect(snarp.SilenceDetector(detector="zcr", zcr_limit=0.005), filename)[0].output_frames, 0)
+	with snarp.adaptive_thresholds(2000):
+		adaptive = snarp.SilenceDetector(detector="zcr")
+	for detector in [snarp.SilenceDetector(detector="rms", window_ms=300), adaptive]:
+		try:
+			detect(detector, filename)
+		except ValueError:
+			pass
+		else:
+			assert False, "{0!r} should be rejected".format(detector.detector)
+
+def test_analysis_samples_decimate():
+	samples = [1, -1, 5, 50, -7, 3, 2, 0, 9, -9]
+	frames = struct.pack("<10h", *samples)
+	numpy = snarp.numpy
+	try:
+		for use_numpy in [True, False]:
+			snarp.numpy = numpy if use_numpy else None
+			for view in [frames, memoryview(frames)]:
+				analyzed = lambda decimation, mode: list(snarp.analysis_samples(view, 2, 2, True, decimation=decimation, mode=mode))
+				assert_eq(analyzed(1, "stride"), samples)
+				assert_eq(analyzed(2, "stride"), [1, -1, -7, 3, 9, -9])
+				assert_eq(analyzed(2, "envelope"), [1, -1, 5, 50, -7, 0, 2, 3, 9, -9, 9, -9])
+				assert_eq(analyzed(4, "envelope"), [-7, -1, 5, 50, 9, -9, 9, -9])
+	finally:
+		snarp.numpy = numpy
+
+def test_decimated_analysis_writes_every_frame():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	expected = remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+	for mode in snarp.DECIMATION_MODES:
+		with snarp.analysis_decimation(8, mode):
+			assert_eq(remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet']), expected)
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					snarp.remove_silences(input, output, map_input=False)
+					output.seek(0)
+					assert_eq(output.read(), expected[1])
+		detector = snarp.SilenceDetector(decimation=8, decimation_mode=mode)
+		assert_eq(detect(detector, filename)[0], expected[0])
+	os.unlink(OUTPUT_FILENAME)
+
+def test_sliding_window_stats_match_whole_window():
+	rng = random.Random(0)
+	for sample_width, window, tolerance in [(1, 3, 0), (2, 10, 0), (3, 4, 1 << 8)]:
+		limit = 1 << (sample_width * 8 - 1)
+		stats = snarp.SlidingWindowStats(window, sample_width)
+		chunks = []
+		for i in range(40):
+			chunk = [rng.randrange(-limit, limit) for j in range(rng.randrange(2, 50))]
+			chunks.append(chunk)
+			peak, iqr = stats.add(chunk)
+			expected_peak, expected_iqr = sorted_chunk_stats(sum(chunks[-window:], []))
+			assert_eq(peak, expected_peak)
+			assert abs(iqr - expected_iqr) <= tolerance, (sample_width, iqr, expected_iqr)
+
+def test_hop_mode():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	results = {}
+	for chunk_ms, window_ms in [(100, None), (100, 100), (10, 100), (20, 100)]:
+		with snarp.analysis_timing(chunk_ms, window_ms):
+			assert_eq(snarp.PRE_ROLL_CHUNKS, 200 // chunk_ms)
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					results[chunk_ms, window_ms] = snarp.remove_silences(input, output).output_frames
+	assert_eq(snarp.PRE_ROLL_CHUNKS, 2)
+	# a window of one chunk is the plain chunk analysis
+	assert_eq(results[100, 100], results[100, None])
+	# the window keeps hearing the end of a beep for up to 90 ms of hops
+	assert results[100, None] < results[10, 100] <= results[100, None] + 3 * 4410 * 0.9, results
+	os.unlink(OUTPUT_FILENAME)
+
+def test_coarse_hop_without_rolls():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	outputs = []
+	with snarp.analysis_timing(250):
+		# hops longer than the pre- and post-roll leave no roll at all
+		assert_eq((snarp.PRE_ROLL_CHUNKS, snarp.POST_ROLL_CHUNKS), (0, 0))
+		for remove in (
+			lambda input, output: snarp.remove_silences(input, output, map_input=True),
+			lambda input, output: snarp.remove_silences(input, output, map_input=False),
+			snarp.live_remove_silences,
+		):
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					remove(input, output)
+			with open(OUTPUT_FILENAME, "rb") as output:
+				outputs.append(output.read())
+	assert_eq(outputs[1], outputs[0])
+	assert_eq(outputs[2], outputs[0])
+	os.unlink(OUTPUT_FILENAME)
+
+def tagged_segments(flags, hysteresis_chunks, pre_roll_chunks, post_roll_chunks):
+	# one byte chunks, so byte offsets are chunk numbers
+	tagged = snarp.tag_segments(
+		((silent, None, b'x') for silent in flags),
+		hysteresis_chunks, pre_roll_chunks, post_roll_chunks
+	)
+	segments = []
+	start = 0
+	for silent, spans in itertools.groupby(tagged, key=lambda pair: pair[0]):
+		stop = start + sum(len(frames) for silent, frames in spans)
+		segments.append((silent, start, stop))
+		start = stop
+	return segments
+
+def test_byte_ring_buffer_hands_out_spans():
+	ring = snarp.ByteRingBuffer(3)
+	for frames in (b'eeee', b'ffff', b'gggg', b'hhhh'):
+		if len(ring) == ring.maxlen:
+			ring.popleft()
+		ring.append(frames)
+	data = ring.data
+	spans = ring.popleft(3)
+	assert_eq([bytes(bytearray(span)) for span in spans], [b'ffffgggg', b'hhhh'])
+	ring.append(b'ii')
+	ring.append(b'jjjjjj')
+	ring.popleft()
+	# a chunk wrapping around the end comes out in two spans
+	ring.append(b'kkkkkk')
+	assert_eq([bytes(bytearray(span)) for span in ring.popleft(2)], [b'jjjjjjkkkk', b'kk'])
+	assert ring.data is data
+	ring.append(b'l' * 20)
+	assert_eq([bytes(bytearray(span)) for span in ring.popleft(5)], [b'l' * 20])
+
+def segment_tags(segments):
+	return [silent for silent, start, stop in segments for chunk in range(start, stop)]
+
+def test_segment_flags_match_tag_segments():
+	rng = random.Random(0)
+	for trial in range(500):
+		flags = []
+		for run in range(rng.randrange(12)):
+			flags.extend([run % 2 == 0] * rng.randrange(1, 15))
+		timings = (rng.randrange(1, 8), rng.randrange(4), rng.randrange(1, 4))
+		expected = tagged_segments(flags, *timings)
+		assert_eq(snarp.segment_flags(flags, *timings, end_fix=False), expected)
+		# the end fix only retags the trailing silence
+		tail = len(flags) - len(list(itertools.takewhile(bool, reversed(flags))))
+		assert_eq(segment_tags(snarp.segment_flags(flags, *timings))[:tail], segment_tags(expected)[:tail])
+	# a short trailing silence is post-rolled instead of kept
+	flags = [True] * 3 + [False] * 5 + [True] * 2
+	assert_eq(tagged_segments(flags, 10, 2, 1), [(True, 0, 1), (False, 1, 10)])
+	assert_eq(snarp.segment_flags(flags, 10, 2, 1), [(True, 0, 1), (False, 1, 9), (True, 9, 10)])
+
+def test_batched_tag_chunks_matches_unbatched():
+	with open("test/data/generated-beeps-22k-16bit-1ch.wav", "rb") as input:
+		input_wave = wave.open(input)
+		limits = (snarp.dbfs_to_sample_delta(-21, 2), snarp.dbfs_to_sample_delta(-30, 2))
+		chunks = list(itertools.takewhile(
+			lambda chunk: len(chunk[0]),
+			snarp.chunked_samples(input_wave, snarp.CHUNK_MS / 1000.0)
+		))
+	unbatched = [tagged[0] for tagged in snarp.tag_chunks(iter(chunks), limits, 2)]
+	batched = [tagged[0] for tagged in snarp.tag_chunks(iter(chunks), limits, 2, batch_size=16)]
+	assert_eq(batched, unbatched)
+	assert True in unbatched and False in unbatched
+
+def stereo_from_mono(filename, output_filename, left_gain, right_gain):
+	# write a stereo copy of a 16 bit mono test file with per-channel gains
+	mono = wave.open(filename, 'rb')
+	samples = snarp.parse_frames(mono.readframes(mono.getnframes()), 2, 1, True)
+	stereo = wave.open(output_filename, 'wb')
+	stereo.setparams((2, 2, mono.getframerate(), 0, 'NONE', 'not compressed'))
+	stereo.writeframes(b''.join(
+		struct.pack('<hh', int(s * left_gain), int(s * right_gain)) for s in samples
+	))
+	stereo.close()
+	mono.close()
+
+def test_channel_policies():
+	filename = "test/data/generated-beeps-22k-16bit-1ch.wav"
+	expected = [
+		('any', 27563),
+		('mix', 27563),
+		(0, 0),
+		(1, 27563),
+		('all', 0),
+	]
+	stereo_from_mono(filename, OUTPUT_FILENAME + ".stereo", 0, 1)
+	for policy, expected_output_frames in expected:
+		with open(OUTPUT_FILENAME + ".stereo", "rb") as input:
+			with open(OUTPUT_FILENAME, "wb+") as output:
+				with snarp.channel_policy(policy):
+					snarp.remove_silences(input, output)
+				output.seek(0)
+				assert_eq((policy, wave.open(output, 'rb').getnframes()), (policy, expected_output_frames))
+	os.unlink(OUTPUT_FILENAME + ".stereo")
+	os.unlink(OUTPUT_FILENAME)
+
+class RecordingWriter(object):
+	def __init__(self):
+		self.writes = []
+		self.closed = False
+
+	def writeframes(self, frames):
+		self.writes.append(bytes(bytearray(frames)))
+
+	def close(self):
+		self.closed = True
+
+def test_p2_quantile_tracks_exact_quantile():
+	rng = random.Random(0)
+	values = [rng.gauss(0, 1) for i in range(5000)]
+	for p in (0.1, 0.5, 0.9):
+		estimate = snarp.P2Quantile(p)
+		for value in values:
+			estimate.add(value)
+		assert abs(estimate.value() - sorted(values)[int(p * len(values))]) < 0.05
+
+def test_adaptive_thresholds_follow_noise_floor():
+	rng = random.Random(0)
+	input_wave = wave.open("test/data/generated-beeps-44k-16bit-1ch.wav", "rb")
+	samples = array.array("h", input_wave.readframes(input_wave.getnframes()))
+	# a noise floor at about -15 dBFS peak, above the "quiet" preset limits
+	noisy = array.array("h", (sample + rng.randint(-1000, 1000) for sample in samples))
+	noisy_filename = OUTPUT_FILENAME + ".noisy.wav"
+	noisy_wave = wave.open(noisy_filename, "wb")
+	noisy_wave.setparams(input_wave.getparams())
+	noisy_wave.writeframes(noisy.tostring())
+	noisy_wave.close()
+	outputs = []
+	for window_ms in (None, 10000):
+		with snarp.adaptive_thresholds(window_ms):
+			with open(noisy_filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					outputs.append(snarp.remove_silences(input, output).output_frames)
+	# fixed limits hear nothing but noise, adaptive ones remove it again
+	assert_eq(outputs[0], 262395)
+	assert outputs[1] < 70000, outputs[1]
+	os.unlink(noisy_filename)
+	os.unlink(OUTPUT_FILENAME)
+
+def test_buffered_writer_coalesces_writes():
+	for threaded in (False, True):
+		recorder = RecordingWriter()
+		writer = snarp.BufferedWaveWriter(recorder, flush_bytes=10, flush_seconds=3600, threaded=threaded)
+		for i in range(7):
+			writer.writeframes(b'abc')
+		writer.writeframes(b'x' * 25)
+		writer.close()
+		assert_eq(recorder.writes, [b'abcabcabcabc', b'abcabcabc', b'x' * 25])
+		assert recorder.closed
+
+def test_buffered_writer_flushes_without_more_writes():
+	for threaded in (False, True):
+		recorder = RecordingWriter()
+		writer = snarp.BufferedWaveWriter(recorder, flush_bytes=1 << 20, flush_seconds=0.05, threaded=threaded)
+		writer.writeframes(b'abc')
+		# nothing more is written, as in silence
+		deadline = time.time() + 5
+		while not recorder.writes and time.time() < deadline:
+			time.sleep(0.01)
+		assert_eq(recorder.writes, [b'abc'])
+		writer.writeframes(b'def')
+		writer.close()
+		assert_eq(recorder.writes, [b'abc', b'def'])
+
+def test_write_behind_output_matches():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	outputs = []
+	for write_behind in (False, True):
+		with snarp.output_buffering(4096, 1.0, write_behind):
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					snarp.remove_silences(input, output)
+		with open(OUTPUT_FILENAME, "rb") as output:
+			outputs.append(output.read())
+	assert_eq(outputs[0], outputs[1])
+	os.unlink(OUTPUT_FILENAME)
+
+def test_mapped_input_matches_stream_input():
+	for filename in ("test/data/generated-beeps-44k-16bit-1ch.wav", "test/data/generated-beeps-22k-8bit-1ch.wav"):
+		outputs = []
+		for map_input in (False, True):
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					with open(OUTPUT_FILENAME + ".bypass", "wb+") as bypass:
+						snarp.remove_silences(input, output, bypass, map_input=map_input)
+			with open(OUTPUT_FILENAME, "rb") as output:
+				with open(OUTPUT_FILENAME + ".bypass", "rb") as bypass:
+					outputs.append((output.read(), bypass.read()))
+		assert_eq(outputs[0], outputs[1])
+		with open(filename, "rb") as input:
+			assert_eq(outputs[1][1], input.read())
+	os.unlink(OUTPUT_FILENAME)
+	os.unlink(OUTPUT_FILENAME + ".bypass")
+
+def test_mapped_wave_data_windows():
+	filename = "test/data/generated-beeps-22k-16bit-1ch.wav"
+	with open(filename, "rb") as input:
+		mapped = snarp.MappedWaveData.open(input, 2, window_bytes=1000)
+		input.seek(mapped.offset)
+		data = input.read(mapped.size)
+		assert_eq(b''.join(bytes(view) for view in mapped.views(0, mapped.size)), data)
+		assert_eq(bytes(mapped.view(123456, 123460)), data[123456:123460])
+		assert_eq(bytes(mapped.view(10, 20)), data[10:20])
+	assert snarp.MappedWaveData.open(io.BytesIO(b'RIFF'), 2) is None
+
+def test_remove_silences_result():
+	with open("test/data/generated-beeps-22k-8bit-1ch.wav", "rb") as input:
+		with open(OUTPUT_FILENAME, "wb+") as output:
+			result = snarp.remove_silences(input, output)
+	assert_eq(result, snarp.SilenceRemovalResult(131198, 27563, 22050))
+	os.unlink(OUTPUT_FILENAME)
+
+class SmallRF64WaveWriter(snarp.RF64WaveWriter):
+	RIFF_LIMIT = 200
+
+def test_rf64_writer_grows_into_rf64():
+	output = io.BytesIO()
+	writer = SmallRF64WaveWriter(output, (2, 2, 8000))
+	writer.writeframes(b'abcd' * 20)
+	# committed without closing, and readable as a plain wave file
+	wave_output = wave.open(io.BytesIO(output.getvalue()))
+	assert_eq(wave_output.readframes(100), b'abcd' * 20)
+	writer.writeframes(b'efgh' * 20)
+	writer.close()
+	data = output.getvalue()
+	header = snarp.RF64WaveWriter.HEADER.unpack(data[:snarp.RF64WaveWriter.HEADER.size])
+	assert_eq(header[:5], (b'RF64', 0xFFFFFFFF, b'WAVE', b'ds64', 28))
+	assert_eq(snarp.RF64WaveWriter.DS64.unpack(header[5]), (len(data) - 8, 160, 40, 0))
+	assert_eq(header[-2:], (b'data', 0xFFFFFFFF))
+	assert_eq(data[snarp.RF64WaveWriter.HEADER.size:], b'abcd' * 20 + b'efgh' * 20)
+
+def test_rolling_output_matches_single_file():
+	directory = tempfile.mkdtemp()
+	try:
+		filename = "test/data/generated-beeps-22k-16bit-1ch.wav"
+		outputs = []
+		for rf64, roll_seconds in ((False, None), (False, 0.5), (True, 0.5)):
+			output_filename = os.path.join(directory, "output{0}.wav".format(len(outputs)))
+			with snarp.output_files(rf64, roll_seconds=roll_seconds):
+				with open(filename, "rb") as input:
+					with open(output_filename, "wb") as output:
+						snarp.remove_silences(input, output)
+			# output0.wav, then output0.0001.wav and on
+			names = sorted(
+				(name for name in os.listdir(directory) if name.startswith("output{0}".format(len(outputs)))),
+				key=lambda name: (name.count('.'), name)
+			)
+			frames = []
+			for name in names:
+				wave_output = wave.open(os.path.join(directory, name))
+				assert roll_seconds is None or wave_output.getnframes() <= 11025
+				frames.append(wave_output.readframes(wave_output.getnframes()))
+			outputs.append((len(names), b''.join(frames)))
+		assert_eq(outputs[0][0], 1)
+		assert outputs[1][0] > 1
+		assert_eq(outputs[1][1], outputs[0][1])
+		assert_eq(outputs[2], outputs[1])
+	finally:
+		shutil.rmtree(directory)
+
+def remove_silences_output(filename, limits):
+	with snarp.silence_limits(*limits):
+		with open(filename, "rb") as input:
+			with open(OUTPUT_FILENAME, "wb+") as output:
+				result = snarp.remove_silences(input, output)
+				output.seek(0)
+				return result, output.read()
+
+def test_analysis_cache_reuses_chunk_stats():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	directory = tempfile.mkdtemp()
+	mapped_chunked_samples = snarp.mapped_chunked_samples
+	try:
+		all_limits = [(-21, -30), (-6, -9), (0, 0)]
+		expected = [remove_silences_output(filename, limits) for limits in all_limits]
+		with snarp.analysis_cache(directory):
+			remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+			assert_eq(len(os.listdir(directory)), 1)
+			# re-runs must not decode the input again
+			snarp.mapped_chunked_samples = None
+			outputs = [remove_silences_output(filename, limits) for limits in all_limits]
+		assert_eq(outputs, expected)
+		assert len(set(output for result, output in outputs)) > 1
+		snarp.mapped_chunked_samples = mapped_chunked_samples
+		with snarp.analysis_cache(directory, 100):
+			remove_silences_output("test/data/generated-beeps-22k-16bit-1ch.wav", snarp.SILENCE_PRESET_LIMITS['quiet'])
+		assert_eq(os.listdir(directory), [])
+	finally:
+		snarp.mapped_chunked_samples = mapped_chunked_samples
+		shutil.rmtree(directory)
+		os.unlink(OUTPUT_FILENAME)
+
+def test_analysis_cache_ignores_damaged_entries():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	limits = snarp.SILENCE_PRESET_LIMITS['quiet']
+	expected = remove_silences_output(filename, limits)
+	directory = tempfile.mkdtemp()
+	try:
+		with snarp.analysis_cache(directory):
+			remove_silences_output(filename, limits)
+			entry = os.path.join(directory, os.listdir(directory)[0])
+			with open(entry, "rb") as f:
+				data = f.read()
+			# a partial record, and a whole record too few
+			for damaged in (data + b"abc", data[:-16]):
+				with open(entry, "wb") as f:
+					f.write(damaged)
+				assert_eq(remove_silences_output(filename, limits), expected)
+				with open(entry, "rb") as f:
+					assert_eq(f.read(), data)
+	finally:
+		shutil.rmtree(directory)
+		os.unlink(OUTPUT_FILENAME)
+
+def test_analysis_cache_evicts_alongside_other_processes():
+	directory = tempfile.mkdtemp()
+	listdir, remove = os.listdir, os.remove
+	def listdir_with_gone(path):
+		# an entry another process removed after listing
+		return listdir(path) + ["gone" + snarp.AnalysisCache.SUFFIX]
+	def remove_twice(path):
+		# another process evicting the same entry first
+		remove(path)
+		remove(path)
+	try:
+		cache = snarp.AnalysisCache(directory, 0)
+		os.listdir, os.remove = listdir_with_gone, remove_twice
+		cache.store("key", [([1], [2])])
+		assert_eq(listdir(directory), [])
+	finally:
+		os.listdir, os.remove = listdir, remove
+		shutil.rmtree(directory)
+
+def test_batch_isolates_failures():
+	input_dir = tempfile.mkdtemp()
+	output_dir = os.path.join(input_dir, "out")
+	try:
+		shutil.copy("test/data/generated-beeps-22k-16bit-1ch.wav", input_dir)
+		with open(os.path.join(input_dir, "broken.wav"), "wb") as broken:
+			broken.write(b"not a wave file")
+		assert_eq(snarp.main("snarp.py", "batch", "--jobs", "2", input_dir, output_dir), 1)
+		output = wave.open(os.path.join(output_dir, "generated-beeps-22k-16bit-1ch.wav"), "rb")
+		assert_eq(output.getnframes(), 27563)
+	finally:
+		shutil.rmtree(input_dir)
+
+def test_sharded_analysis_matches_serial():
+	for filename, expected_input_frames, expected_output_frames in [
+		("test/data/generated-beeps-44k-16bit-1ch.wav", 262395, 55125),
+		("test/data/generated-beeps-22k-8bit-1ch.wav", 131198, 27563),
+	]:
+		outputs = []
+		for jobs in (1, 3, 7):
+			stats = io.BytesIO()
+			stats.close = lambda: None
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb+") as output:
+					with open(OUTPUT_FILENAME + ".bypass", "wb+") as bypass:
+						with snarp.stats_file(stats):
+							result = snarp.remove_silences(input, output, bypass, jobs=jobs)
+			assert_eq(result.input_frames, expected_input_frames)
+			assert_eq(result.output_frames, expected_output_frames)
+			with open(OUTPUT_FILENAME, "rb") as output:
+				with open(OUTPUT_FILENAME + ".bypass", "rb") as bypass:
+					outputs.append((output.read(), bypass.read(), stats.getvalue()))
+		assert_eq(outputs[1], outputs[0])
+		assert_eq(outputs[2], outputs[0])
+	os.unlink(OUTPUT_FILENAME)
+	os.unlink(OUTPUT_FILENAME + ".bypass")
+
+def test_stats_records_hold_32bit_deltas():
+	# twice the RMS of a full scale 32 bit square wave
+	deltas = [(2 ** 32, 2 ** 32 - 1), (0, 1)]
+	f = io.BytesIO()
+	writer = snarp.BinaryStatsWriter(f)
+	for peak_delta, iqr_delta in deltas:
+		writer.push(peak_delta, iqr_delta, 4)
+	writer.flush()
+	f.seek(0)
+	assert_eq([(peak, iqr) for peak, iqr, sample_width in snarp.read_stats(f)], deltas)
+
+def test_analysis_cache_holds_32bit_deltas():
+	deltas = [(2 ** 32, 2 ** 32 - 1), (0, 1)]
+	directory = tempfile.mkdtemp()
+	try:
+		cache = snarp.AnalysisCache(directory, 1 << 20)
+		cache.store("key", [([peak_delta], [iqr_delta]) for peak_delta, iqr_delta in deltas])
+		assert_eq([(list(peaks), list(iqrs)) for peaks, iqrs in cache.load("key")], [([2 ** 32], [2 ** 32 - 1]), ([0], [1])])
+	finally:
+		shutil.rmtree(directory)
+
+def test_binary_stats_convert_to_csv():
+	directory = tempfile.mkdtemp()
+	try:
+		stats = {}
+		for name in ("stats.csv", "stats.bin"):
+			stats[name] = os.path.join(directory, name)
+			with snarp.stats_file(stats[name]):
+				with open("test/data/generated-beeps-22k-16bit-1ch.wav", "rb") as input:
+					with open(OUTPUT_FILENAME, "wb+") as output:
+						snarp.remove_silences(input, output)
+		with open(stats["stats.bin"], "rb") as f:
+			records = list(snarp.read_stats(f))
+		assert_eq(len(records), 60)
+		assert_eq(os.path.getsize(stats["stats.bin"]), snarp.STATS_HEADER.size + 60 * snarp.STATS_RECORD_BYTES)
+		converted = os.path.join(directory, "converted.csv")
+		assert_eq(snarp.main("snarp.py", "stats-csv", stats["stats.bin"], converted), 0)
+		with open(converted) as f:
+			with open(stats["stats.csv"]) as expected:
+				assert_eq(f.read(), expected.read())
+	finally:
+		shutil.rmtree(directory)
+	os.unlink(OUTPUT_FILENAME)
+
+def test_index_and_splice_match_remove_silences():
+	filenames = ["test/data/generated-beeps-44k-8bit-1ch.wav", "test/data/generated-beeps-44k-16bit-1ch.wav"]
+	expected = b''
+	for filename in filenames[1:]:
+		with open(filename, "rb") as input:
+			with open(OUTPUT_FILENAME, "wb+") as output:
+				snarp.remove_silences(input, output)
+				output.seek(0)
+				output_wave = wave.open(output, 'rb')
+				expected = output_wave.readframes(output_wave.getnframes())
+	indexes = []
+	for filename in filenames:
+		index_file = io.BytesIO()
+		with open(filename, "rb") as input:
+			result = snarp.index_silences(input, index_file, with_stats=True)
+		index = json.loads(index_file.getvalue())
+		assert_eq(len(index['chunk_stats']), 60)
+		assert_eq(result.output_frames, sum(end - start for start, end in index['segments']))
+		indexes.append(index)
+	assert_eq(indexes[0]['segments'], indexes[1]['segments'])
+
+	with open(OUTPUT_FILENAME, "wb+") as output:
+		# formats differ
+		try:
+			snarp.splice(indexes, output)
+		except ValueError:
+			pass
+		else:
+			assert False, "spliced 8 and 16 bit inputs together"
+	with open(OUTPUT_FILENAME, "wb+") as output:
+		assert_eq(snarp.splice(indexes[1:] * 2, output), 110250)
+		output.seek(0)
+		output_wave = wave.open(output, 'rb')
+		assert_eq(output_wave.readframes(output_wave.getnframes()), expected * 2)
+	os.unlink(OUTPUT_FILENAME)
+
+class PipeOutput(object):
+	# a write-only, unseekable stream recording how far `input` was read at every write
+	def __init__(self, input):
+		self.input = input
+		self.writes = []
+
+	def write(self, data):
+		self.writes.append((bytes(data), self.input.tell()))
+
+	def flush(self):
+		pass
+
+	def data(self):
+		return b"".join(data for data, position in self.writes)
+
+def test_streaming_output_and_segment_events():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	result, expected = remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+	expected_wave = wave.open(io.BytesIO(expected), "rb")
+	expected_frames = expected_wave.readframes(expected_wave.getnframes())
+	index_file = io.BytesIO()
+	with open(filename, "rb") as input:
+		snarp.index_silences(input, index_file)
+	segments = json.loads(index_file.getvalue())['segments']
+	data = open(filename, "rb").read()
+	header_bytes = 44
+	chunk_frames = 4410
+	for kind, live in [("wav", False), ("raw", False), ("wav", True)]:
+		input = io.BytesIO(data)
+		output = PipeOutput(input)
+		events = PipeOutput(input)
+		with open(OUTPUT_FILENAME + ".bypass", "wb") as bypass:
+			with snarp.output_stream(kind):
+				with snarp.segment_events(events):
+					if live:
+						snarp.live_remove_silences(input, output, bypass)
+					else:
+						assert_eq(snarp.remove_silences(input, output, bypass), result)
+		# the bypass file is not streamed
+		assert_eq(open(OUTPUT_FILENAME + ".bypass", "rb").read(), data)
+		if kind == "wav":
+			header, frames = output.data()[:header_bytes], output.data()[header_bytes:]
+			assert_eq(struct.unpack("<4sL4s", header[:12]), (b"RIFF", 0xFFFFFFFF, b"WAVE"))
+			assert_eq(struct.unpack("<4sL", header[36:]), (b"data", 0xFFFFFFFF))
+		else:
+			frames = output.data()
+		assert_eq(frames, expected_frames)
+
+		parsed = [(json.loads(line), position) for line, position in events.writes]
+		starts = [event["input_frame"] for event, position in parsed if event["event"] == "start"]
+		ends = [event["input_frame"] for event, position in parsed if event["event"] == "end"]
+		assert_eq([list(segment) for segment in zip(starts, ends)], segments)
+		assert_eq(parsed[-1][0]["output_frame"], result.output_frames)
+		if not live:
+			# events are written no later than pre-roll plus hysteresis after their input was read
+			latency = (snarp.PRE_ROLL_CHUNKS + snarp.HYSTERESIS_CHUNKS + 1) * chunk_frames
+			for event, position in parsed:
+				assert (position - header_bytes) // 2 - event["input_frame"] <= latency
+	os.unlink(OUTPUT_FILENAME + ".bypass")
+
+def test_split_output_writes_each_segment():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	result, expected = remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+	expected_wave = wave.open(io.BytesIO(expected), "rb")
+	expected_frames = expected_wave.readframes(expected_wave.getnframes())
+	index_file = io.BytesIO()
+	with open(filename, "rb") as input:
+		snarp.index_silences(input, index_file)
+	segments = json.loads(index_file.getvalue())['segments']
+	directory = tempfile.mkdtemp()
+	try:
+		template = os.path.join(directory, "{index:02d}-{input_frame}-{seconds:.1f}-{time:%Y}.wav")
+		for map_input, live in [(True, False), (False, False), (False, True)]:
+			events = io.BytesIO()
+			with open(filename, "rb") as input:
+				with open(OUTPUT_FILENAME, "wb") as output:
+					with snarp.split_output(template, writers=3):
+						with snarp.segment_events(events):
+							if live:
+								snarp.live_remove_silences(input, output)
+							else:
+								snarp.remove_silences(input, output, map_input=map_input)
+			written = [event for event in map(json.loads, events.getvalue().splitlines()) if event["event"] == "file"]
+			assert_eq(sorted([event["input_frame"], event["input_frame"] + event["frames"]] for event in written), segments)
+			filenames = sorted(os.listdir(directory))
+			assert_eq(len(filenames), len(segments))
+			frames = b""
+			for name, (start, stop) in zip(filenames, segments):
+				assert name.startswith("{0:02d}-{1}-{2:.1f}-".format(filenames.index(name) + 1, start, start / 44100.0))
+				segment_wave = wave.open(os.path.join(directory, name), "rb")
+				assert_eq(segment_wave.getnframes(), stop - start)
+				frames += segment_wave.readframes(stop - start)
+				os.unlink(os.path.join(directory, name))
+			assert_eq(frames, expected_frames)
+	finally:
+		shutil.rmtree(directory)
+	os.unlink(OUTPUT_FILENAME)
+
+def test_split_output_without_joined_output():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	directory = tempfile.mkdtemp()
+	try:
+		template = os.path.join(directory, "{index}.wav")
+		# rolling options apply to the joined output, which isn't written
+		assert_eq(snarp.main("snarp.py", "-i", filename, "--split", template, "--roll-interval", "1"), 0)
+		assert_eq(sorted(os.listdir(directory)), ["1.wav", "2.wav", "3.wav"])
+	finally:
+		shutil.rmtree(directory)
+
+def test_live_pipeline_matches_remove_silences():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	outputs = []
+	for remove in (snarp.remove_silences, snarp.live_remove_silences):
+		with open(filename, "rb") as input:
+			with open(OUTPUT_FILENAME, "wb+") as output:
+				with open(OUTPUT_FILENAME + ".bypass", "wb+") as bypass:
+					result = remove(input, output, bypass)
+		assert_eq(result, snarp.SilenceRemovalResult(262395, 55125, 44100))
+		with open(OUTPUT_FILENAME, "rb") as output:
+			with open(OUTPUT_FILENAME + ".bypass", "rb") as bypass:
+				outputs.append((output.read(), bypass.read()))
+	assert_eq(outputs[1], outputs[0])
+	os.unlink(OUTPUT_FILENAME)
+	os.unlink(OUTPUT_FILENAME + ".bypass")
+
+class FailingInput(object):
+	# a file whose reads fail once `size` bytes are read
+	def __init__(self, data, size):
+		self.input = io.BytesIO(data)
+		self.size = size
+
+	def read(self, n=-1):
+		if self.input.tell() >= self.size:
+			raise IOError("disk gone")
+		return self.input.read(n)
+
+def test_live_pipeline_raises_reader_errors():
+	with open("test/data/generated-beeps-44k-16bit-1ch.wav", "rb") as input:
+		data = input.read()
+	with open(OUTPUT_FILENAME, "wb") as output:
+		try:
+			snarp.live_remove_silences(FailingInput(data, 100000), output)
+		except IOError as e:
+			assert_eq(str(e), "disk gone")
+		else:
+			assert False, "reader error was lost"
+	os.unlink(OUTPUT_FILENAME)
+
+class SlowWriter(RecordingWriter):
+	def writeframes(self, frames):
+		time.sleep(0.01)
+		RecordingWriter.writeframes(self, frames)
+
+def test_live_pipeline_drains_input_under_backpressure():
+	with open("test/data/generated-beeps-44k-16bit-1ch.wav", "rb") as input:
+		input_wave = wave.open(input)
+		output = SlowWriter()
+		pipeline = snarp.LivePipeline(input_wave, output, queue_chunks=1, spill_chunks=2)
+		pipeline.run()
+	counters = pipeline.counters
+	# the reader finished the whole input without waiting for the writer
+	assert_eq(counters['frames_read'], 262395)
+	assert counters['backpressure_events'] > 0
+	assert counters['overruns'] > 0
+	assert_eq(counters['max_spilled_chunks'], 2)
+	assert counters['chunks_written'] < 60
+
+class RecordingWave(RecordingWriter):
+	def frames(self):
+		return b"".join(self.writes)
+
+def detect(detector, filename):
+	with open(filename, "rb") as input:
+		output = RecordingWave()
+		result = detector.process(wave.open(input), output)
+	return result, output.frames()
+
+def test_silence_detectors_run_side_by_side():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	with open(filename, "rb") as input:
+		with open(OUTPUT_FILENAME, "wb+") as output:
+			snarp.remove_silences(input, output, map_input=False)
+			output.seek(0)
+			output_wave = wave.open(output, "rb")
+			expected = output_wave.readframes(output_wave.getnframes())
+	os.unlink(OUTPUT_FILENAME)
+	default = snarp.SilenceDetector()
+	assert_eq(detect(default, filename), (snarp.SilenceRemovalResult(262395, 55125, 44100), expected))
+
+	detectors = [default, default.copy(pre_roll_ms=0, post_roll_ms=500), default.copy(peak_limit=-3, iqr_limit=-3)]
+	serial = [detect(detector, filename) for detector in detectors]
+	assert len(set(frames for result, frames in serial)) == 3
+	concurrent = [None] * len(detectors)
+	def run(i):
+		concurrent[i] = detect(detectors[i], filename)
+	threads = [threading.Thread(target=run, args=(i,)) for i in range(len(detectors))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert_eq(concurrent, serial)
+
+def test_silence_detector_ignores_changed_globals():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	detector = snarp.SilenceDetector()
+	expected = detect(detector, filename)
+	with snarp.analysis_timing(10, window_ms=500):
+		with snarp.silence_limits(-3, -3):
+			assert_eq(detect(detector, filename), expected)
+			assert_eq(detect(detector.copy(), filename), expected)
+
+class TricklingPipe(object):
+	# hands out at most a few bytes per read, like a slow pipe
+	def __init__(self, data, size=7):
+		self.data = io.BytesIO(data)
+		self.size = size
+
+	def readinto(self, buf):
+		data = self.data.read(min(len(buf), self.size))
+		buf[:len(data)] = data
+		return len(data)
+
+def test_raw_pcm_reader_reuses_buffers():
+	data = bytes(bytearray(i % 251 for i in range(6 * 100 + 4)))
+	reader = snarp.RawPcmReader(TricklingPipe(data), 3, 2, 8000, 30)
+	buffers = [id(buf) for buf in reader.buffers]
+	chunks = []
+	while True:
+		frames = reader.readframes(11)
+		if not frames:
+			break
+		chunks.append(frames.tobytes())
+	# the last, partial frame is dropped
+	assert_eq(b"".join(chunks), data[:600])
+	assert_eq([len(chunk) for chunk in chunks], [66] * 9 + [6])
+	assert_eq((reader.tell(), reader.getnframes()), (100, 100))
+	assert_eq([id(buf) for buf in reader.buffers], buffers)
+	# samples are converted to little endian, and signed unless 8 bit
+	for name, data, expected in [
+		("S16_BE", b"\x12\x34\xff\xfe", b"\x34\x12\xfe\xff"),
+		("U16_LE", b"\x00\x80\xff\x7f", b"\x00\x00\xff\xff"),
+		("U24_3BE", b"\x80\x00\x01\x00\x00\x00", b"\x01\x00\x00\x00\x00\x80"),
+		("S32_BE", b"\x01\x02\x03\x04", b"\x04\x03\x02\x01"),
+		("U32_BE", b"\x80\x00\x00\x01", b"\x01\x00\x00\x00"),
+		("S8", b"\x00\x80\x7f", b"\x80\x00\xff"),
+		("U8", b"\x00\x80\x7f", b"\x00\x80\x7f"),
+	]:
+		sample_width, signedness, endianness = snarp.RAW_FORMATS[name]
+		reader = snarp.RawPcmReader(TricklingPipe(data), sample_width, 1, 8000, 10, signedness, endianness)
+		assert_eq(reader.readframes(10).tobytes(), expected)
+
+def test_raw_input_matches_wave_input():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	expected_result, expected_output = remove_silences_output(filename, snarp.SILENCE_PRESET_LIMITS['quiet'])
+	input_wave = wave.open(filename, "rb")
+	samples = snarp.parse_frames(input_wave.readframes(input_wave.getnframes()), 2, 1, True)
+	# 24 bit big endian, unlike any wave file
+	raw = b"".join(struct.pack(">i", int(sample) << 8)[1:] for sample in samples)
+	with snarp.raw_input_format("S24_3BE", 44100, 1, read_chunks=3):
+		for live in [False, True]:
+			output = io.BytesIO()
+			if live:
+				result = snarp.live_remove_silences(TricklingPipe(raw, 4096), output)
+			else:
+				result = snarp.remove_silences(TricklingPipe(raw, 4096), output)
+			assert_eq(result, expected_result)
+			output.seek(0)
+			output_wave = wave.open(output, "rb")
+			assert_eq(output_wave.getsampwidth(), 3)
+			output_samples = snarp.parse_frames(output_wave.readframes(output_wave.getnframes()), 3, 1, True)
+			expected_wave = wave.open(io.BytesIO(expected_output), "rb")
+			expected_samples = snarp.parse_frames(expected_wave.readframes(expected_wave.getnframes()), 2, 1, True)
+			assert [int(sample) for sample in output_samples] == [int(sample) << 8 for sample in expected_samples]
+
+def test_sweep_matches_single_runs():
+	filename = "test/data/generated-beeps-44k-16bit-1ch.wav"
+	configurations = snarp.sweep_configurations([-21, -3], [-30, -3], [300, 1000], [0, 200], [100, 500])
+	for jobs in (1, 2):
+		with open(filename, "rb") as input:
+			results = snarp.sweep(input, configurations, jobs)
+		assert_eq([result.configuration for result in results], configurations)
+		for result in results[::5]:
+			detector = snarp.SilenceDetector(**result.configuration._asdict())
+			expected, frames = detect(detector, filename)
+			assert_eq(result.kept_frames, expected.output_frames)
+			assert_eq(result.segments > 0, result.kept_frames > 0)
+			assert result.min_seconds <= result.median_seconds <= result.p90_seconds <= result.max_seconds
+	assert len(set(result.kept_frames for result in results)) > 1
+
+def test_stream_server_handles_concurrent_streams():
+	filename = "test/data/generated-beeps-22k-16bit-1ch.wav"
+	output_dir = tempfile.mkdtemp()
+	try:
+		server = snarp.StreamServer(snarp.SilenceDetector(), output_dir)
+		address = server.listen("127.0.0.1", 0)
+		fifo = os.path.join(output_dir, "mic.fifo")
+		os.mkfifo(fifo)
+		server.add_fifo(fifo)
+		with open(filename, "rb") as input:
+			data = input.read()
+		def send_socket():
+			connection = socket.create_connection(address)
+			connection.sendall(data)
+			connection.close()
+		def send_fifo():
+			with open(fifo, "wb") as f:
+				f.write(data)
+		senders = [threading.Thread(target=send_socket) for i in range(3)] + [threading.Thread(target=send_fifo)]
+		for sender in senders:
+			sender.start()
+		for sender in senders:
+			sender.join()
+		deadline = time.time() + 10
+		while len(server.results) < 4 and time.time() < deadline:
+			time.sleep(0.05)
+		server.stop()
+		assert_eq(len(server.results), 4)
+		for name, result in server.results.items():
+			assert_eq(result, snarp.SilenceRemovalResult(131198, 27563, 22050))
+			assert_eq(wave.open(os.path.join(output_dir, name + ".wav"), "rb").getnframes(), 27563)
+	finally:
+		shutil.rmtree(output_dir)
+
+def test_stream_server_output_files():
+	filename = "test/data/generated-beeps-22k-16bit-1ch.wav"
+	for rf64, roll_seconds in [(False, None), (True, None), (False, 0.5), (True, 0.5)]:
+		output_dir = tempfile.mkdtemp()
+		try:
+			with snarp.output_files(rf64, roll_seconds=roll_seconds):
+				server = snarp.StreamServer(snarp.SilenceDetector(), output_dir)
+				server.add_fifo(filename)
+				server.wait()
+			name = "generated-beeps-22k-16bit-1ch"
+			assert_eq(server.results[name], snarp.SilenceRemovalResult(131198, 27563, 22050))
+			names = sorted(os.listdir(output_dir))
+			if roll_seconds is None:
+				assert_eq(names, [name + ".wav"])
+			else:
+				assert_eq(len(names), 3)
+			frames = [wave.open(os.path.join(output_dir, f), "rb").getnframes() for f in names]
+			assert_eq(sum(frames), 27563)
+		finally:
+			shutil.rmtree(output_dir)
+
+def test_metrics_count_pipeline_stages():
+	metrics = snarp.Metrics()
+	with snarp.metrics_sink(metrics):
+		with open("test/data/generated-beeps-22k-16bit-1ch.wav", "rb") as input:
+			with open(OUTPUT_FILENAME, "wb+") as output:
+				with open(OUTPUT_FILENAME + ".bypass", "wb+") as bypass:
+					result = snarp.remove_silences(input, output, bypass)
+	snapshot = metrics.snapshot()
+	counters = snapshot['counters']
+	assert_eq(counters['snarp_input_frames_total'], 131198)
+	assert_eq(counters['snarp_chunks_total{kind="silent"}'] + counters['snarp_chunks_total{kind="audible"}'], 60)
+	assert_eq(counters['snarp_written_bytes_total{writer="output"}'], result.output_frames * 2)
+	assert_eq(counters['snarp_written_bytes_total{writer="bypass"}'], 131198 * 2)
+	assert counters['snarp_segments_total{kind="audible"}'] > 0
+	assert_eq(snapshot['histograms']['snarp_read_seconds']['count'], 60)
+	assert snapshot['gauges']['snarp_realtime_factor'] > 1
+	os.unlink(OUTPUT_FILENAME)
+	os.unlink(OUTPUT_FILENAME + ".bypass")
+
+def test_metrics_exporters():
+	directory = tempfile.mkdtemp()
+	try:
+		textfile = os.path.join(directory, "snarp.prom")
+		jsonl = os.path.join(directory, "snarp.jsonl")
+		metrics = snarp.Metrics(
+			[snarp.PrometheusTextfileExporter(textfile), snarp.JsonLinesExporter(jsonl)],
+			buckets=(0.5, 1.0)
+		)
+		metrics.count("chunks_total", 3, kind="silent")
+		metrics.gauge("realtime_factor", 2.5)
+		for value in (0.25, 0.75, 2.0):
+			metrics.observe("write_seconds", value, writer="output")
+		metrics.close()
+		with open(textfile) as f:
+			assert_eq(f.read().splitlines(), [
+				'# TYPE chunks_total counter',
+				'chunks_total{kind="silent"} 3',
+				'# TYPE realtime_factor gauge',
+				'realtime_factor 2.5',
+				'# TYPE write_seconds histogram',
+				'write_seconds_bucket{writer="output",le="0.5"} 1',
+				'write_seconds_bucket{writer="output",le="1.0"} 2',
+				'write_seconds_bucket{writer="output",le="+Inf"} 3',
+				'write_seconds_sum{writer="output"} 3.0',
+				'write_seconds_count{writer="output"} 3',
+			])
+		with open(jsonl) as f:
+			snapshots = [json.loads(line) for line in f]
+		assert_eq(len(snapshots), 1)
+		assert_eq(snapshots[0]['histograms']['write_seconds{writer="output"}']['buckets'], [1, 2, 3])
+	finally:
+		shutil.rmtree(directory)
+
 
 if __name__ == '__main__':
 	test()
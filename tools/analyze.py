@@ -4,9 +4,13 @@
 Analyze chunk sample level stats from SNARP
 
 Run SNARP with the flag --stats-file to specify the filename to save
-CSV sample stats data to. Analye with
+sample stats data to. Analye with
 
-    python analyze.py statsfile.csv
+    python analyze.py statsfile
+
+Binary stats files are memory mapped and converted to dBFS in one
+vectorized step; CSV stats files (any filename ending in .csv) are
+read as well.
 
 You'll need the analysis dependencies in analyze-requirements.txt 
 installed.
@@ -17,16 +21,43 @@ from pandas import Series, DataFrame
 import code
 import numpy as np
 import matplotlib.pyplot as plt
+import os
 import sys
-import csv
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import snarp
+
+STATS_DTYPE = np.dtype([('peak_delta', '<f8'), ('iqr_delta', '<f8')])
+
+def deltas_to_dbfs(deltas, sample_width):
+	'''
+	Vectorized `snarp.sample_delta_to_dbfs`
+	'''
+	return np.log10(np.maximum(deltas, 1) / 2.0 ** (sample_width * 8)) * 10
+
+def load_stats(filename):
+	'''
+	Return (peak, iqr) dBFS level arrays from a binary or CSV stats file
+	'''
+	with open(filename, 'rb') as f:
+		try:
+			sample_width = snarp.read_stats_header(f)
+		except ValueError:
+			sample_width = None
+	if sample_width is None:
+		data = np.loadtxt(filename, delimiter=',', ndmin=2)
+		return data[:, 0], data[:, 1]
+	records = np.memmap(filename, dtype=STATS_DTYPE, mode='r', offset=snarp.STATS_HEADER.size)
+	return (
+		deltas_to_dbfs(records['peak_delta'], sample_width),
+		deltas_to_dbfs(records['iqr_delta'], sample_width)
+	)
 
 if __name__ == '__main__':
-	with open("stats.csv" if len(sys.argv) < 2 else sys.argv[1]) as f:
-		reader = csv.reader(f)
-		data = [(float(peak), float(iqr)) for peak, iqr in reader]
+	peaks, iqrs = load_stats("stats.csv" if len(sys.argv) < 2 else sys.argv[1])
 
-	md = Series(zip(*data)[0])
-	iqrd = Series(zip(*data)[1])
+	md = Series(peaks)
+	iqrd = Series(iqrs)
 
 	df = DataFrame(data=dict(max_deltas=md, iqr_deltas=iqrd))
 
@@ -0,0 +1,599 @@
+#!/usr/bin/env python
+# coding=utf8
+'''
+Benchmark SNARP processing stages
+
+Compare the bulk sample decoder (`snarp.parse_frames`) against the
+original per-sample `struct.unpack` path (`snarp.frame_to_sample`):
+
+    python benchmark.py decode
+
+Compare sort based chunk statistics against selection based ones, per
+chunk and batched:
+
+    python benchmark.py stats
+
+Compare per-chunk analysis cost for 1 to 8 channel input:
+
+    python benchmark.py channels
+
+Compare the chunk detectors (see snarp.DETECTORS), timing statistics
+and decisions on synthetic chunks of noise and tones at random levels,
+and counting the decisions that differ from the peak-iqr detector's:
+
+    python benchmark.py detectors
+
+Compare decoding and analysis at several decimation factors (see
+snarp.ANALYSIS_DECIMATION) in both modes, reporting how many chunk
+decisions and segments differ from full rate analysis, on the test data
+and on synthetic tone bursts:
+
+    python benchmark.py decimation
+
+Compare peak memory and run time of remove_silences reading through the
+wave module against the memory mapped input path:
+
+    python benchmark.py mapped
+
+Measure the overhead of running many streams through one process with
+`snarp.SilenceDetector`, one thread each (as the serve command does):
+
+    python benchmark.py streams
+
+Throughput is reported in frames per second.
+
+Run the full suite on synthetic recordings (see synthetic.py) of various
+rates, sample widths and channel counts, timing each stage and the whole
+run, and save the results as JSON:
+
+    python benchmark.py suite --seconds 600 --output results.json
+
+Stage times are cumulative differences: `chunked_samples` alone, then
+what `tag_chunks` and `tag_segments` add on top, and separately the
+buffered writers copying every frame. `end_to_end` is `remove_silences`.
+Compare two result files, e.g. from different commits, with
+
+    python benchmark.py compare before.json after.json
+
+The suite needs NumPy.
+'''
+
+import os
+import sys
+import time
+import random
+import math
+import wave
+import collections
+import shutil
+import logging
+import resource
+import tempfile
+import multiprocessing
+import argparse
+import itertools
+import subprocess
+import json
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import snarp
+
+DECODE_FORMATS = [
+	# (sample_width, nchannels, signed_data)
+	(1, 1, False),
+	(2, 1, True),
+	(2, 2, True),
+	(3, 1, True),
+	(4, 1, True),
+]
+
+def random_frames(nframes, sample_width, nchannels, seed=0):
+	rng = random.Random(seed)
+	return bytes(bytearray(rng.randrange(256) for i in range(nframes * sample_width * nchannels)))
+
+def best_time(func, repeat=3):
+	'''Return the shortest run time of `repeat` calls of func'''
+	best = None
+	for i in range(repeat):
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best
+
+def scalar_decode(frames, sample_width, nchannels, signed_data):
+	frame_width = sample_width * nchannels
+	return [
+		snarp.frame_to_sample(frames[i:i + frame_width], sample_width, signed_data)
+		for i in range(0, len(frames), frame_width)
+	]
+
+def benchmark_decode(seconds=10, frame_rate=48000, chunk_ms=snarp.CHUNK_MS):
+	'''Time decoding `seconds` of audio chunk by chunk with each decoder'''
+	nframes = int(seconds * frame_rate)
+	frames_per_chunk = int(frame_rate * chunk_ms / 1000.0)
+	print("{0:>6} {1:>3} {2:>8} {3:>14} {4:>14} {5:>14} {6:>8}".format(
+		"width", "ch", "signed", "scalar fps", "array fps", "numpy fps", "speedup"
+	))
+	for sample_width, nchannels, signed_data in DECODE_FORMATS:
+		frames = random_frames(nframes, sample_width, nchannels)
+		frame_width = sample_width * nchannels
+		chunks = [
+			frames[i:i + frames_per_chunk * frame_width]
+			for i in range(0, len(frames), frames_per_chunk * frame_width)
+		]
+
+		def run(parse):
+			for chunk in chunks:
+				parse(chunk, len(chunk) // sample_width, sample_width, signed_data, 'little')
+
+		if sample_width in (1, 2, 4):
+			scalar = best_time(lambda: [
+				scalar_decode(chunk, sample_width, nchannels, signed_data) for chunk in chunks
+			], repeat=1)
+		else:
+			# the scalar decoder never supported packed 24 bit samples
+			scalar = None
+		array_time = best_time(lambda: run(snarp._parse_frames_array))
+		numpy_time = best_time(lambda: run(snarp._parse_frames_numpy)) if snarp.numpy is not None else None
+
+		best = min(t for t in (array_time, numpy_time) if t is not None)
+		print("{0:>6} {1:>3} {2:>8} {3:>14} {4:>14} {5:>14} {6:>8}".format(
+			sample_width * 8,
+			nchannels,
+			"yes" if signed_data else "no",
+			"{0:.0f}".format(nframes / scalar) if scalar else "n/a",
+			"{0:.0f}".format(nframes / array_time),
+			"{0:.0f}".format(nframes / numpy_time) if numpy_time else "n/a",
+			"{0:.1f}x".format(scalar / best) if scalar else "n/a",
+		))
+
+def sorted_chunk_stats(samples):
+	# the original sort based tag_chunks statistics
+	samples = sorted(samples)
+	count = len(samples)
+	first, last = samples[:int(count/2)], samples[int(count/2):]
+	q1, q3 = first[int(len(first)/2):][0], last[int(len(last)/2):][0]
+	return samples[count - 1] - samples[0], q3 - q1
+
+def benchmark_stats(seconds=60, frame_rate=96000, chunk_ms=snarp.CHUNK_MS, batch_size=64):
+	'''Time chunk statistics for `seconds` of 16 bit audio'''
+	nframes = int(seconds * frame_rate)
+	frames_per_chunk = int(frame_rate * chunk_ms / 1000.0)
+	frames = random_frames(nframes, 2, 1)
+	chunks = [
+		snarp.parse_frames(frames[i:i + frames_per_chunk * 2], 2, 1, True)
+		for i in range(0, len(frames), frames_per_chunk * 2)
+	]
+	timings = [
+		("sorted", best_time(lambda: [sorted_chunk_stats(chunk) for chunk in chunks], repeat=1)),
+		("chunk_stats", best_time(lambda: [snarp.chunk_stats(chunk) for chunk in chunks])),
+		("chunk_stats_batch", best_time(lambda: [
+			snarp.chunk_stats_batch(chunks[i:i + batch_size])
+			for i in range(0, len(chunks), batch_size)
+		])),
+	]
+	for name, elapsed in timings:
+		print("{0:>18} {1:>14.0f} fps {2:>10.1f}x realtime".format(
+			name, nframes / elapsed, seconds / elapsed
+		))
+
+def benchmark_channels(seconds=60, frame_rate=48000, chunk_ms=snarp.CHUNK_MS):
+	'''Time decoding and statistics of 16 bit audio by channel count'''
+	nframes = int(seconds * frame_rate)
+	frames_per_chunk = int(frame_rate * chunk_ms / 1000.0)
+	for nchannels in (1, 2, 8):
+		frame_width = 2 * nchannels
+		frames = random_frames(nframes, 2, nchannels)
+		chunks = [
+			frames[i:i + frames_per_chunk * frame_width]
+			for i in range(0, len(frames), frames_per_chunk * frame_width)
+		]
+		elapsed = best_time(lambda: [
+			snarp.chunk_stats_batch([snarp.parse_frames(chunk, 2, nchannels, True)], nchannels)
+			for chunk in chunks
+		])
+		print("{0:>3} channels {1:>14.0f} fps {2:>10.1f}x realtime".format(
+			nchannels, nframes / elapsed, seconds / elapsed
+		))
+
+def detector_chunks(nchunks, frames_per_chunk, seed=0):
+	'''
+	Return 16 bit mono chunks of quiet noise, tones and loud noise, in
+	random order and at random levels around the default silence limits
+	'''
+	rng = random.Random(seed)
+	chunks = []
+	for i in range(nchunks):
+		kind = rng.choice(('floor', 'tone', 'noise'))
+		amplitude = 32767 * 10 ** (rng.uniform(-60, -10) / 20.0)
+		if kind == 'tone':
+			step = 2 * math.pi * rng.uniform(100, 1000) / 48000
+			samples = [int(amplitude * math.sin(step * j)) for j in range(frames_per_chunk)]
+		else:
+			if kind == 'floor':
+				amplitude /= 100
+			samples = [int(rng.gauss(0, amplitude)) for j in range(frames_per_chunk)]
+		frames = snarp.array.array('h', [max(-32768, min(32767, sample)) for sample in samples]).tostring()
+		chunks.append(snarp.parse_frames(frames, 2, 1, True))
+	return chunks
+
+def benchmark_detectors(nchunks=2000, frame_rate=48000, chunk_ms=snarp.CHUNK_MS, batch_size=64):
+	'''
+	Time each chunk detector's statistics and decisions on synthetic
+	chunks, and count the decisions differing from peak-iqr's
+	'''
+	frames_per_chunk = int(frame_rate * chunk_ms / 1000.0)
+	chunks = detector_chunks(nchunks, frames_per_chunk)
+	nframes = nchunks * frames_per_chunk
+	seconds = nframes / float(frame_rate)
+	decisions = {}
+	for name in sorted(snarp.DETECTORS):
+		detector = snarp.DETECTORS[name](snarp.current_silence_limits())
+		silence_deltas = detector.silence_deltas(2)
+		def decide():
+			audible = []
+			for i in range(0, len(chunks), batch_size):
+				first, second = detector.chunk_stats(chunks[i:i + batch_size], 1, 2)
+				audible.extend(
+					detector.audible(first[row][0], second[row][0], silence_deltas) for row in range(len(first))
+				)
+			return audible
+		elapsed = best_time(decide)
+		decisions[name] = decide()
+		differing = sum(1 for a, b in zip(decisions[name], decisions['peak-iqr']) if a != b)
+		print("{0:>10} {1:>14.0f} fps {2:>10.1f}x realtime {3:>6.1%} differ from peak-iqr".format(
+			name, nframes / elapsed, seconds / elapsed, differing / float(nchunks)
+		))
+
+def write_bursts(filename, seconds, frame_rate=48000, burst_seconds=2, gap_seconds=5):
+	'''Write a 16 bit mono wave file of tone bursts separated by silence'''
+	period = burst_seconds + gap_seconds
+	tone = bytes(bytearray().join(
+		bytearray(snarp.struct.pack('<h', int(16000 * math.sin(2 * math.pi * 440 * i / frame_rate))))
+		for i in range(frame_rate)
+	))
+	silence = b'\0\0' * frame_rate
+	output = wave.open(filename, 'wb')
+	output.setparams((1, 2, frame_rate, 0, 'NONE', 'not compressed'))
+	for second in range(int(seconds)):
+		output.writeframes(tone if second % period < burst_seconds else silence)
+	output.close()
+
+def _run_remove_silences(input_filename, output_filename, map_input, results):
+	logging.disable(logging.INFO)
+	start = time.time()
+	with open(input_filename, 'rb') as input_file:
+		with open(output_filename, 'wb') as output_file:
+			snarp.remove_silences(input_file, output_file, map_input=map_input)
+	results.put((time.time() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+def benchmark_mapped(seconds=3600):
+	'''Time remove_silences on `seconds` of audio, streamed and mapped'''
+	directory = tempfile.mkdtemp(prefix='snarp-benchmark-')
+	try:
+		input_filename = os.path.join(directory, 'input.wav')
+		write_bursts(input_filename, seconds)
+		for map_input in (False, True):
+			results = multiprocessing.Queue()
+			process = multiprocessing.Process(target=_run_remove_silences, args=(
+				input_filename, os.path.join(directory, 'output.wav'), map_input, results
+			))
+			process.start()
+			elapsed, maxrss = results.get()
+			process.join()
+			print("{0:>8} {1:>8.2f} s {2:>8.1f}x realtime {3:>8.1f} MB peak RSS".format(
+				"mapped" if map_input else "wave", elapsed, seconds / elapsed, maxrss / 1024.0
+			))
+	finally:
+		shutil.rmtree(directory)
+
+DECIMATION_FILES = [
+	os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'test', 'data', name)
+	for name in ('generated-beeps-44k-16bit-1ch.wav', 'generated-beeps-22k-8bit-1ch.wav')
+]
+
+def decimated_flags(filename, decimation, mode):
+	'''Return the chunk flags of `filename`, decoded and tagged at `decimation`'''
+	with open(filename, 'rb') as input_file:
+		input_wave = wave.open(input_file)
+		with snarp.analysis_decimation(decimation, mode):
+			return [
+				silent for silent, samples, frames in snarp.tag_chunks(
+					snarp.chunked_samples(input_wave, snarp.CHUNK_MS / 1000.0),
+					snarp.input_delta_limits(input_wave),
+					sample_width=input_wave.getsampwidth(),
+					batch_size=16,
+					nchannels=input_wave.getnchannels()
+				)
+			]
+
+def benchmark_decimation(seconds=600, factors=(1, 2, 4, 8, 16)):
+	'''
+	Time decoding and analysis at each decimation factor and mode, and
+	report the chunk decisions and segments differing from full rate
+	analysis, for the test data and `seconds` of 96 kHz tone bursts
+	'''
+	directory = tempfile.mkdtemp(prefix='snarp-benchmark-')
+	try:
+		bursts = os.path.join(directory, 'bursts.wav')
+		write_bursts(bursts, seconds, frame_rate=96000)
+		for filename in DECIMATION_FILES + [bursts]:
+			print(os.path.basename(filename))
+			nframes = wave.open(filename, 'rb').getnframes()
+			expected = decimated_flags(filename, 1, 'stride')
+			expected_segments = snarp.segment_flags(expected)
+			for mode in snarp.DECIMATION_MODES:
+				for decimation in factors:
+					flags = decimated_flags(filename, decimation, mode)
+					elapsed = best_time(lambda: decimated_flags(filename, decimation, mode))
+					differing = sum(1 for a, b in zip(flags, expected) if a != b)
+					segments = snarp.segment_flags(flags)
+					print("{0:>9} {1:>3} {2:>14.0f} fps {3:>6.1%} chunks differ {4:>4} segments ({5:+d})".format(
+						mode, decimation, nframes / elapsed, differing / float(len(flags)),
+						len(segments), len(segments) - len(expected_segments)
+					))
+	finally:
+		shutil.rmtree(directory)
+
+class NullWriter(object):
+	def writeframes(self, frames):
+		pass
+
+	def close(self):
+		pass
+
+def cpu_time():
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	return usage.ru_utime + usage.ru_stime
+
+def benchmark_streams(seconds=600, frame_rate=16000, counts=(1, 4, 16, 64)):
+	'''
+	Time `seconds` of audio in each of 1 to many concurrent streams
+
+	The CPU time per stream should stay flat as streams are added; any
+	growth is the cost of running them side by side in one process.
+	'''
+	logging.disable(logging.INFO)
+	directory = tempfile.mkdtemp(prefix='snarp-benchmark-')
+	try:
+		input_filename = os.path.join(directory, 'input.wav')
+		write_bursts(input_filename, seconds, frame_rate)
+		detector = snarp.SilenceDetector()
+		print("{0:>8} {1:>10} {2:>14} {3:>16} {4:>14} {5:>12}".format(
+			"streams", "wall s", "CPU s/stream", "vs one stream", "realtime each", "peak RSS MB"
+		))
+		single = None
+		for count in counts:
+			def run():
+				with open(input_filename, 'rb') as input_file:
+					detector.process(wave.open(input_file), NullWriter())
+			threads = [threading.Thread(target=run) for i in range(count)]
+			start, start_cpu = time.time(), cpu_time()
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			elapsed, per_stream = time.time() - start, (cpu_time() - start_cpu) / count
+			single = per_stream if single is None else single
+			print("{0:>8} {1:>10.2f} {2:>14.3f} {3:>+15.1%} {4:>13.1f}x {5:>12.1f}".format(
+				count,
+				elapsed,
+				per_stream,
+				per_stream / single - 1,
+				seconds / elapsed,
+				resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+			))
+	finally:
+		shutil.rmtree(directory)
+
+# (signal, frame rate, sample width, channels)
+SUITE_CASES = [
+	('speech', 8000, 1, 1),
+	('speech', 16000, 2, 1),
+	('speech', 44100, 2, 2),
+	('speech', 48000, 3, 2),
+	('speech', 96000, 4, 1),
+	('speech', 48000, 2, 8),
+	('tone', 48000, 2, 1),
+	('noise', 48000, 2, 1),
+]
+
+# regressions beyond this fraction are flagged by compare, unless the
+# stage took less than REGRESSION_MIN_SECONDS in both runs
+REGRESSION_THRESHOLD = 0.1
+REGRESSION_MIN_SECONDS = 0.01
+
+def case_name(signal, frame_rate, sample_width, nchannels):
+	return "{0}-{1}hz-{2}bit-{3}ch".format(signal, frame_rate, sample_width * 8, nchannels)
+
+def consume(iterable):
+	for item in iterable:
+		pass
+
+def measure_case(filename, directory):
+	'''
+	Time the stages of SNARP on wave file `filename`
+
+	Should run in a fresh interpreter (see suite_main) so that the peak RSS
+	reflects this case alone.
+	'''
+	logging.disable(logging.INFO)
+	stages = collections.OrderedDict()
+	with open(filename, 'rb') as input_file:
+		input_wave = wave.open(input_file)
+		frame_width = input_wave.getsampwidth() * input_wave.getnchannels()
+
+		def decode():
+			input_wave.rewind()
+			consume(itertools.takewhile(
+				lambda chunk: len(chunk[1]),
+				snarp.chunked_samples(input_wave, snarp.CHUNK_MS / 1000.0)
+			))
+		def tag():
+			input_wave.rewind()
+			consume(snarp.tag_input_chunks(input_file, input_wave, None))
+		def segment():
+			input_wave.rewind()
+			consume(snarp.tag_segments(snarp.tag_input_chunks(input_file, input_wave, None)))
+
+		# each stage is timed as the difference to the stages before it
+		decoded, tagged, segmented = best_time(decode), best_time(tag), best_time(segment)
+		stages['chunked_samples'] = decoded
+		stages['tag_chunks'] = max(0.0, tagged - decoded)
+		stages['tag_segments'] = max(0.0, segmented - tagged)
+
+		mapped = snarp.MappedWaveData.open(input_file, frame_width)
+		chunk_bytes = int(input_wave.getframerate() * snarp.CHUNK_MS / 1000.0) * frame_width
+		def write():
+			with open(os.path.join(directory, 'written.wav'), 'wb') as output_file:
+				output_wave = snarp.open_output_wave(output_file, input_wave.getparams())
+				for offset in range(0, mapped.size, chunk_bytes):
+					output_wave.writeframes(mapped.view(offset, offset + chunk_bytes))
+				output_wave.close()
+		stages['writers'] = best_time(write)
+		nframes = mapped.size // frame_width
+
+	results = []
+	def remove():
+		with open(filename, 'rb') as input_file:
+			with open(os.path.join(directory, 'output.wav'), 'wb') as output_file:
+				results.append(snarp.remove_silences(input_file, output_file))
+	stages['end_to_end'] = best_time(remove)
+
+	return {
+		'frames': nframes,
+		'output_frames': results[0].output_frames,
+		'stages': stages,
+		'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+	}
+
+def measure_main(argv):
+	filename, directory = argv
+	json.dump(measure_case(filename, directory), sys.stdout)
+	return 0
+
+def git_commit():
+	try:
+		return subprocess.check_output(
+			['git', 'rev-parse', 'HEAD'],
+			cwd=os.path.dirname(os.path.abspath(__file__))
+		).strip().decode('ascii')
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def suite_main(argv):
+	parser = argparse.ArgumentParser(prog='benchmark.py suite', description='Run the benchmark suite.')
+	parser.add_argument('--seconds', type=float, default=600, help='Length of each synthetic recording.')
+	parser.add_argument('--cases', default='', help='Only run cases whose name contains this string.')
+	parser.add_argument('--output', default=None, help='Write results to this JSON file.')
+	args = parser.parse_args(argv)
+
+	import synthetic
+
+	report = {
+		'commit': git_commit(),
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+		'python': sys.version.split()[0],
+		'numpy': snarp.numpy.__version__ if snarp.numpy is not None else None,
+		'seconds': args.seconds,
+		'cases': collections.OrderedDict(),
+	}
+	print("{0:<28} {1:>9} {2:>14} {3:>9}  {4}".format(
+		"case", "realtime", "fps", "RSS MB", "stage seconds"
+	))
+	for case in SUITE_CASES:
+		name = case_name(*case)
+		if args.cases not in name:
+			continue
+		directory = tempfile.mkdtemp(prefix='snarp-benchmark-')
+		try:
+			filename = os.path.join(directory, 'input.wav')
+			synthetic.write_synthetic(filename, *(case + (args.seconds,)))
+			measured = json.loads(subprocess.check_output(
+				[sys.executable, os.path.abspath(__file__), 'measure', filename, directory]
+			).decode('utf8'), object_pairs_hook=collections.OrderedDict)
+		finally:
+			shutil.rmtree(directory)
+		end_to_end = measured['stages']['end_to_end']
+		measured['realtime_factor'] = args.seconds / end_to_end
+		measured['frames_per_second'] = measured['frames'] / end_to_end
+		report['cases'][name] = measured
+		print("{0:<28} {1:>8.1f}x {2:>14.0f} {3:>9.1f}  {4}".format(
+			name,
+			measured['realtime_factor'],
+			measured['frames_per_second'],
+			measured['peak_rss_mb'],
+			' '.join("{0}={1:.3f}".format(stage, elapsed) for stage, elapsed in measured['stages'].items())
+		))
+
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=2)
+	return 0
+
+def compare_main(argv):
+	parser = argparse.ArgumentParser(prog='benchmark.py compare', description='Compare two suite results.')
+	parser.add_argument('before')
+	parser.add_argument('after')
+	args = parser.parse_args(argv)
+	with open(args.before) as f:
+		before = json.load(f, object_pairs_hook=collections.OrderedDict)
+	with open(args.after) as f:
+		after = json.load(f, object_pairs_hook=collections.OrderedDict)
+	print("{0} -> {1}".format(before.get('commit'), after.get('commit')))
+
+	regressions = 0
+	for name, new in after['cases'].items():
+		old = before['cases'].get(name)
+		if old is None:
+			continue
+		# normalize by length in case the runs used different --seconds
+		cells = []
+		for stage in new['stages']:
+			if stage not in old['stages']:
+				continue
+			old_rate = old['stages'][stage] / old['frames']
+			new_rate = new['stages'][stage] / new['frames']
+			if old_rate:
+				ratio = new_rate / old_rate
+			else:
+				ratio = 1.0 if not new_rate else float('inf')
+			flag = ''
+			# stages this short are mostly timer noise
+			timed = max(old['stages'][stage], new['stages'][stage]) >= REGRESSION_MIN_SECONDS
+			if timed and ratio > 1 + REGRESSION_THRESHOLD:
+				flag = '!'
+				regressions += 1
+			cells.append("{0}={1:.2f}x{2}".format(stage, ratio, flag))
+		print("{0:<28} {1}".format(name, ' '.join(cells)))
+	print("{0} stage regressions over {1:.0%} (time ratios after/before, ! marks them)".format(
+		regressions, REGRESSION_THRESHOLD
+	))
+	return 1 if regressions else 0
+
+# benchmarks taking command line arguments
+COMMANDS = {
+	'suite': suite_main,
+	'compare': compare_main,
+	'measure': measure_main,
+}
+
+BENCHMARKS = {
+	'decode': benchmark_decode,
+	'stats': benchmark_stats,
+	'channels': benchmark_channels,
+	'detectors': benchmark_detectors,
+	'decimation': benchmark_decimation,
+	'mapped': benchmark_mapped,
+	'streams': benchmark_streams,
+}
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+		sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
+	names = sys.argv[1:] or sorted(BENCHMARKS)
+	for name in names:
+		print("== {0} ==".format(name))
+		BENCHMARKS[name]()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# coding=utf8
+'''
+Generate deterministic synthetic recordings for benchmarking SNARP
+
+Signals are built from a seeded random generator, so the same arguments
+always produce the same file. Available signals:
+
+    tone    a steady 440 Hz tone
+    noise   a constant noise floor, nothing audible
+    speech  speech-like bursts of syllable-modulated noise and harmonics,
+            separated by pauses, over a noise floor
+
+Generate a file from the command line with
+
+    python synthetic.py speech 48000 3 2 600 speech.wav
+
+for ten minutes of 24 bit stereo at 48 kHz. NumPy is required.
+'''
+
+import sys
+import wave
+
+import numpy
+
+SIGNALS = ('tone', 'noise', 'speech')
+
+NOISE_FLOOR_DBFS = -60.0
+BLOCK_SECONDS = 10
+
+def dbfs_to_amplitude(dbfs):
+	return 10.0 ** (dbfs / 20.0)
+
+def speech_envelope(rng, nframes, frame_rate):
+	'''
+	Return a 0..1 envelope of 1-4 s bursts with 4 Hz syllables and 1-6 s pauses
+	'''
+	envelope = numpy.zeros(nframes)
+	position = int(rng.uniform(0.5, 3) * frame_rate)
+	while position < nframes:
+		length = int(rng.uniform(1, 4) * frame_rate)
+		t = numpy.arange(min(length, nframes - position)) / float(frame_rate)
+		syllables = 0.5 - 0.5 * numpy.cos(2 * numpy.pi * rng.uniform(3, 5) * t)
+		envelope[position:position + len(t)] = syllables
+		position += length + int(rng.uniform(1, 6) * frame_rate)
+	return envelope
+
+def generate_block(signal, rng, start_frame, nframes, frame_rate, nchannels):
+	'''
+	Return float samples in [-1, 1] shaped (nframes, nchannels)
+	'''
+	t = (start_frame + numpy.arange(nframes)) / float(frame_rate)
+	block = rng.normal(0, dbfs_to_amplitude(NOISE_FLOOR_DBFS), (nframes, nchannels))
+	if signal == 'tone':
+		block += 0.5 * numpy.sin(2 * numpy.pi * 440 * t)[:, numpy.newaxis]
+	elif signal == 'speech':
+		envelope = speech_envelope(rng, nframes, frame_rate)
+		voice = 0.3 * numpy.sin(2 * numpy.pi * 140 * t) + 0.15 * numpy.sin(2 * numpy.pi * 280 * t)
+		voice += rng.normal(0, 0.1, nframes)
+		# the talker moves between channels from burst to burst
+		channel = rng.randint(nchannels)
+		block[:, channel] += envelope * voice
+	elif signal != 'noise':
+		raise ValueError("Unknown signal {0!r}".format(signal))
+	return numpy.clip(block, -1, 1)
+
+def encode_block(block, sample_width):
+	'''
+	Encode float samples as little endian wave frame data
+	'''
+	full_scale = 2 ** (sample_width * 8 - 1) - 1
+	samples = numpy.round(block * full_scale).astype('<i4')
+	if sample_width == 1:
+		# 8 bit wave data is unsigned
+		return (samples + 128).astype(numpy.uint8).tobytes()
+	if sample_width == 3:
+		return samples.reshape(-1, 1).view(numpy.uint8)[:, :3].tobytes()
+	return samples.astype('<i{0}'.format(sample_width)).tobytes()
+
+def write_synthetic(filename, signal, frame_rate, sample_width, nchannels, seconds, seed=0):
+	'''
+	Write `seconds` of a synthetic `signal` to wave file `filename`
+
+	The file is generated in blocks, so any duration fits in memory.
+	'''
+	rng = numpy.random.RandomState(seed)
+	output = wave.open(filename, 'wb')
+	output.setparams((nchannels, sample_width, frame_rate, 0, 'NONE', 'not compressed'))
+	nframes = int(seconds * frame_rate)
+	block_frames = BLOCK_SECONDS * frame_rate
+	try:
+		for start_frame in range(0, nframes, block_frames):
+			block = generate_block(
+				signal, rng, start_frame, min(block_frames, nframes - start_frame), frame_rate, nchannels
+			)
+			output.writeframes(encode_block(block, sample_width))
+	finally:
+		output.close()
+
+if __name__ == '__main__':
+	if len(sys.argv) != 7:
+		sys.exit("usage: synthetic.py {0} RATE WIDTH CHANNELS SECONDS FILENAME".format('|'.join(SIGNALS)))
+	signal, frame_rate, sample_width, nchannels, seconds, filename = sys.argv[1:]
+	write_synthetic(filename, signal, int(frame_rate), int(sample_width), int(nchannels), float(seconds))